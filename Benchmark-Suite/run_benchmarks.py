@@ -0,0 +1,314 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# Bộ benchmark đầu-cuối chạy trong tiến trình (FastAPI TestClient, Streamlit chế độ bare),
+# dữ liệu lấy từ bộ sinh giả lập nên không cần file Online_Retail.xlsx.
+# Mỗi phần chạy trong một tiến trình con riêng vì các service đọc RETAIL_DATA_DIR lúc import.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BASE_DIR)
+WEB_SERVICES_DIR = os.path.join(REPO_DIR, "Web-Services")
+WEB_DIR = os.path.join(WEB_SERVICES_DIR, "Web")
+SENDER_DIR = os.path.join(REPO_DIR, "Data-Sender-Service")
+PREDICT_DIR = os.path.join(REPO_DIR, "Predict-Future-Trends")
+for path in (WEB_SERVICES_DIR, WEB_DIR, SENDER_DIR, PREDICT_DIR):
+    if path not in sys.path:
+        sys.path.append(path)
+
+DEFAULT_SCALES = "10000,1000000,10000000"
+SECTIONS = ("ingest", "api_data", "dashboard", "predict")
+SEED_CHUNK_ROWS = 1_000_000
+
+
+def percentile_metrics(prefix, samples_s):
+    samples_ms = np.asarray(samples_s) * 1000
+    return [
+        (f"{prefix}_p50", float(np.percentile(samples_ms, 50)), "ms"),
+        (f"{prefix}_p95", float(np.percentile(samples_ms, 95)), "ms"),
+    ]
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def api_frame(df):
+    # Cột Excel -> tên trường của /ingest (như send_data.build_payload)
+    from send_data import FIELD_NAMES
+    return df[list(FIELD_NAMES)].rename(columns=FIELD_NAMES)
+
+
+# ------------------------------------------------------------------ dữ liệu
+def seed_store(data_dir, rows, seed):
+    """
+    Nạp rows dòng giả lập thẳng vào bộ lưu trữ (segment + rollup + sketch top-K),
+    như trạng thái sau khi Web-Services đã nhận chừng ấy dữ liệu.
+    """
+    from segment_store import SegmentStore, frame_to_table
+    from rollups import RollupStore
+    from heavy_hitters import HeavyHitterStore
+    from synthetic_data import SyntheticRetail
+
+    store = SegmentStore(data_dir)
+    rollups = RollupStore(data_dir)
+    heavy_hitters = HeavyHitterStore(data_dir)
+    for chunk in SyntheticRetail(seed=seed).iter_chunks(rows, SEED_CHUNK_ROWS):
+        table = frame_to_table(api_frame(chunk))
+        position = store.append_table(table)
+        typed = table.to_pandas()
+        rollups.apply(typed, position)
+        heavy_hitters.apply(typed, position)
+    rollups.flush()
+    heavy_hitters.flush()
+    store.close()
+
+
+# ------------------------------------------------------------ các phần đo
+def bench_ingest(data_dir, scale, args):
+    """
+    Thông lượng /ingest: gửi tuần tự các lô batch_size dòng qua TestClient.
+    """
+    from fastapi.testclient import TestClient
+    from send_data import build_payload
+    from synthetic_data import generate_dataset
+    import main
+
+    df = generate_dataset(args.ingest_rows, seed=args.seed)
+    bodies = [build_payload(df.iloc[i:i + args.batch_size]).encode("utf-8")
+              for i in range(0, len(df), args.batch_size)]
+    latencies = []
+    with TestClient(main.app) as client:
+        started = time.perf_counter()
+        for body in bodies:
+            begin = time.perf_counter()
+            res = client.post("/ingest", content=body, headers={"Content-Type": "application/json"})
+            latencies.append(time.perf_counter() - begin)
+            res.raise_for_status()
+        elapsed = time.perf_counter() - started
+    return [("rows_per_s", len(df) / elapsed, "rows/s")] + percentile_metrics("request", latencies)
+
+
+def bench_api_data(data_dir, scale, args):
+    """
+    Độ trễ /api/data (đọc đuôi dữ liệu cho biểu đồ realtime) theo kích thước lịch sử.
+    """
+    from fastapi.testclient import TestClient
+    import main
+
+    results = []
+    with TestClient(main.app) as client:
+        for n in (20, 1000):
+            samples = []
+            for _ in range(args.repeats):
+                _, elapsed = timed(client.get, "/api/data", params={"n": n})
+                samples.append(elapsed)
+            results += percentile_metrics(f"n{n}", samples)
+    return results
+
+
+def bench_dashboard(data_dir, scale, args):
+    """
+    Thời gian dựng hai trang dashboard (Streamlit chạy không giao diện). Các trang truy vấn qua
+    QueryClient chạy cục bộ trên thư mục dữ liệu (cùng mã với /api/query), nên đo cả phần tổng hợp.
+    """
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    from query_client import QueryClient
+    from Page.sales_quantity_products import render_chart_page_sales
+    from Page.customers_and_countries import render_chart_page_customers
+
+    client = QueryClient(None, data_dir)
+    _, bounds_s = timed(client.bounds)
+    _, sales_s = timed(render_chart_page_sales, client)
+    _, customers_s = timed(render_chart_page_customers, client)
+    return [
+        ("bounds_s", bounds_s, "s"),
+        ("render_sales_s", sales_s, "s"),
+        ("render_customers_s", customers_s, "s"),
+    ]
+
+
+def bench_predict(data_dir, scale, args):
+    """
+    Độ trễ từng endpoint của main_api: lần đầu (tính thật) và lần hai (từ cache).
+    """
+    os.environ.setdefault("JOB_SYNC_WAIT", str(args.predict_timeout))
+    from fastapi.testclient import TestClient
+    import main_api
+
+    wait = {"wait": args.predict_timeout}
+    endpoints = [
+        ("predict_sales_holt_winters", "/predict_sales/", {"model": "holt_winters"}, wait),
+        ("predict_sales_holt_winters_hourly", "/predict_sales/", {"model": "holt_winters", "freq": "h", "periods": 24}, wait),
+        ("predict_sales_prophet", "/predict_sales/", {"periods": 7}, wait),
+        ("recommend_products", "/recommend_products/", None, dict(wait, min_support=0.01, min_confidence=0.3)),
+        ("recommend_for_items", "/recommend_for_items/", {"stock_codes": ["20000", "20001"]}, wait),
+        ("segment_customers", "/segment_customers/", None, dict(wait, n_clusters=4)),
+        ("predict_sales_batch", "/predict_sales/batch/", {"limit": 20, "model": "holt_winters"}, None),
+    ]
+    results = []
+    with TestClient(main_api.app) as client:
+        for name, path, body, params in endpoints:
+            for attempt in ("cold", "warm"):
+                res, elapsed = timed(client.post, path, json=body, params=params)
+                results.append((f"{name}_{attempt}_s", elapsed, "s"))
+                if res.status_code != 200:
+                    results.append((f"{name}_{attempt}_status", res.status_code, "http"))
+    return results
+
+
+BENCHMARKS = {
+    "ingest": bench_ingest,
+    "api_data": bench_api_data,
+    "dashboard": bench_dashboard,
+    "predict": bench_predict,
+}
+
+
+# ------------------------------------------------------------- điều phối
+def run_section(section, data_dir, scale, args):
+    """
+    Chạy một phần trong tiến trình con; trả về danh sách kết quả (hoặc lỗi).
+    """
+    command = [sys.executable, os.path.abspath(__file__), "--section", section, "--data-dir", data_dir,
+               "--scale", str(scale), "--seed", str(args.seed), "--repeats", str(args.repeats),
+               "--ingest-rows", str(args.ingest_rows), "--batch-size", str(args.batch_size),
+               "--predict-timeout", str(args.predict_timeout)]
+    env = dict(os.environ, RETAIL_DATA_DIR=data_dir, COMPACT_INTERVAL="3600")
+    proc = subprocess.run(command, env=env, capture_output=True, text=True)
+    lines = [line for line in proc.stdout.splitlines() if line.startswith("{")]
+    if proc.returncode != 0 or not lines:
+        error = (proc.stderr.strip().splitlines() or ["không có kết quả"])[-1]
+        return [{"section": section, "scale": scale, "metric": "error", "value": None, "unit": None, "error": error}]
+    payload = json.loads(lines[-1])
+    if "error" in payload:
+        return [{"section": section, "scale": scale, "metric": "error", "value": None, "unit": None,
+                 "error": payload["error"]}]
+    return [{"section": section, "scale": scale, "metric": m, "value": round(v, 6) if isinstance(v, float) else v,
+             "unit": u} for m, v, u in payload["results"]]
+
+
+def run_worker(args):
+    try:
+        results = BENCHMARKS[args.section](args.data_dir, args.scale, args)
+        print(json.dumps({"results": results}))
+    except Exception as e:
+        print(json.dumps({"error": f"{type(e).__name__}: {e}"}))
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path, threshold):
+    """
+    So với một file kết quả cũ: in tỉ lệ thay đổi, trả về số chỉ số xấu đi quá threshold.
+    """
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {(r["section"], r["scale"], r["metric"]): r for r in json.load(f)["results"]}
+    regressions = 0
+    for result in results:
+        old = baseline.get((result["section"], result["scale"], result["metric"]))
+        if old is None or not old.get("value") or result["value"] is None or result["unit"] == "http":
+            continue
+        ratio = result["value"] / old["value"]
+        worse = ratio < 1 - threshold if result["unit"] == "rows/s" else ratio > 1 + threshold
+        regressions += worse
+        flag = "❌" if worse else "  "
+        print(f"{flag} {result['section']:>10} {result['scale']:>10} {result['metric']:<40} "
+              f"{old['value']:>12.4f} -> {result['value']:>12.4f} {result['unit']:<6} x{ratio:.2f}")
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark đầu-cuối: ingest, /api/data, dashboard, main_api")
+    parser.add_argument("--scales", default=DEFAULT_SCALES, help="Số dòng lịch sử, phân tách bằng dấu phẩy")
+    parser.add_argument("--sections", default=",".join(SECTIONS))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeats", type=int, default=50, help="Số lần gọi mỗi phép đo độ trễ")
+    parser.add_argument("--ingest-rows", type=int, default=200_000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--predict-timeout", type=float, default=1800)
+    parser.add_argument("--workdir", help="Thư mục chứa dữ liệu sinh ra (mặc định: thư mục tạm)")
+    parser.add_argument("--output", help="File JSON kết quả (mặc định: results/benchmark-<thời gian>.json)")
+    parser.add_argument("--baseline", help="File kết quả cũ để so sánh")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Ngưỡng xấu đi (tương đối) khi so sánh")
+    # Dùng nội bộ khi chạy một phần trong tiến trình con
+    parser.add_argument("--section", help=argparse.SUPPRESS)
+    parser.add_argument("--data-dir", help=argparse.SUPPRESS)
+    parser.add_argument("--scale", type=int, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.section:
+        run_worker(args)
+        return
+
+    sections = [s.strip() for s in args.sections.split(",") if s.strip()]
+    scales = [int(s) for s in args.scales.split(",") if s.strip()]
+    workdir = args.workdir or tempfile.mkdtemp(prefix="retail-bench-")
+    results = []
+
+    if "ingest" in sections:
+        data_dir = os.path.join(workdir, "ingest")
+        os.makedirs(data_dir, exist_ok=True)
+        print(f"⏱️ ingest: {args.ingest_rows:,} dòng, lô {args.batch_size}")
+        results += run_section("ingest", data_dir, args.ingest_rows, args)
+
+    for scale in scales:
+        data_dir = os.path.join(workdir, f"rows-{scale}")
+        os.makedirs(data_dir, exist_ok=True)
+        print(f"📥 Sinh {scale:,} dòng vào {data_dir} ...")
+        _, seed_s = timed(seed_store, data_dir, scale, args.seed)
+        results.append({"section": "seed", "scale": scale, "metric": "seed_s", "value": round(seed_s, 6), "unit": "s"})
+        for section in sections:
+            if section == "ingest":
+                continue
+            print(f"⏱️ {section} @ {scale:,} dòng")
+            results += run_section(section, data_dir, scale, args)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("section", "data_dir", "scale")},
+        },
+        "results": results,
+    }
+    output = args.output or os.path.join(BASE_DIR, "results", time.strftime("benchmark-%Y%m%d-%H%M%S.json"))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"✅ Đã ghi {len(results)} kết quả -> {output}")
+
+    for result in results:
+        if result["metric"] == "error":
+            print(f"⚠️ {result['section']} @ {result['scale']:,}: {result['error']}")
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.threshold)
+        if regressions:
+            print(f"❌ {regressions} chỉ số xấu đi quá {args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
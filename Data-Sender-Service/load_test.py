@@ -0,0 +1,177 @@
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+
+import aiohttp
+import numpy as np
+
+from send_data import API_ENDPOINT, CACHE_PATH, EXCEL_PATH, build_payload, load_dataset
+
+# Số body khác nhau được mã hoá sẵn trước khi chạy (tránh client tự trở thành nút thắt CPU)
+PAYLOAD_POOL_SIZE = 200
+
+
+def build_payload_pool(df, batch_size, pool_size=PAYLOAD_POOL_SIZE):
+    bodies = []
+    for start in range(0, min(len(df), batch_size * pool_size), batch_size):
+        group = df.iloc[start:start + batch_size]
+        bodies.append((build_payload(group).encode("utf-8"), len(group)))
+    return bodies
+
+
+class LoadTest:
+    """
+    N sender asyncio chạy song song trên một connection pool, gửi lô tới /ingest
+    theo tốc độ mục tiêu (dòng/giây, 0 = không giới hạn), thử lại với backoff luỹ thừa.
+    """
+
+    def __init__(self, endpoint, bodies, concurrency=8, target_rate=0.0, duration=30.0,
+                 max_requests=None, retries=3, backoff=0.2, timeout=30.0):
+        self.endpoint = endpoint
+        self.bodies = itertools.cycle(bodies)
+        self.concurrency = concurrency
+        self.batch_size = bodies[0][1]
+        self.target_rate = target_rate
+        self.duration = duration
+        self.max_requests = max_requests
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        self.slots = itertools.count()
+        self.latencies = []
+        self.errors = Counter()
+        self.rows_sent = 0
+        self.rows_accepted = 0
+        self.requests_ok = 0
+        self.retry_count = 0
+
+    def next_slot(self, started):
+        """
+        Lấy lượt gửi tiếp theo; trả về thời điểm được phép gửi hoặc None khi đã hết.
+        """
+        slot = next(self.slots)
+        if self.max_requests is not None and slot >= self.max_requests:
+            return None
+        if self.target_rate > 0:
+            send_at = started + slot * self.batch_size / self.target_rate
+        else:
+            send_at = time.perf_counter()
+        if send_at - started >= self.duration:
+            return None
+        return send_at
+
+    async def send(self, session, body, rows):
+        for attempt in range(self.retries + 1):
+            begin = time.perf_counter()
+            try:
+                async with session.post(self.endpoint, data=body) as res:
+                    if res.status == 200:
+                        try:
+                            payload = await res.json(content_type=None)
+                        except ValueError:
+                            payload = None
+                        if not isinstance(payload, dict) or "skipped" not in payload:
+                            # 200 nhưng không phải kết quả ghi (body không phải JSON, hoặc "Dữ liệu không hợp lệ")
+                            self.errors["invalid_response" if payload is None else "rejected"] += 1
+                            self.errors["failed_requests"] += 1
+                            return
+                        self.latencies.append(time.perf_counter() - begin)
+                        self.requests_ok += 1
+                        self.rows_sent += rows
+                        self.rows_accepted += rows - int(payload.get("skipped", 0))
+                        return
+                    self.errors[f"http_{res.status}"] += 1
+                    retryable = res.status in (429, 502, 503, 504)
+            except asyncio.TimeoutError:
+                self.errors["timeout"] += 1
+                retryable = True
+            except aiohttp.ClientError as e:
+                self.errors[type(e).__name__] += 1
+                retryable = True
+
+            if not retryable or attempt == self.retries:
+                self.errors["failed_requests"] += 1
+                return
+            self.retry_count += 1
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    async def sender(self, session, started):
+        while True:
+            send_at = self.next_slot(started)
+            if send_at is None:
+                return
+            delay = send_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            body, rows = next(self.bodies)
+            await self.send(session, body, rows)
+
+    async def run(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        headers = {"Content-Type": "application/json"}
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=headers) as session:
+            started = time.perf_counter()
+            await asyncio.gather(*(self.sender(session, started) for _ in range(self.concurrency)))
+            elapsed = time.perf_counter() - started
+        return self.summary(elapsed)
+
+    def summary(self, elapsed):
+        latencies_ms = np.array(self.latencies) * 1000
+        percentiles = {}
+        if len(latencies_ms):
+            for p in (50, 95, 99):
+                percentiles[f"p{p}_ms"] = round(float(np.percentile(latencies_ms, p)), 2)
+            percentiles["max_ms"] = round(float(latencies_ms.max()), 2)
+        return {
+            "endpoint": self.endpoint,
+            "concurrency": self.concurrency,
+            "batch_size": self.batch_size,
+            "target_rows_per_s": self.target_rate,
+            "duration_s": round(elapsed, 3),
+            "requests_ok": self.requests_ok,
+            "rows_sent": self.rows_sent,
+            "rows_accepted": self.rows_accepted,
+            "rows_per_s": round(self.rows_sent / elapsed, 1) if elapsed else 0.0,
+            "latency": percentiles,
+            "retries": self.retry_count,
+            "errors": dict(self.errors),
+        }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Đo tải /ingest: thông lượng và độ trễ")
+    parser.add_argument("--endpoint", default=API_ENDPOINT)
+    parser.add_argument("--excel", default=EXCEL_PATH)
+    parser.add_argument("--cache", default=CACHE_PATH)
+    parser.add_argument("--concurrency", type=int, default=8, help="Số sender chạy song song")
+    parser.add_argument("--batch-size", type=int, default=500, help="Số dòng mỗi request")
+    parser.add_argument("--rate", type=float, default=0.0, help="Tốc độ mục tiêu (dòng/giây), 0 = tối đa")
+    parser.add_argument("--duration", type=float, default=30.0, help="Thời gian chạy (giây)")
+    parser.add_argument("--requests", type=int, default=None, help="Dừng sau số request này")
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--output", help="Ghi báo cáo JSON ra file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    df = load_dataset(args.excel, args.cache)
+    bodies = build_payload_pool(df, args.batch_size)
+
+    test = LoadTest(args.endpoint, bodies, concurrency=args.concurrency, target_rate=args.rate,
+                    duration=args.duration, max_requests=args.requests, retries=args.retries)
+    report = asyncio.run(test.run())
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
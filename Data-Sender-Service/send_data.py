@@ -1,43 +1,166 @@
+import argparse
+import os
 import time
-import requests
+
+import numpy as np
 import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # Cấu hình
 API_ENDPOINT = "http://localhost:8000/ingest"  # Đầu nhận dữ liệu
+EXCEL_PATH = "Data/Online_Retail.xlsx"
+CACHE_PATH = "Data/Online_Retail.parquet"      # Bản chuyển đổi nhị phân, tránh parse xlsx mỗi lần chạy
+
+# Tên cột trong file Excel -> tên trường gửi lên /ingest
+FIELD_NAMES = {
+    "InvoiceNo": "invoiceNo",
+    "StockCode": "stockCode",
+    "Description": "description",
+    "Quantity": "quantity",
+    "UnitPrice": "unitPrice",
+    "InvoiceDate": "invoiceDate",
+    "CustomerID": "customerID",
+    "Country": "country",
+}
+
+
+def load_dataset(excel_path=EXCEL_PATH, cache_path=CACHE_PATH):
+    """
+    Đọc dữ liệu gốc, dùng bản Parquet đã cache nếu nó mới hơn file Excel.
+    Trả về DataFrame đã chuẩn hoá kiểu, sắp theo InvoiceDate, kèm cột InvoiceMinute.
+    """
+    if os.path.exists(cache_path) and (
+        not os.path.exists(excel_path) or os.path.getmtime(cache_path) >= os.path.getmtime(excel_path)
+    ):
+        return pd.read_parquet(cache_path)
+
+    print(f"📥 Đọc {excel_path} và tạo cache {cache_path} ...")
+    df = pd.read_excel(excel_path)
+
+    # Xử lý thời gian: cắt về phút
+    df["InvoiceDate"] = pd.to_datetime(df["InvoiceDate"])
+    df["InvoiceMinute"] = df["InvoiceDate"].dt.floor("min")
+    for column in ["InvoiceNo", "StockCode", "Description", "CustomerID", "Country"]:
+        df[column] = df[column].astype(str)
+    df = df.sort_values("InvoiceDate", kind="stable").reset_index(drop=True)
+
+    df.to_parquet(cache_path, index=False)
+    return df
+
+
+def build_payload(group):
+    """
+    Tạo body JSON cho cả nhóm dòng bằng thao tác theo cột (không iterrows).
+    """
+    payload = group[list(FIELD_NAMES)].rename(columns=FIELD_NAMES)
+    payload = payload.assign(
+        quantity=payload["quantity"].astype("int64"),
+        unitPrice=payload["unitPrice"].astype("float64"),
+        invoiceDate=payload["invoiceDate"].dt.strftime("%Y-%m-%d %H:%M:%S"),
+    )
+    return payload.to_json(orient="records", force_ascii=False)
+
+
+def create_session(pool_size=4):
+    # Session dùng chung: giữ kết nối keep-alive, tự thử lại khi server tạm lỗi
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504], allowed_methods=["POST"])
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"Content-Type": "application/json"})
+    return session
+
+
+def iter_batches(df, batch_rows):
+    """
+    Gom các phút liên tiếp thành lô tối đa batch_rows dòng (mỗi phút luôn nằm trọn trong một lô).
+    Trả về (phút đầu, phút cuối, DataFrame).
+    """
+    if df.empty:
+        return
+    minutes = df["InvoiceMinute"].to_numpy()
+    # Vị trí bắt đầu của mỗi phút (df đã sắp theo thời gian)
+    starts = np.concatenate([[0], np.flatnonzero(minutes[1:] != minutes[:-1]) + 1, [len(minutes)]])
+    begin = 0
+    for index in range(1, len(starts)):
+        end = starts[index]
+        is_last = index == len(starts) - 1
+        if is_last or starts[index + 1] - starts[begin] > batch_rows:
+            yield minutes[starts[begin]], minutes[end - 1], df.iloc[starts[begin]:end]
+            begin = index
+
+
+def replay(df, endpoint=API_ENDPOINT, speed=60.0, max_sleep=None, batch_rows=1, session=None):
+    """
+    Phát lại dữ liệu theo thời gian hoá đơn.
+    speed: số giây dữ liệu trên mỗi giây thực (60 = mỗi phút dữ liệu một giây, 0 = nhanh nhất có thể).
+    max_sleep: thời gian chờ tối đa giữa hai lần gửi (bỏ qua khoảng trống ban đêm); None = không giới hạn.
+    """
+    session = session or create_session()
+    sent_rows = 0
+    started = time.perf_counter()
+    next_send = started
+    previous_minute = None
+
+    for first_minute, last_minute, group in iter_batches(df, batch_rows):
+        # Lên lịch theo thời điểm tuyệt đối để thời gian gửi không cộng dồn độ trễ
+        if speed > 0 and previous_minute is not None:
+            gap = pd.Timedelta(first_minute - previous_minute).total_seconds()
+            wait = gap / speed
+            next_send += wait if max_sleep is None else min(wait, max_sleep)
+            delay = next_send - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        previous_minute = last_minute
+
+        print(f"\n⏱️ Gửi {len(group)} dòng cho phút: {pd.Timestamp(first_minute)}")
+        try:
+            res = session.post(endpoint, data=build_payload(group).encode("utf-8"))
+            if 200 <= res.status_code < 300:
+                print(f"✅ Đã gửi {len(group)} dòng | Status: {res.status_code}")
+                sent_rows += len(group)
+            else:
+                print(f"❌ Server từ chối {len(group)} dòng | Status: {res.status_code}")
+        except Exception as e:
+            print("❌ Lỗi khi gửi:", e)
+
+    elapsed = time.perf_counter() - started
+    print(f"\n🏁 Đã gửi {sent_rows} dòng trong {elapsed:.1f}s ({sent_rows / max(elapsed, 1e-9):,.0f} dòng/s)")
+    return sent_rows
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Phát lại dữ liệu Online Retail tới /ingest")
+    parser.add_argument("--endpoint", default=API_ENDPOINT)
+    parser.add_argument("--excel", default=EXCEL_PATH)
+    parser.add_argument("--cache", default=CACHE_PATH)
+    parser.add_argument("--speed", type=float, default=60.0,
+                        help="Giây dữ liệu trên mỗi giây thực; 1 = thời gian thực, 0 = nhanh nhất có thể")
+    parser.add_argument("--max-sleep", type=float, default=None,
+                        help="Chờ tối đa giữa hai lần gửi (giây), để bỏ qua khoảng trống ban đêm; mặc định không giới hạn")
+    parser.add_argument("--batch-rows", type=int, default=None,
+                        help="Gom nhiều phút vào một lần gửi (mặc định: 1 phút/lần, hoặc 5000 dòng khi --speed 0)")
+    parser.add_argument("--start", help="Chỉ phát lại từ thời điểm này, ví dụ 2011-01-01")
+    parser.add_argument("--end", help="Chỉ phát lại tới thời điểm này")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    df = load_dataset(args.excel, args.cache)
+
+    # Chọn khoảng thời gian
+    if args.start:
+        df = df[df["InvoiceDate"] >= pd.Timestamp(args.start)]
+    if args.end:
+        df = df[df["InvoiceDate"] <= pd.Timestamp(args.end)]
+
+    batch_rows = args.batch_rows or (5000 if args.speed == 0 else 1)
+    replay(df, args.endpoint, args.speed, args.max_sleep, batch_rows)
+
 
-# Đọc dữ liệu từ Excel
-df = pd.read_excel("Data/Online_Retail.xlsx")
-
-# Xử lý thời gian: cắt về phút
-df["InvoiceDate"] = pd.to_datetime(df["InvoiceDate"])
-df["InvoiceMinute"] = df["InvoiceDate"].dt.floor("min")
-
-# Nhóm dữ liệu theo từng phút
-grouped = df.groupby("InvoiceMinute")
-
-# Gửi dữ liệu theo từng phút
-for invoice_minute, group in grouped:
-    print(f"\n⏱️ Gửi {len(group)} dòng cho phút: {invoice_minute}")
-
-    payloads = []
-    for _, row in group.iterrows():
-        payloads.append({
-            "invoiceNo": row["InvoiceNo"],
-            "stockCode": str(row["StockCode"]),
-            "description": str(row["Description"]),
-            "quantity": int(row["Quantity"]),
-            "unitPrice": float(row["UnitPrice"]),
-            "invoiceDate": row["InvoiceDate"].strftime("%Y-%m-%d %H:%M:%S"),
-            "customerID": str(row["CustomerID"]),
-            "country": row["Country"]
-        })
-
-    # Gửi tất cả dòng trong phút đó cùng lúc
-    try:
-        res = requests.post(API_ENDPOINT, json=payloads)
-        print(f"✅ Đã gửi {len(payloads)} dòng | Status: {res.status_code}")
-    except Exception as e:
-        print("❌ Lỗi khi gửi:", e)
-
-    # Đợi 1 giây rồi mới gửi phút tiếp theo
-    time.sleep(1)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import argparse
+import itertools
+import os
+
+import numpy as np
+import pandas as pd
+
+# Bộ sinh dữ liệu Online Retail giả lập, cùng cột với file Excel gốc (xem send_data.load_dataset).
+# Cùng seed + cùng tham số luôn cho cùng dữ liệu, kể cả khi sinh theo nhiều khối liên tiếp.
+
+ADJECTIVES = ["WHITE", "RED", "VINTAGE", "PINK", "BLUE", "GREEN", "HANGING", "JUMBO", "SET OF 3", "REGENCY",
+              "HEART", "GLASS", "WOODEN", "PAPER", "RETROSPOT", "FELTCRAFT", "LARGE", "SMALL", "ROUND", "ANTIQUE"]
+NOUNS = ["T-LIGHT HOLDER", "LANTERN", "BAG", "MUG", "CAKE CASES", "BUNTING", "DOORMAT", "CUSHION COVER",
+         "LUNCH BOX", "CANDLE", "CLOCK", "TEACUP", "NAPKINS", "WATER BOTTLE", "PHOTO FRAME", "GARLAND"]
+COUNTRIES = ["United Kingdom", "Germany", "France", "EIRE", "Spain", "Netherlands", "Belgium", "Switzerland",
+             "Portugal", "Australia", "Norway", "Italy", "Channel Islands", "Finland", "Cyprus", "Sweden",
+             "Austria", "Denmark", "Japan", "Poland", "Israel", "USA", "Hong Kong", "Singapore", "Iceland",
+             "Canada", "Greece", "Malta", "United Arab Emirates", "European Community", "RSA", "Lebanon",
+             "Lithuania", "Brazil", "Czech Republic", "Bahrain", "Saudi Arabia", "Unspecified"]
+
+
+def zipf_weights(n, skew):
+    weights = 1.0 / np.arange(1, n + 1) ** skew
+    return weights / weights.sum()
+
+
+class SyntheticRetail:
+    """
+    Sinh hoá đơn theo thời gian: mỗi hoá đơn có một khách hàng (hoặc thiếu mã khách),
+    số dòng theo phân phối hình học, sản phẩm chọn theo phân phối Zipf (skew càng lớn càng lệch).
+    Gọi generate() nhiều lần sẽ sinh tiếp (số hoá đơn, thời gian nối tiếp lần trước).
+    """
+
+    def __init__(self, seed=0, products=4000, customers=4300, skew=1.1, lines_per_invoice=20,
+                 cancel_rate=0.02, missing_customer_rate=0.25, invoice_interval=60.0,
+                 start="2010-12-01 08:00:00"):
+        self.seed = seed
+        self.skew = skew
+        self.lines_per_invoice = lines_per_invoice
+        self.cancel_rate = cancel_rate
+        self.missing_customer_rate = missing_customer_rate
+        self.invoice_interval = invoice_interval
+        self.chunks = itertools.count()
+        self.next_invoice = 536365
+        self.clock = pd.Timestamp(start).value // 10**9  # giây
+
+        rng = np.random.default_rng([seed, 0])
+        # Danh mục sản phẩm: mã, mô tả, giá gốc
+        self.stock_codes = np.array([f"{20000 + i}" for i in range(products)], dtype=object)
+        names = [f"{a} {n}" for a, n in itertools.product(ADJECTIVES, NOUNS)]
+        self.descriptions = np.array([f"{names[i % len(names)]} {i // len(names) + 1}" for i in range(products)],
+                                     dtype=object)
+        self.prices = np.round(rng.lognormal(mean=0.8, sigma=0.8, size=products), 2) + 0.05
+        self.product_weights = zipf_weights(products, skew)
+
+        # Khách hàng: mã dạng số thực như file gốc ("17850.0"), quốc gia lệch mạnh về United Kingdom
+        self.customer_ids = np.array([f"{12346 + i}.0" for i in range(customers)], dtype=object)
+        self.customer_countries = rng.choice(len(COUNTRIES), size=customers, p=zipf_weights(len(COUNTRIES), 2.5))
+        self.customer_weights = zipf_weights(customers, 0.8)
+
+    def generate(self, rows):
+        """
+        Sinh thêm rows dòng. Trả về DataFrame cùng cột với send_data.load_dataset (kèm InvoiceMinute).
+        """
+        rng = np.random.default_rng([self.seed, 1, next(self.chunks)])
+
+        # Số dòng của từng hoá đơn, cắt cho đủ đúng rows dòng
+        lines = rng.geometric(1.0 / self.lines_per_invoice, size=rows // self.lines_per_invoice * 2 + 16)
+        while lines.sum() < rows:
+            lines = np.concatenate([lines, rng.geometric(1.0 / self.lines_per_invoice, size=len(lines))])
+        n_invoices = int(np.searchsorted(np.cumsum(lines), rows)) + 1
+        invoice_of_row = np.repeat(np.arange(n_invoices), lines[:n_invoices])[:rows]
+
+        # Thuộc tính theo hoá đơn
+        invoice_numbers = self.next_invoice + np.arange(n_invoices)
+        cancelled = rng.random(n_invoices) < self.cancel_rate
+        customers = rng.choice(len(self.customer_ids), size=n_invoices, p=self.customer_weights)
+        missing = rng.random(n_invoices) < self.missing_customer_rate
+        seconds = self.clock + np.cumsum(rng.exponential(self.invoice_interval, size=n_invoices)).astype("int64")
+        self.next_invoice += n_invoices
+        self.clock = int(seconds[-1])
+
+        invoice_no = np.char.add(np.where(cancelled, "C", ""), invoice_numbers.astype(str))
+        customer_id = np.where(missing, "nan", self.customer_ids[customers].astype(str))
+        country = np.array(COUNTRIES, dtype=object)[self.customer_countries[customers]]
+        dates = pd.to_datetime(seconds, unit="s").floor("min")
+
+        # Thuộc tính theo dòng
+        products = rng.choice(len(self.stock_codes), size=rows, p=self.product_weights)
+        quantity = rng.geometric(0.25, size=rows) * rng.choice([1, 1, 1, 2, 6, 12], size=rows)
+        quantity = np.where(cancelled[invoice_of_row], -quantity, quantity)
+
+        df = pd.DataFrame({
+            "InvoiceNo": invoice_no[invoice_of_row].astype(object),
+            "StockCode": self.stock_codes[products],
+            "Description": self.descriptions[products],
+            "Quantity": quantity.astype("int64"),
+            "InvoiceDate": dates[invoice_of_row],
+            "UnitPrice": self.prices[products],
+            "CustomerID": customer_id[invoice_of_row].astype(object),
+            "Country": country[invoice_of_row],
+        })
+        df["InvoiceMinute"] = df["InvoiceDate"]
+        return df
+
+    def iter_chunks(self, rows, chunk_rows=1_000_000):
+        remaining = rows
+        while remaining > 0:
+            size = min(chunk_rows, remaining)
+            remaining -= size
+            yield self.generate(size)
+
+
+def generate_dataset(rows, seed=0, **options):
+    return SyntheticRetail(seed=seed, **options).generate(rows)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Sinh dữ liệu Online Retail giả lập (Parquet, dùng được làm --cache)")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--products", type=int, default=4000)
+    parser.add_argument("--customers", type=int, default=4300)
+    parser.add_argument("--skew", type=float, default=1.1, help="Độ lệch Zipf của độ phổ biến sản phẩm")
+    parser.add_argument("--output", default="Data/Online_Retail_synthetic.parquet")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    df = generate_dataset(args.rows, seed=args.seed, products=args.products,
+                          customers=args.customers, skew=args.skew)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    df.to_parquet(args.output, index=False)
+    print(f"✅ Đã sinh {len(df):,} dòng, {df['InvoiceNo'].nunique():,} hoá đơn -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.environ.get("RETAIL_DATA_DIR", os.path.join(BASE_DIR, "..", "Web-Services", "Web"))
+sys.path.append(os.path.join(BASE_DIR, "..", "Web-Services", "Web"))
+
+from fast_forecast import FREQUENCIES, MODELS, fast_forecast, load_series
+
+
+def predict(model, train, horizon, freq):
+    if model == "prophet":
+        # Import khi cần: Prophet nặng và không bắt buộc để so sánh các mô hình nhanh
+        from models.forecasting import predict_sales_with_prophet
+        forecast_df, _ = predict_sales_with_prophet(train, periods=horizon)
+        return forecast_df[forecast_df["ds"] > train["ds"].max()]["yhat"].to_numpy()[:horizon]
+    return fast_forecast(train, horizon, model, freq)["yhat"].to_numpy()
+
+
+def backtest(series, models, horizon, folds, freq):
+    """
+    Đánh giá rolling-origin: folds điểm cắt cuối chuỗi, mỗi lần train trên phần trước điểm cắt
+    và dự đoán horizon bước tiếp theo. Trả về sai số (MAE, RMSE, sMAPE) và thời gian fit theo mô hình.
+    """
+    if len(series) < horizon * (folds + 1):
+        raise ValueError(f"Chuỗi chỉ có {len(series)} điểm, cần ít nhất {horizon * (folds + 1)}")
+    cuts = [len(series) - horizon * (fold + 1) for fold in reversed(range(folds))]
+
+    report = {}
+    for model in models:
+        errors, actuals, predictions, fit_ms = [], [], [], []
+        for cut in cuts:
+            train = series.iloc[:cut].reset_index(drop=True)
+            actual = series["y"].to_numpy()[cut:cut + horizon]
+            started = time.perf_counter()
+            yhat = predict(model, train, horizon, freq)
+            fit_ms.append((time.perf_counter() - started) * 1000)
+            errors.append(actual - yhat)
+            actuals.append(actual)
+            predictions.append(yhat)
+
+        error = np.concatenate(errors)
+        actual = np.concatenate(actuals)
+        prediction = np.concatenate(predictions)
+        denominator = np.abs(actual) + np.abs(prediction)
+        smape = np.where(denominator > 0, 2 * np.abs(error) / np.where(denominator > 0, denominator, 1), 0.0)
+        report[model] = {
+            "mae": round(float(np.abs(error).mean()), 4),
+            "rmse": round(float(np.sqrt((error ** 2).mean())), 4),
+            "smape": round(float(smape.mean()), 4),
+            "fit_ms_mean": round(float(np.mean(fit_ms)), 3),
+            "fit_ms_max": round(float(np.max(fit_ms)), 3),
+        }
+    return report
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="So sánh độ chính xác và thời gian fit giữa các mô hình dự đoán")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--freq", default="D", choices=list(FREQUENCIES))
+    parser.add_argument("--models", default=",".join(MODELS), help="Danh sách mô hình, phân tách bằng dấu phẩy")
+    parser.add_argument("--horizon", type=int, default=7, help="Số bước dự đoán mỗi lần")
+    parser.add_argument("--folds", type=int, default=5, help="Số điểm cắt rolling-origin")
+    parser.add_argument("--window-days", type=float, default=None, help="Chỉ dùng lịch sử gần đây (ngày)")
+    parser.add_argument("--country")
+    parser.add_argument("--stock-code")
+    parser.add_argument("--output", help="Ghi báo cáo JSON ra file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    models = [model.strip() for model in args.models.split(",") if model.strip()]
+    unknown = [model for model in models if model not in MODELS]
+    if unknown:
+        raise SystemExit(f"Mô hình không hợp lệ: {unknown}")
+    if args.freq != "D" and "prophet" in models:
+        models.remove("prophet")
+        print("⚠️ Bỏ qua prophet: chỉ so sánh theo ngày (freq=D)")
+
+    window = pd.Timedelta(days=args.window_days) if args.window_days else None
+    series = load_series(args.data_dir, args.freq, window, args.country, args.stock_code)
+    report = {
+        "freq": args.freq,
+        "horizon": args.horizon,
+        "folds": args.folds,
+        "points": len(series),
+        "models": backtest(series, models, args.horizon, args.folds, args.freq),
+    }
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
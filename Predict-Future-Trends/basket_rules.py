@@ -0,0 +1,249 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+# Số bộ luật (theo ngưỡng support/confidence) giữ sẵn trong bộ nhớ
+RULE_INDEX_CACHE = int(os.environ.get("RULE_INDEX_CACHE", 8))
+# Cột có thể dùng để sắp bảng luật trả về (giảm dần, cùng giá trị thì lift cao hơn trước)
+RULE_SORTS = ("lift", "confidence", "support")
+
+
+class BasketState:
+    """
+    Ma trận giỏ hàng thưa X (hoá đơn x sản phẩm, CSR) và ma trận đếm cặp C = X^T X,
+    cập nhật tăng dần: với D là các cặp (hoá đơn, sản phẩm) mới,
+    C' = C + D^T X + X^T D + D^T D (hoá đơn trải qua nhiều lô vẫn được đếm đúng).
+    Đường chéo của C là số hoá đơn chứa từng sản phẩm.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.generation = None
+        self.reset()
+
+    def reset(self):
+        self.invoices = {}   # invoiceNo -> dòng
+        self.items = {}      # stockCode -> cột
+        self.item_codes = []
+        self.descriptions = {}
+        self.X = sp.csr_matrix((0, 0), dtype=np.int32)
+        self.C = sp.csr_matrix((0, 0), dtype=np.int32)
+        self.rows_applied = 0
+
+    @property
+    def version(self):
+        return self.generation, self.rows_applied
+
+    @property
+    def n_invoices(self):
+        return self.X.shape[0]
+
+    def update(self, raw, generation):
+        """
+        Cộng các dòng raw.iloc[rows_applied:]; dựng lại từ đầu nếu generation đổi.
+        """
+        with self.lock:
+            if generation != self.generation or len(raw) < self.rows_applied:
+                self.reset()
+                self.generation = generation
+            delta = raw.iloc[self.rows_applied:]
+            self.rows_applied = len(raw)
+            if not delta.empty:
+                self._apply(delta)
+            return len(delta)
+
+    @staticmethod
+    def _codes(mapping, values, names=None):
+        codes = np.empty(len(values), dtype=np.int64)
+        for i, value in enumerate(values):
+            code = mapping.get(value)
+            if code is None:
+                code = mapping[value] = len(mapping)
+                if names is not None:
+                    names.append(value)
+            codes[i] = code
+        return codes
+
+    def _apply(self, delta):
+        invoice = delta["invoiceNo"].astype(object).astype(str)
+        # Bỏ hoá đơn huỷ (mã bắt đầu bằng C) và dòng trả hàng
+        valid = (delta["quantity"] > 0) & ~invoice.str.startswith("C")
+        if not valid.any():
+            return
+        pairs = pd.DataFrame({
+            "invoiceNo": invoice[valid].to_numpy(),
+            "stockCode": delta["stockCode"][valid].astype(object).astype(str).to_numpy(),
+            "description": delta["description"][valid].astype(object).to_numpy(),
+        }).drop_duplicates(["invoiceNo", "stockCode"])
+
+        for code, description in pairs.drop_duplicates("stockCode")[["stockCode", "description"]].itertuples(index=False):
+            self.descriptions.setdefault(code, description)
+
+        # Chỉ mã hoá giá trị khác nhau, sau đó ánh xạ lại theo vị trí
+        invoice_values, invoice_inverse = np.unique(pairs["invoiceNo"].to_numpy(), return_inverse=True)
+        item_values, item_inverse = np.unique(pairs["stockCode"].to_numpy(), return_inverse=True)
+        rows = self._codes(self.invoices, invoice_values)[invoice_inverse]
+        cols = self._codes(self.items, item_values, self.item_codes)[item_inverse]
+
+        shape = (len(self.invoices), len(self.items))
+        X = self._resize(self.X, shape)
+        C = self._resize(self.C, (shape[1], shape[1]))
+
+        # Bỏ các cặp đã có trong X (hoá đơn đã gặp gửi lại cùng sản phẩm)
+        old_rows = rows < self.X.shape[0]
+        if old_rows.any():
+            present = np.zeros(len(rows), dtype=bool)
+            present[old_rows] = np.asarray(
+                X[rows[old_rows], cols[old_rows]]
+            ).ravel() > 0
+            rows, cols = rows[~present], cols[~present]
+        if not len(rows):
+            self.X, self.C = X, C
+            return
+
+        D = sp.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)), shape=shape)
+        cross = D.T @ X
+        self.C = (C + cross + cross.T + D.T @ D).tocsr()
+        self.X = (X + D).tocsr()
+
+    @staticmethod
+    def _resize(matrix, shape):
+        if matrix.shape == shape:
+            return matrix
+        matrix = matrix.tocoo()
+        return sp.csr_matrix((matrix.data, (matrix.row, matrix.col)), shape=shape, dtype=np.int32)
+
+    def mine_rules(self, min_support, min_confidence):
+        """
+        Luật một-một A -> B từ ma trận đếm cặp, lọc theo support và confidence.
+        Trả về RuleIndex (luật nhóm theo sản phẩm vế trái, sắp theo confidence giảm dần).
+        """
+        with self.lock:
+            C, n = self.C, self.n_invoices
+            item_codes = list(self.item_codes)
+            descriptions = dict(self.descriptions)
+        if n == 0 or C.nnz == 0:
+            return RuleIndex.empty()
+
+        counts = C.diagonal().astype("float64")
+        pair = C.tocoo()
+        keep = (pair.row != pair.col) & (pair.data >= min_support * n)
+        antecedent, consequent, both = pair.row[keep], pair.col[keep], pair.data[keep].astype("float64")
+        confidence = both / counts[antecedent]
+        keep = confidence >= min_confidence
+        antecedent, consequent, both, confidence = antecedent[keep], consequent[keep], both[keep], confidence[keep]
+        support = both / n
+        lift = confidence / (counts[consequent] / n)
+
+        rules = pd.DataFrame({
+            "antecedent": antecedent,
+            "consequent": consequent,
+            "support": support,
+            "confidence": confidence,
+            "lift": lift,
+        }).sort_values(["antecedent", "confidence", "lift"], ascending=[True, False, False], kind="stable")
+        return RuleIndex(rules.reset_index(drop=True), item_codes, descriptions)
+
+
+class RuleIndex:
+    """
+    Bảng luật sắp theo vế trái, kèm indptr kiểu CSR: luật của một sản phẩm nằm trong
+    rules[indptr[i]:indptr[i + 1]] -> tra cứu O(số luật của sản phẩm).
+    """
+
+    def __init__(self, rules, item_codes, descriptions):
+        self.rules = rules
+        self.item_codes = item_codes
+        self.descriptions = descriptions
+        self.item_index = {code: i for i, code in enumerate(item_codes)}
+        counts = np.bincount(rules["antecedent"].to_numpy(), minlength=len(item_codes))
+        self.indptr = np.concatenate([[0], np.cumsum(counts)])
+
+    @classmethod
+    def empty(cls):
+        return cls(pd.DataFrame(columns=["antecedent", "consequent", "support", "confidence", "lift"])
+                   .astype({"antecedent": "int64", "consequent": "int64"}), [], {})
+
+    def __len__(self):
+        return len(self.rules)
+
+    def to_frame(self):
+        """
+        Bảng luật theo lift, confidence giảm dần; mã sản phẩm là Categorical trên item_codes
+        (gửi qua tiến trình và mã hoá theo cột, không dựng dict cho từng luật).
+        """
+        order = np.lexsort((-self.rules["confidence"].to_numpy(), -self.rules["lift"].to_numpy()))
+        rules = self.rules.take(order)
+        categories = pd.Index(self.item_codes, dtype=object)
+        return pd.DataFrame({
+            "antecedent": pd.Categorical.from_codes(rules["antecedent"].to_numpy(), categories=categories),
+            "consequent": pd.Categorical.from_codes(rules["consequent"].to_numpy(), categories=categories),
+            "support": rules["support"].to_numpy(dtype="float64"),
+            "confidence": rules["confidence"].to_numpy(dtype="float64"),
+            "lift": rules["lift"].to_numpy(dtype="float64"),
+        })
+
+    def recommend(self, stock_codes, top_n=10):
+        """
+        Gợi ý sản phẩm cho các mã trong giỏ: gộp luật của từng mã, bỏ mã đã có trong giỏ,
+        mỗi sản phẩm gợi ý lấy luật có confidence cao nhất.
+        """
+        basket = {self.item_index[code] for code in stock_codes if code in self.item_index}
+        parts = [self.rules.iloc[self.indptr[i]:self.indptr[i + 1]] for i in sorted(basket)]
+        if not parts:
+            return []
+        candidates = pd.concat(parts)
+        candidates = candidates[~candidates["consequent"].isin(basket)]
+        best = candidates.sort_values(["confidence", "lift"], ascending=False, kind="stable") \
+            .drop_duplicates("consequent").head(top_n)
+        return [
+            {
+                "stockCode": self.item_codes[c],
+                "description": self.descriptions.get(self.item_codes[c]),
+                "because_of": self.item_codes[a],
+                "support": s,
+                "confidence": conf,
+                "lift": lift,
+            }
+            for a, c, s, conf, lift in best[["antecedent", "consequent", "support", "confidence", "lift"]]
+            .itertuples(index=False)
+        ]
+
+
+class RuleIndexCache:
+    """
+    Giữ các RuleIndex đã dựng theo (phiên bản giỏ hàng, min_support, min_confidence), LRU.
+    """
+
+    def __init__(self, max_entries=RULE_INDEX_CACHE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def get(self, basket, min_support, min_confidence):
+        key = (basket.version, min_support, min_confidence)
+        index = self.entries.get(key)
+        if index is None:
+            index = basket.mine_rules(min_support, min_confidence)
+            self.entries[key] = index
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        self.entries.move_to_end(key)
+        return index
+
+
+def rule_view(rules, min_lift=0.0, sort="lift"):
+    """
+    Lọc theo lift và sắp lại bảng luật (từ RuleIndex.to_frame) trên cột NumPy, trước khi phân trang và mã hoá.
+    """
+    if sort not in RULE_SORTS:
+        raise ValueError(f"sort chỉ nhận {list(RULE_SORTS)}")
+    if min_lift > 0:
+        rules = rules[rules["lift"].to_numpy() >= min_lift]
+    if sort != "lift":
+        # lexsort ổn định: cùng giá trị thì giữ thứ tự lift giảm dần sẵn có
+        rules = rules.take(np.lexsort((-rules[sort].to_numpy(),)))
+    return rules.reset_index(drop=True)
@@ -0,0 +1,113 @@
+import asyncio
+import os
+import time
+
+import pandas as pd
+
+from fast_forecast import forecast_records
+from metrics import observe_stage
+from rollups import load_rollup
+from serialization import encode_line
+
+# Số tiến trình fit song song và số ngày dữ liệu tối thiểu của một chuỗi
+BATCH_FORECAST_WORKERS = int(os.environ.get("BATCH_FORECAST_WORKERS", os.cpu_count() or 2))
+MIN_SERIES_DAYS = int(os.environ.get("MIN_SERIES_DAYS", 14))
+GROUP_COLUMNS = ("stockCode", "country")
+
+
+def build_series(data_dir, group_by, keys=None, limit=50, start=None, end=None):
+    """
+    Dựng chuỗi doanh thu theo ngày cho từng nhóm từ rollup ngày (một lần đọc cho mọi chuỗi).
+    group_by: danh sách cột trong GROUP_COLUMNS. keys: chỉ lấy các nhóm này,
+    nếu không có thì lấy limit nhóm có doanh thu lớn nhất.
+    Trả về [(key, DataFrame(ds, y))].
+    """
+    daily = load_rollup(data_dir, "day", start, end)
+    if daily.empty:
+        return []
+    daily = daily.groupby(list(group_by) + ["bucket"], observed=True)["total"].sum().reset_index()
+    label = daily[list(group_by)].astype(str).agg(" | ".join, axis=1)
+
+    if keys:
+        selected = [key for key in dict.fromkeys(keys)]
+    else:
+        selected = daily.groupby(label)["total"].sum().nlargest(limit).index.tolist()
+
+    series = []
+    groups = daily.groupby(label, sort=False)
+    for key in selected:
+        if key not in groups.groups:
+            series.append((key, pd.DataFrame(columns=["ds", "y"])))
+            continue
+        group = groups.get_group(key).sort_values("bucket")
+        series.append((key, pd.DataFrame({"ds": group["bucket"].to_numpy(), "y": group["total"].to_numpy()})))
+    return series
+
+
+def forecast_series(key, history, periods, model="prophet"):
+    """
+    Fit một chuỗi trong worker; trả về dự đoán các ngày sau dữ liệu và thời gian fit.
+    """
+    if model != "prophet":
+        # Mô hình nhanh cần chuỗi đều bước: ngày không có giao dịch -> 0
+        regular = history.set_index("ds")["y"].asfreq("D", fill_value=0.0)
+        result = forecast_records(pd.DataFrame({"ds": regular.index, "y": regular.to_numpy()}), periods, model, "D")
+        return dict(result, key=key, status="done", history_days=len(history))
+
+    from models.forecasting import predict_sales_with_prophet
+
+    started = time.perf_counter()
+    forecast_df, _ = predict_sales_with_prophet(history, periods=periods)
+    fit_seconds = time.perf_counter() - started
+
+    future = forecast_df[forecast_df["ds"] > history["ds"].max()]
+    columns = [c for c in ("ds", "yhat", "yhat_lower", "yhat_upper") if c in future.columns]
+    future = future[columns].assign(ds=future["ds"].dt.strftime("%Y-%m-%d"))
+    return {
+        "key": key,
+        "status": "done",
+        "model": model,
+        "history_days": len(history),
+        "fit_seconds": round(fit_seconds, 4),
+        "forecast": future.reset_index(drop=True),
+    }
+
+
+async def stream_forecasts(pool, series, periods, min_days=MIN_SERIES_DAYS, model="prophet"):
+    """
+    Gửi từng chuỗi đủ dài vào process pool, trả về từng dòng NDJSON ngay khi chuỗi đó xong,
+    dòng cuối là tóm tắt. Client ngắt kết nối thì huỷ các chuỗi chưa chạy.
+    """
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    counts = {"done": 0, "skipped": 0, "failed": 0}
+
+    async def run(key, history):
+        try:
+            return await loop.run_in_executor(pool, forecast_series, key, history, periods, model)
+        except Exception as e:
+            return {"key": key, "status": "failed", "error": str(e)}
+
+    tasks = []
+    for key, history in series:
+        if len(history) < min_days:
+            counts["skipped"] += 1
+            yield encode_line({"key": key, "status": "skipped", "history_days": len(history),
+                               "reason": f"Chuỗi ngắn hơn {min_days} ngày"})
+            continue
+        tasks.append(asyncio.ensure_future(run(key, history)))
+
+    try:
+        for completed in asyncio.as_completed(tasks):
+            result = await completed
+            counts[result["status"]] += 1
+            if "fit_seconds" in result:
+                observe_stage("main_api", "predict_sales_batch", "fit", result["fit_seconds"])
+            yield encode_line(result)
+    finally:
+        # Huỷ các chuỗi chưa chạy (ví dụ client đã ngắt kết nối)
+        for task in tasks:
+            task.cancel()
+
+    summary = dict(counts, series=len(series), elapsed_seconds=round(time.perf_counter() - started, 4))
+    yield encode_line({"summary": summary})
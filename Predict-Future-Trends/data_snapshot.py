@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+
+import pandas as pd
+
+from frame_schema import memory_report
+from incremental_loader import IncrementalLoader, append_frames
+from metrics import stage
+from segment_store import data_signature, store_dir
+
+
+class DataVersion:
+    """
+    Chỉ theo dõi phiên bản dữ liệu (không nạp dữ liệu): số tăng dần mỗi khi data_signature đổi.
+    Dùng ở tiến trình API chính, nơi dữ liệu được đọc trong các worker.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+        self.signature = None
+        self.version = 0
+
+    def current(self):
+        if not os.path.isdir(store_dir(self.root)):
+            raise FileNotFoundError(f"Thư mục dữ liệu không tồn tại: {self.root}")
+        signature = data_signature(self.root)
+        with self.lock:
+            if signature != self.signature:
+                self.signature = signature
+                self.version += 1
+            return self.version
+
+
+class DatasetSnapshot:
+    """
+    Bản dữ liệu dùng chung trong một tiến trình: nạp một lần, sau đó chỉ đọc phần mới
+    (qua IncrementalLoader) và chỉ tiền xử lý các dòng mới.
+
+    frame là DataFrame đã tiền xử lý, được thay bằng object mới mỗi khi dữ liệu đổi và
+    không bao giờ bị sửa tại chỗ -> các handler dùng chung mà không cần copy.
+    version tăng dần mỗi lần frame đổi, dùng làm khoá cache/phiên bản dữ liệu.
+    """
+
+    def __init__(self, root, preprocess):
+        self.root = root
+        self.preprocess = preprocess
+        self.loader = IncrementalLoader(root)
+        self.lock = threading.Lock()
+        self.frame = pd.DataFrame()
+        self.version = 0
+        self.loaded_at = None
+        self.raw_rows = 0
+        self.generation = None
+        self.signature = None
+
+    def get(self):
+        """
+        Trả về (frame, version), làm mới trước nếu file dữ liệu đã đổi.
+        """
+        if not os.path.isdir(store_dir(self.root)):
+            raise FileNotFoundError(f"Thư mục dữ liệu không tồn tại: {self.root}")
+        signature = data_signature(self.root)
+        if signature == self.signature:
+            return self.frame, self.version
+
+        with self.lock:
+            if signature != self.signature:
+                self._refresh()
+                self.signature = signature
+            return self.frame, self.version
+
+    def _refresh(self):
+        with stage("main_api", "snapshot", "read"):
+            changed = self.loader.refresh()
+        if not changed and self.generation == self.loader.generation:
+            return
+        raw = self.loader.frame
+        with stage("main_api", "snapshot", "preprocess"):
+            if self.generation != self.loader.generation or len(raw) < self.raw_rows:
+                # Dữ liệu cũ đã bị thay: tiền xử lý lại toàn bộ
+                frame = self.preprocess(raw.copy(deep=False)) if not raw.empty else pd.DataFrame()
+            elif len(raw) > self.raw_rows:
+                delta = self.preprocess(raw.iloc[self.raw_rows:].copy(deep=False))
+                frame = append_frames(self.frame, delta)
+            else:
+                return
+
+        self.frame = frame
+        self.raw_rows = len(raw)
+        self.generation = self.loader.generation
+        self.version += 1
+        self.loaded_at = time.time()
+
+    def info(self):
+        return {
+            "version": self.version,
+            "rows": len(self.frame),
+            "raw_rows": self.raw_rows,
+            "loaded_at": self.loaded_at,
+            "raw_memory": memory_report(self.loader.frame),
+        }
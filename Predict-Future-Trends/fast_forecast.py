@@ -0,0 +1,158 @@
+import glob
+import itertools
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from rollups import GRANULARITIES, load_rollup, rollup_dir
+
+# Các mô hình nhanh (NumPy), dùng thay Prophet khi cần trả lời trong vài mili giây
+FAST_MODELS = ("seasonal_naive", "holt_winters", "moving_average")
+MODELS = ("prophet",) + FAST_MODELS
+
+# freq -> (granularity của rollup, độ dài mùa vụ, cửa sổ lịch sử mặc định)
+FREQUENCIES = {
+    "D": ("day", 7, None),
+    "h": ("hour", 24, pd.Timedelta(days=60)),
+    "min": ("minute", 1440, pd.Timedelta(days=3)),
+}
+MOVING_AVERAGE_WINDOW = 7
+# Lưới tham số Holt-Winters, được thử đồng thời (vector hoá theo tổ hợp tham số)
+HW_GRID = (0.1, 0.3, 0.5, 0.8)
+INTERVAL_Z = 1.96
+
+
+def latest_bucket(data_dir, granularity):
+    """
+    Bucket mới nhất của một granularity: chỉ đọc partition cuối cùng.
+    """
+    paths = sorted(glob.glob(os.path.join(rollup_dir(data_dir, granularity), "*.parquet")))
+    if not paths:
+        return None
+    last = os.path.basename(paths[-1])[:-len(".parquet")]
+    fmt = GRANULARITIES[granularity][1]
+    start = pd.to_datetime(last, format=fmt) if fmt else None
+    df = load_rollup(data_dir, granularity, start)
+    return df["bucket"].max() if not df.empty else None
+
+
+def load_series(data_dir, freq="D", window=None, country=None, stock_code=None):
+    """
+    Chuỗi doanh thu đều bước (thiếu bucket -> 0) từ rollup: DataFrame(ds, y).
+    window: khoảng lịch sử tính từ bucket mới nhất (mặc định theo FREQUENCIES).
+    """
+    granularity, _, default_window = FREQUENCIES[freq]
+    window = window if window is not None else default_window
+    start = None
+    if window is not None:
+        latest = latest_bucket(data_dir, granularity)
+        if latest is None:
+            return pd.DataFrame(columns=["ds", "y"])
+        start = latest - window
+
+    df = load_rollup(data_dir, granularity, start)
+    if country is not None:
+        df = df[df["country"] == country]
+    if stock_code is not None:
+        df = df[df["stockCode"] == stock_code]
+    if df.empty:
+        return pd.DataFrame(columns=["ds", "y"])
+    y = df.groupby("bucket")["total"].sum().asfreq(freq, fill_value=0.0)
+    return pd.DataFrame({"ds": y.index, "y": y.to_numpy(dtype="float64")})
+
+
+def seasonal_naive(y, periods, season):
+    """
+    Lặp lại mùa vụ cuối cùng; không đủ một mùa thì lặp giá trị cuối.
+    """
+    if season <= 1 or len(y) < season:
+        return np.full(periods, y[-1]), y[1:] - y[:-1]
+    last_season = y[-season:]
+    residuals = y[season:] - y[:-season]
+    return np.resize(last_season, periods), residuals
+
+
+def moving_average(y, periods, window=MOVING_AVERAGE_WINDOW):
+    window = max(1, min(window, len(y)))
+    cumsum = np.concatenate([[0.0], np.cumsum(y)])
+    fitted = (cumsum[window:] - cumsum[:-window]) / window
+    residuals = y[window:] - fitted[:-1]
+    return np.full(periods, fitted[-1]), residuals
+
+
+def holt_winters(y, periods, season, grid=HW_GRID):
+    """
+    Holt-Winters cộng tính (hoặc Holt nếu chuỗi ngắn hơn hai mùa vụ).
+    Mọi tổ hợp (alpha, beta, gamma) trong lưới chạy cùng lúc dưới dạng mảng,
+    chọn tổ hợp có sai số một bước nhỏ nhất.
+    """
+    seasonal = season > 1 and len(y) >= 2 * season
+    m = season if seasonal else 1
+    params = np.array(list(itertools.product(grid, grid, grid if seasonal else (0.0,))))
+    alpha, beta, gamma = params[:, 0], params[:, 1], params[:, 2]
+    k = len(params)
+
+    if seasonal:
+        level = np.full(k, y[:m].mean())
+        trend = np.full(k, (y[m:2 * m].mean() - y[:m].mean()) / m)
+        seasons = np.tile(y[:m] - y[:m].mean(), (k, 1))
+        start = m
+    else:
+        level = np.full(k, y[0])
+        trend = np.full(k, y[1] - y[0] if len(y) > 1 else 0.0)
+        seasons = np.zeros((k, 1))
+        start = 1
+
+    errors = np.zeros((k, len(y) - start))
+    for t in range(start, len(y)):
+        s = seasons[:, t % m]
+        prediction = level + trend + s
+        errors[:, t - start] = y[t] - prediction
+        new_level = alpha * (y[t] - s) + (1 - alpha) * (level + trend)
+        trend = beta * (new_level - level) + (1 - beta) * trend
+        seasons[:, t % m] = gamma * (y[t] - new_level) + (1 - gamma) * s
+        level = new_level
+
+    best = int(np.argmin((errors ** 2).sum(axis=1))) if errors.shape[1] else 0
+    steps = np.arange(1, periods + 1)
+    season_index = (len(y) + steps - 1) % m
+    forecast = level[best] + steps * trend[best] + seasons[best, season_index]
+    return forecast, errors[best]
+
+
+def fast_forecast(history, periods, model="holt_winters", freq="D"):
+    """
+    Dự đoán periods bước sau chuỗi history (ds, y) bằng mô hình nhanh.
+    Trả về DataFrame (ds, yhat, yhat_lower, yhat_upper); khoảng tin cậy từ độ lệch chuẩn phần dư.
+    """
+    _, season, _ = FREQUENCIES[freq]
+    y = history["y"].to_numpy(dtype="float64")
+    if len(y) < 2:
+        raise ValueError("Cần ít nhất 2 điểm dữ liệu để dự đoán.")
+
+    if model == "seasonal_naive":
+        yhat, residuals = seasonal_naive(y, periods, season)
+    elif model == "moving_average":
+        yhat, residuals = moving_average(y, periods)
+    elif model == "holt_winters":
+        yhat, residuals = holt_winters(y, periods, season)
+    else:
+        raise ValueError(f"Mô hình không hợp lệ: {model}")
+
+    spread = INTERVAL_Z * (residuals.std() if len(residuals) > 1 else 0.0)
+    ds = pd.date_range(pd.Timestamp(history["ds"].iloc[-1]), periods=periods + 1, freq=freq)[1:]
+    return pd.DataFrame({"ds": ds, "yhat": yhat, "yhat_lower": yhat - spread, "yhat_upper": yhat + spread})
+
+
+def forecast_records(history, periods, model, freq):
+    """
+    Như fast_forecast nhưng trả về kết quả (dict, forecast là DataFrame đã định dạng ds) kèm thời gian fit.
+    """
+    started = time.perf_counter()
+    forecast = fast_forecast(history, periods, model, freq)
+    fit_seconds = time.perf_counter() - started
+    forecast = forecast.assign(ds=forecast["ds"].dt.strftime("%Y-%m-%d %H:%M:%S" if freq != "D" else "%Y-%m-%d"))
+    return {"model": model, "freq": freq, "fit_seconds": round(fit_seconds, 6),
+            "forecast": forecast}
@@ -0,0 +1,225 @@
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from metrics import REGISTRY, observe_stage, observe_stages
+from model_tasks import TaskError, init_worker, run_task
+
+# Số tiến trình worker, số job chờ tối đa, thời gian chạy tối đa mỗi job (giây)
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", 32))
+JOB_TIMEOUT = float(os.environ.get("JOB_TIMEOUT", 900))
+# Số job đã xong còn giữ lại để tra cứu kết quả
+JOB_HISTORY = int(os.environ.get("JOB_HISTORY", 256))
+
+ACTIVE_STATUSES = ("queued", "running")
+
+JOBS_TOTAL = REGISTRY.counter("retail_jobs_total", "Số job đã kết thúc theo loại và trạng thái", ("kind", "status"))
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, kind, params, key=None, timeout=JOB_TIMEOUT):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params
+        self.key = key
+        self.timeout = timeout
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.status_code = None
+        self.done = asyncio.Event()
+
+    def info(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "params": self.params,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+
+
+class WorkerSlot:
+    """
+    Một worker = một ProcessPoolExecutor một tiến trình, để có thể dừng riêng job đang chạy
+    (huỷ/quá hạn) bằng cách kill tiến trình đó mà không ảnh hưởng job ở worker khác.
+    """
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self.executor = self._create()
+
+    def _create(self):
+        return ProcessPoolExecutor(max_workers=1, initializer=init_worker, initargs=(self.data_dir,))
+
+    def kill(self):
+        # ProcessPoolExecutor không có API dừng job đang chạy, phải kill tiến trình worker
+        for process in list(getattr(self.executor, "_processes", {}).values()):
+            process.kill()
+
+    def restart(self):
+        self.kill()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = self._create()
+
+    def shutdown(self):
+        self.kill()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class JobManager:
+    """
+    Chạy job huấn luyện/tính toán trong process pool, ngoài event loop:
+    hàng đợi giới hạn, timeout theo job, huỷ job, gộp các job giống nhau (cùng key) đang chờ/chạy.
+    on_result(job) được gọi khi job xong thành công (ví dụ để lưu vào cache kết quả).
+    """
+
+    def __init__(self, data_dir, workers=JOB_WORKERS, queue_size=JOB_QUEUE_SIZE, on_result=None):
+        self.data_dir = data_dir
+        self.workers = workers
+        self.queue_size = queue_size
+        self.on_result = on_result
+        self.jobs = OrderedDict()   # job_id -> Job
+        self.active = {}            # key -> Job đang chờ/chạy
+        self.running = {}           # job_id -> WorkerSlot
+        self.slots = []
+        self.tasks = []
+        self.queue = None
+
+    def start(self):
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.slots = [WorkerSlot(self.data_dir) for _ in range(self.workers)]
+        self.tasks = [asyncio.create_task(self._run(slot)) for slot in self.slots]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        for slot in self.slots:
+            slot.shutdown()
+        for job in list(self.active.values()):
+            self._finish(job, "cancelled", error="API đang dừng")
+
+    def submit(self, kind, params, key=None, timeout=None):
+        """
+        Đưa job vào hàng đợi; trả về (job, coalesced). Job cùng key đang chờ/chạy được dùng lại.
+        """
+        if key is not None and key in self.active:
+            return self.active[key], True
+        job = Job(kind, params, key, timeout or JOB_TIMEOUT)
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise QueueFullError(f"Hàng đợi job đã đầy ({self.queue_size} job)")
+        self.jobs[job.id] = job
+        if key is not None:
+            self.active[key] = job
+        self._trim_history()
+        return job, False
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None or job.status not in ACTIVE_STATUSES:
+            return job
+        slot = self.running.get(job_id)
+        self._finish(job, "cancelled", error="Job đã bị huỷ")
+        if slot is not None:
+            # Worker đang chạy job này: kill, vòng _run sẽ khởi động lại worker
+            slot.kill()
+        return job
+
+    async def wait(self, job, timeout):
+        """
+        Chờ job xong tối đa timeout giây; trả về True nếu job đã kết thúc.
+        """
+        if timeout is not None and timeout <= 0:
+            return job.done.is_set()
+        try:
+            await asyncio.wait_for(job.done.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def stats(self):
+        statuses = {}
+        for job in self.jobs.values():
+            statuses[job.status] = statuses.get(job.status, 0) + 1
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "queued": self.queue.qsize() if self.queue else 0,
+            "running": len(self.running),
+            "jobs": statuses,
+        }
+
+    def _finish(self, job, status, result=None, error=None, status_code=None):
+        if job.status not in ACTIVE_STATUSES:
+            return
+        job.status = status
+        job.result = result
+        job.error = error
+        job.status_code = status_code
+        job.finished_at = time.time()
+        JOBS_TOTAL.inc(kind=job.kind, status=status)
+        if job.started_at is not None:
+            observe_stage("main_api", job.kind, "run", job.finished_at - job.started_at)
+        if job.key is not None and self.active.get(job.key) is job:
+            del self.active[job.key]
+        job.done.set()
+        if status == "done" and self.on_result is not None:
+            self.on_result(job)
+
+    def _trim_history(self):
+        for job_id in list(self.jobs):
+            if len(self.jobs) <= JOB_HISTORY:
+                break
+            if self.jobs[job_id].status not in ACTIVE_STATUSES:
+                del self.jobs[job_id]
+
+    async def _run(self, slot):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            try:
+                if job.status != "queued":
+                    continue  # Đã bị huỷ khi còn trong hàng đợi
+                job.status = "running"
+                job.started_at = time.time()
+                observe_stage("main_api", job.kind, "queue", job.started_at - job.created_at)
+                self.running[job.id] = slot
+                future = loop.run_in_executor(slot.executor, run_task, job.kind, job.params)
+                try:
+                    result, stages = await asyncio.wait_for(future, job.timeout)
+                    observe_stages(stages)
+                    self._finish(job, "done", result=result)
+                except asyncio.TimeoutError:
+                    slot.restart()
+                    self._finish(job, "timeout", error=f"Job chạy quá {job.timeout:g}s", status_code=504)
+                except BrokenProcessPool:
+                    slot.restart()
+                    self._finish(job, "failed", error="Worker bị dừng đột ngột", status_code=500)
+                except TaskError as e:
+                    self._finish(job, "failed", error=e.detail, status_code=e.status_code)
+                except Exception as e:
+                    self._finish(job, "failed", error=str(e), status_code=500)
+            finally:
+                self.running.pop(job.id, None)
+                self.queue.task_done()
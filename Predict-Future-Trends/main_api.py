@@ -1,11 +1,13 @@
 # api_server/main_api.py
 
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
+from typing import List, Optional
 import pandas as pd
-import json
+import asyncio
 import os
+import sys
 
 # Import các hàm xử lý dữ liệu và mô hình từ thư mục cha của api_server
 # (Giả định models/ và utils/ nằm trong cùng cấp với api_server/ hoặc đã được copy vào api_server/)
@@ -26,10 +28,7 @@ import os
 # Ví dụ đơn giản:
 
 # Giả định models và utils được copy vào api_server
-from models.forecasting import predict_sales_with_prophet
-from models.recommendation import get_product_recommendations
-from models.clv_prediction import segment_customers_rfm
-from utils.data_processing import preprocess_dataframe, aggregate_daily_sales, get_rfm_data
+# Các mô hình được import và chạy trong model_tasks.py (worker của process pool, xem jobs.py)
 
 app = FastAPI(
     title="Sales Prediction & Analysis API",
@@ -37,120 +36,368 @@ app = FastAPI(
     version="1.0.0"
 )
 
-# Đường dẫn tới file dữ liệu (giả định nằm cùng cấp với main_api.py)
-DATA_FILE_PATH = "../received_data.jsonl" # Hoặc 'received_data.jsonl' nếu file này nằm trong api_server/
+# Thư mục dữ liệu do Web-Services ghi ra (chứa segments/manifest.json)
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.environ.get("RETAIL_DATA_DIR", os.path.join(BASE_DIR, "..", "Web-Services", "Web"))
 
-# Hàm đọc dữ liệu (tương tự như Streamlit)
-def read_data_for_api(path=DATA_FILE_PATH):
-    rows = []
-    if not os.path.exists(path):
-        raise FileNotFoundError(f"File dữ liệu không tồn tại: {path}")
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            for line in f:
-                rows.append(json.loads(line))
-        return pd.DataFrame(rows)
-    except json.JSONDecodeError as e:
-        raise ValueError(f"Lỗi phân tích cú pháp JSON trong file {path}: {e}")
-    except Exception as e:
-        raise Exception(f"Lỗi khi đọc file dữ liệu {path}: {e}")
+# Dùng chung bộ đọc segment với dashboard (Web-Services/Web/segment_store.py)
+sys.path.append(os.path.join(BASE_DIR, "..", "Web-Services", "Web"))
+from data_snapshot import DataVersion
+from result_cache import ResultCache
+from jobs import JobManager, QueueFullError
+from model_tasks import TASKS
+from batch_forecast import BATCH_FORECAST_WORKERS, GROUP_COLUMNS, MIN_SERIES_DAYS, build_series, stream_forecasts
+from fast_forecast import FREQUENCIES, MODELS, forecast_records, load_series
+from basket_rules import RULE_SORTS, rule_view
+from serialization import (ARROW, JSON, MEDIA_TYPES, NDJSON, decode_cursor, encode_arrow, encode_cursor,
+                           encode_json, iter_ndjson, negotiate, table_key)
+from metrics import CONTENT_TYPE, PROFILE_ENDPOINT, REGISTRY, profile_for, stage, start_profiler_from_env, track_requests
+from concurrent.futures import ProcessPoolExecutor
+
+track_requests(app, "main_api")
+
+# Thời gian chờ mặc định của các endpoint đồng bộ; quá hạn sẽ trả về 202 kèm job_id
+JOB_SYNC_WAIT = float(os.environ.get("JOB_SYNC_WAIT", 30))
+# Số luật mỗi trang JSON của /recommend_products/ khi không chỉ định limit (NDJSON/Arrow mặc định trả hết)
+RULES_PAGE_SIZE = int(os.environ.get("RULES_PAGE_SIZE", 1000))
+
+# Phiên bản dữ liệu (dữ liệu thật được nạp trong từng worker)
+data_version = DataVersion(DATA_DIR)
+
+# Kết quả mô hình theo (endpoint, phiên bản dữ liệu, tham số): dữ liệu và tham số không đổi thì không fit lại
+result_cache = ResultCache()
+
+def cache_job_result(job):
+    if job.key is not None:
+        result_cache.put(job.key, job.result)
+
+# Prophet/Apriori/K-Means chạy trong process pool, không chặn event loop
+jobs = JobManager(DATA_DIR, on_result=cache_job_result)
+
+@app.on_event("startup")
+async def start_jobs():
+    start_profiler_from_env("main_api")
+    jobs.start()
+    # Pool riêng cho dự đoán hàng loạt: mỗi chuỗi là một tác vụ độc lập, không cần bản dữ liệu
+    app.state.forecast_pool = ProcessPoolExecutor(max_workers=BATCH_FORECAST_WORKERS)
+
+@app.on_event("shutdown")
+async def stop_jobs():
+    await jobs.stop()
+    app.state.forecast_pool.shutdown(wait=False, cancel_futures=True)
 
 # Định nghĩa request body cho endpoint dự đoán doanh số
 class SalesForecastRequest(BaseModel):
     periods: int = 7 # Mặc định dự đoán 7 ngày
+    model: str = "prophet"  # prophet | seasonal_naive | holt_winters | moving_average
+    freq: str = "D"         # D | h | min (theo giờ/phút chỉ dùng mô hình nhanh)
+
+class BatchForecastRequest(BaseModel):
+    group_by: List[str] = ["stockCode"]   # stockCode và/hoặc country
+    keys: Optional[List[str]] = None      # Nhãn nhóm, ví dụ "85123A" hoặc "85123A | United Kingdom"
+    limit: int = 50                       # Không có keys: lấy limit nhóm doanh thu cao nhất
+    periods: int = 7
+    model: str = "prophet"
+    min_days: int = MIN_SERIES_DAYS
+    start: Optional[str] = None
+    end: Optional[str] = None
+
+class ItemRecommendationRequest(BaseModel):
+    stock_codes: List[str]          # Các mã sản phẩm đang có trong giỏ
+    min_support: float = 0.005
+    min_confidence: float = 0.2
+    top_n: int = 10
+
+class JobRequest(BaseModel):
+    kind: str                       # predict_sales | recommend_products | recommend_for_items | segment_customers
+    params: dict = {}
+    timeout: Optional[float] = None # Giây, mặc định JOB_TIMEOUT
+
+def response_type(accept, offered=MEDIA_TYPES):
+    media = negotiate(accept, offered)
+    if media is None:
+        raise HTTPException(status_code=406, detail=f"Chỉ trả về {', '.join(offered)}")
+    return media
+
+async def encode_response(content, media, headers=None):
+    """
+    Mã hoá kết quả (bảng DataFrame mã hoá theo cột, xem serialization.py) thành response kiểu media.
+    JSON/Arrow mã hoá trong thread để không chặn event loop; NDJSON stream theo từng khối dòng.
+    """
+    if media == NDJSON:
+        return StreamingResponse(iter_ndjson(content), media_type=NDJSON, headers=headers)
+    body = await asyncio.to_thread(encode_arrow if media == ARROW else encode_json, content)
+    return Response(content=body, media_type=media, headers=headers)
+
+async def render(content, accept):
+    """
+    Trả kết quả theo header Accept: JSON (mặc định), NDJSON, hoặc Arrow IPC nếu kết quả có bảng.
+    """
+    offered = MEDIA_TYPES if table_key(content) is not None else (JSON, NDJSON)
+    return await encode_response(content, response_type(accept, offered))
+
+def job_content(job):
+    """
+    Kết quả của job đã kết thúc nếu thành công, lỗi HTTP nếu không.
+    """
+    if job.status == "done":
+        return job.result
+    if job.status == "cancelled":
+        raise HTTPException(status_code=409, detail=job.error)
+    raise HTTPException(status_code=job.status_code or 500, detail=job.error)
+
+def submit_job(kind, params, key=None, timeout=None):
+    try:
+        job, coalesced = jobs.submit(kind, params, key=key, timeout=timeout)
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    if coalesced:
+        result_cache.note_coalesced()
+    return job
+
+async def current_version():
+    try:
+        return await asyncio.to_thread(data_version.current)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def model_result(kind, params, wait, version=None):
+    """
+    Lấy kết quả từ cache, hoặc chạy job và chờ tối đa wait giây.
+    version: phiên bản dữ liệu của kết quả cần lấy (mặc định bản hiện tại); bản cũ chỉ còn trong cache.
+    Trả về (phiên bản, kết quả, None), hoặc (phiên bản, None, response 202 kèm job_id) nếu job chưa xong.
+    """
+    current = await current_version()
+    version = current if version is None else version
+    key = (kind, version) + tuple(sorted(params.items()))
+    content = result_cache.get(key)
+    if content is not None:
+        return version, content, None
+    if version != current:
+        raise HTTPException(status_code=410, detail="Dữ liệu đã đổi, cursor hết hạn: hãy lấy lại từ trang đầu.")
+
+    job = submit_job(kind, params, key=key)
+    if await jobs.wait(job, wait):
+        return version, job_content(job), None
+    return version, None, JSONResponse(status_code=202, content=job.info())
+
+async def run_model(kind, params, wait, accept=None):
+    """
+    Trả kết quả từ cache, hoặc chạy job và chờ tối đa wait giây;
+    job chưa xong thì trả về 202 kèm job_id để tra cứu qua /jobs/{job_id}.
+    """
+    _, content, pending = await model_result(kind, params, wait)
+    if pending is not None:
+        return pending
+    return await render(content, accept)
 
 @app.get("/")
 async def read_root():
     return {"message": "Chào mừng đến với Sales Prediction & Analysis API!"}
 
+@app.get("/data_version/")
+async def get_data_version():
+    """
+    Phiên bản dữ liệu hiện tại (tăng mỗi khi dữ liệu đổi).
+    """
+    return {"version": await current_version()}
+
+@app.get("/cache_stats/")
+async def cache_stats():
+    """
+    Thống kê cache kết quả mô hình (hit/miss/gộp request/loại bỏ).
+    """
+    return result_cache.stats()
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Histogram thời gian theo công đoạn (kể cả công đoạn chạy trong worker) và bộ đếm job, định dạng Prometheus.
+    """
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
+
+# Chỉ đăng ký khi bật PROFILE_ENDPOINT (profiler cho cả vòng đời tiến trình: PROFILE_DIR)
+if PROFILE_ENDPOINT:
+    @app.get("/debug/profile")
+    async def get_profile(seconds: float = 5, interval: float = 0.01):
+        """
+        Lấy mẫu stack của tiến trình API trong seconds giây, trả về dạng folded (cho flamegraph).
+        Worker của process pool được profile qua biến môi trường PROFILE_DIR.
+        """
+        seconds = max(0.1, min(seconds, 60))
+        folded = await asyncio.to_thread(profile_for, seconds, max(interval, 0.001))
+        return PlainTextResponse(folded)
+
+@app.post("/jobs/", status_code=202)
+async def create_job(request: JobRequest):
+    """
+    Đưa một job mô hình vào hàng đợi, trả về job_id ngay.
+    """
+    if request.kind not in TASKS:
+        raise HTTPException(status_code=400, detail=f"Loại job không hợp lệ: {request.kind}")
+    job = submit_job(request.kind, request.params, timeout=request.timeout)
+    return job.info()
+
+@app.get("/jobs/")
+async def job_stats():
+    return jobs.stats()
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Không tìm thấy job")
+    return job.info()
+
+@app.get("/jobs/{job_id}/result")
+async def job_result(job_id: str, http_request: Request, wait: float = 0):
+    """
+    Kết quả của job (kiểu trả về theo header Accept); chờ thêm tối đa wait giây nếu job chưa xong
+    (202 nếu vẫn chưa xong).
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Không tìm thấy job")
+    if not await jobs.wait(job, wait):
+        return JSONResponse(status_code=202, content=job.info())
+    return await render(job_content(job), http_request.headers.get("accept"))
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    job = jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Không tìm thấy job")
+    return job.info()
+
+def compute_fast_forecast(periods, model, freq):
+    with stage("main_api", "predict_sales_fast", "read"):
+        history = load_series(DATA_DIR, freq)
+    if len(history) < 2:
+        raise HTTPException(status_code=400, detail="Không đủ dữ liệu doanh số để dự đoán (cần ít nhất 2 điểm).")
+    with stage("main_api", "predict_sales_fast", "fit"):
+        return forecast_records(history, periods, model, freq)
+
 @app.post("/predict_sales/")
-async def predict_sales(request: SalesForecastRequest):
+async def predict_sales(request: SalesForecastRequest, http_request: Request, wait: float = JOB_SYNC_WAIT):
     """
     Dự đoán doanh số bán hàng trong tương lai.
+    model=prophet chạy qua hàng đợi job (chỉ theo ngày); các mô hình nhanh tính trực tiếp từ rollup.
+    Kiểu trả về theo header Accept (JSON, NDJSON hoặc Arrow IPC).
     """
+    accept = http_request.headers.get("accept")
+    if request.model not in MODELS:
+        raise HTTPException(status_code=400, detail=f"model chỉ nhận {list(MODELS)}")
+    if request.freq not in FREQUENCIES:
+        raise HTTPException(status_code=400, detail=f"freq chỉ nhận {list(FREQUENCIES)}")
+    if request.model == "prophet":
+        if request.freq != "D":
+            raise HTTPException(status_code=400, detail="Prophet chỉ hỗ trợ freq=D, hãy chọn mô hình nhanh cho dữ liệu theo giờ/phút.")
+        return await run_model("predict_sales", {"periods": request.periods}, wait, accept)
+
+    version = await current_version()
+    key = ("predict_sales", version, request.model, request.freq, request.periods)
+    content = result_cache.get(key)
+    if content is None:
+        try:
+            content = await asyncio.to_thread(compute_fast_forecast, request.periods, request.model, request.freq)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        result_cache.put(key, content)
+    return await render(content, accept)
+
+@app.post("/predict_sales/batch/")
+async def predict_sales_batch(request: BatchForecastRequest):
+    """
+    Dự đoán doanh số theo ngày cho nhiều sản phẩm/quốc gia song song.
+    Trả về NDJSON: mỗi dòng một chuỗi (kèm fit_seconds) ngay khi xong, dòng cuối là tóm tắt.
+    """
+    if request.model not in MODELS:
+        raise HTTPException(status_code=400, detail=f"model chỉ nhận {list(MODELS)}")
+    invalid = [column for column in request.group_by if column not in GROUP_COLUMNS]
+    if not request.group_by or invalid:
+        raise HTTPException(status_code=400, detail=f"group_by chỉ nhận {list(GROUP_COLUMNS)}")
     try:
-        df_raw = read_data_for_api()
-        df = preprocess_dataframe(df_raw.copy())
-        
-        if df.empty:
-            raise HTTPException(status_code=400, detail="Không có dữ liệu hoặc dữ liệu bị lỗi để dự đoán doanh số.")
-        
-        df_daily_sales = aggregate_daily_sales(df)
-        if df_daily_sales.empty or df_daily_sales.shape[0] < 2:
-            raise HTTPException(status_code=400, detail="Không đủ dữ liệu doanh số hàng ngày để huấn luyện mô hình Prophet (cần ít nhất 2 ngày).")
-
-        # Prophet không trả về figure trực tiếp qua API, chỉ dữ liệu
-        forecast_df, _ = predict_sales_with_prophet(df_daily_sales, periods=request.periods)
-        
-        if forecast_df.empty:
-             raise HTTPException(status_code=500, detail="Lỗi trong quá trình dự đoán doanh số.")
-
-        # Lọc các ngày dự đoán và chuyển đổi sang định dạng JSON
-        last_history_date = df_daily_sales['ds'].max()
-        future_forecast = forecast_df[forecast_df['ds'] > last_history_date].to_dict(orient="records")
-        
-        # Để Streamlit có thể vẽ lại biểu đồ, cần gửi lại dữ liệu lịch sử và dự đoán.
-        # Hoặc frontend sẽ tự vẽ lại biểu đồ từ dữ liệu mà nó đang có.
-        # Ở đây ta gửi dữ liệu dự đoán dưới dạng JSON.
-        # Frontend sẽ có trách nhiệm hiển thị.
-        
-        return JSONResponse(content={"forecast": future_forecast})
-
-    except (FileNotFoundError, ValueError, Exception) as e:
+        with stage("main_api", "predict_sales_batch", "read"):
+            series = await asyncio.to_thread(
+                build_series, DATA_DIR, request.group_by, request.keys, request.limit, request.start, request.end
+            )
+    except (FileNotFoundError, ValueError) as e:
         raise HTTPException(status_code=500, detail=str(e))
+    return StreamingResponse(
+        stream_forecasts(app.state.forecast_pool, series, request.periods, request.min_days, request.model),
+        media_type="application/x-ndjson",
+    )
 
 @app.post("/recommend_products/")
-async def recommend_products(min_support: float = 0.01, min_confidence: float = 0.5):
+async def recommend_products(http_request: Request, min_support: float = 0.01, min_confidence: float = 0.5,
+                             min_lift: float = 0.0, sort: str = "lift", limit: Optional[int] = None,
+                             cursor: Optional[str] = None, wait: float = JOB_SYNC_WAIT):
     """
-    Đề xuất sản phẩm dựa trên luật kết hợp (Apriori).
+    Đề xuất sản phẩm dựa trên luật kết hợp (cặp sản phẩm, toàn bộ danh mục).
+    Lọc theo min_lift và sắp theo sort (lift | confidence | support, giảm dần) trước khi mã hoá.
+    Phân trang: limit luật mỗi trang, trang sau lấy bằng cursor=next_cursor (cùng tham số lọc/sắp);
+    các trang của một cursor luôn thuộc cùng một phiên bản dữ liệu.
+    Header Accept: application/json (mặc định, RULES_PAGE_SIZE luật mỗi trang), application/x-ndjson
+    (stream từng luật, dòng cuối là tóm tắt) hoặc application/vnd.apache.arrow.stream
+    (tổng số luật và cursor kế tiếp nằm trong header X-Total-Count, X-Next-Cursor).
     """
-    try:
-        df_raw = read_data_for_api()
-        df = preprocess_dataframe(df_raw.copy())
-        
-        if df.empty:
-            raise HTTPException(status_code=400, detail="Không có dữ liệu hoặc dữ liệu bị lỗi để đề xuất sản phẩm.")
-            
-        rules_df = get_product_recommendations(df, min_support=min_support, min_confidence=min_confidence)
-        
-        if rules_df.empty:
-            return JSONResponse(content={"recommendations": [], "message": "Không tìm thấy luật đề xuất nào với ngưỡng đã chọn."})
-
-        return JSONResponse(content={"recommendations": rules_df.to_dict(orient="records")})
-
-    except (FileNotFoundError, ValueError, Exception) as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    if sort not in RULE_SORTS:
+        raise HTTPException(status_code=400, detail=f"sort chỉ nhận {list(RULE_SORTS)}")
+    if limit is not None and limit < 1:
+        raise HTTPException(status_code=400, detail="limit phải lớn hơn 0")
+    media = response_type(http_request.headers.get("accept"))
+    params = {"min_support": min_support, "min_confidence": min_confidence}
+    view_params = [min_support, min_confidence, min_lift, sort]
+
+    version, offset = None, 0
+    if cursor:
+        try:
+            version, offset, cursor_params = decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if cursor_params != view_params:
+            raise HTTPException(status_code=400, detail="cursor không khớp với tham số lọc/sắp của request")
+
+    version, content, pending = await model_result("recommend_products", params, wait, version)
+    if pending is not None:
+        return pending
+
+    # Bảng đã lọc/sắp được cache theo (phiên bản, ngưỡng, min_lift, sort): các trang sau chỉ cắt lát
+    view_key = ("recommend_products:view", version) + tuple(sorted(params.items())) + (min_lift, sort)
+    view = result_cache.get(view_key)
+    if view is None:
+        view = await asyncio.to_thread(rule_view, content["recommendations"], min_lift, sort)
+        result_cache.put(view_key, view)
+
+    if limit is None and media == JSON:
+        limit = RULES_PAGE_SIZE
+    total = len(view)
+    end = total if limit is None else min(offset + limit, total)
+    next_cursor = encode_cursor(version, end, view_params) if end < total else None
+    page = {"recommendations": view.iloc[offset:end], "total": total, "offset": offset, "next_cursor": next_cursor}
+    if "message" in content:
+        page["message"] = content["message"]
+    headers = {"X-Total-Count": str(total)}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    return await encode_response(page, media, headers)
+
+@app.post("/recommend_for_items/")
+async def recommend_for_items(request: ItemRecommendationRequest, http_request: Request, wait: float = JOB_SYNC_WAIT):
+    """
+    Gợi ý sản phẩm mua kèm cho các mã sản phẩm cho trước, tra từ bộ luật đã dựng sẵn.
+    """
+    params = {
+        "stock_codes": tuple(sorted(set(request.stock_codes))),
+        "min_support": request.min_support,
+        "min_confidence": request.min_confidence,
+        "top_n": request.top_n,
+    }
+    return await run_model("recommend_for_items", params, wait, http_request.headers.get("accept"))
 
 @app.post("/segment_customers/")
-async def segment_customers(n_clusters: int = 4):
+async def segment_customers(http_request: Request, n_clusters: int = 4, wait: float = JOB_SYNC_WAIT):
     """
     Phân đoạn khách hàng dựa trên chỉ số RFM bằng K-Means.
     """
-    try:
-        df_raw = read_data_for_api()
-        df = preprocess_dataframe(df_raw.copy())
-        
-        if df.empty:
-            raise HTTPException(status_code=400, detail="Không có dữ liệu hoặc dữ liệu bị lỗi để phân đoạn khách hàng.")
-        
-        rfm_df = get_rfm_data(df)
-        if rfm_df.empty or rfm_df.shape[0] < n_clusters:
-            raise HTTPException(status_code=400, detail=f"Không đủ dữ liệu khách hàng để phân cụm (cần ít nhất {n_clusters} khách hàng).")
-            
-        segmented_rfm_df, _ = segment_customers_rfm(rfm_df.copy(), n_clusters=n_clusters)
-        
-        if segmented_rfm_df.empty:
-            raise HTTPException(status_code=500, detail="Lỗi trong quá trình phân đoạn khách hàng.")
-
-        # Trả về tóm tắt của các cụm
-        cluster_summary = segmented_rfm_df.groupby('Cluster_Ranked').agg(
-            AvgRecency=('Recency', 'mean'),
-            AvgFrequency=('Frequency', 'mean'),
-            AvgMonetary=('Monetary', 'mean'),
-            NumCustomers=('CustomerID', 'nunique')
-        ).sort_values(by='AvgMonetary', ascending=False).reset_index()
-
-        return JSONResponse(content={"cluster_summary": cluster_summary.to_dict(orient="records")})
-
-    except (FileNotFoundError, ValueError, Exception) as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+    return await run_model("segment_customers", {"n_clusters": n_clusters}, wait, http_request.headers.get("accept"))
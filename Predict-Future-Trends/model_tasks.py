@@ -0,0 +1,145 @@
+# Các phép tính mô hình chạy trong worker của process pool (xem jobs.py).
+# Mỗi worker giữ một DatasetSnapshot riêng, nạp một lần và làm mới tăng dần giữa các job.
+
+from utils.data_processing import preprocess_dataframe, aggregate_daily_sales
+
+from data_snapshot import DatasetSnapshot
+from metrics import collect_stages, stage, start_profiler_from_env
+from rfm_state import RFMState, WarmSegmenter
+from basket_rules import BasketState, RuleIndexCache
+
+_snapshot = None
+# Trạng thái RFM và mô hình phân cụm của worker, cập nhật tăng dần giữa các job
+_rfm = RFMState()
+_segmenter = WarmSegmenter()
+# Ma trận giỏ hàng thưa + đếm cặp sản phẩm, và các bộ luật đã dựng theo ngưỡng
+_basket = BasketState()
+_rule_indexes = RuleIndexCache()
+
+
+class TaskError(Exception):
+    """
+    Lỗi có mã HTTP, gửi được qua ranh giới tiến trình (pickle theo args).
+    """
+
+    def __init__(self, status_code, detail):
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def init_worker(data_dir):
+    global _snapshot
+    _snapshot = DatasetSnapshot(data_dir, preprocess_dataframe)
+    start_profiler_from_env("main_api-worker")
+
+
+def compute_sales_forecast(df, periods):
+    if df.empty:
+        raise TaskError(400, "Không có dữ liệu hoặc dữ liệu bị lỗi để dự đoán doanh số.")
+
+    with stage("main_api", "predict_sales", "aggregate"):
+        df_daily_sales = aggregate_daily_sales(df)
+    if df_daily_sales.empty or df_daily_sales.shape[0] < 2:
+        raise TaskError(400, "Không đủ dữ liệu doanh số hàng ngày để huấn luyện mô hình Prophet (cần ít nhất 2 ngày).")
+
+    # Import Prophet khi cần (nặng), các mô hình nhanh trong fast_forecast.py không cần
+    from models.forecasting import predict_sales_with_prophet
+
+    # Prophet không trả về figure trực tiếp qua API, chỉ dữ liệu
+    with stage("main_api", "predict_sales", "fit"):
+        forecast_df, _ = predict_sales_with_prophet(df_daily_sales, periods=periods)
+
+    if forecast_df.empty:
+        raise TaskError(500, "Lỗi trong quá trình dự đoán doanh số.")
+
+    # Lọc các ngày dự đoán; giữ dạng DataFrame, API mã hoá theo cột (xem serialization.py)
+    last_history_date = df_daily_sales['ds'].max()
+    future_forecast = forecast_df[forecast_df['ds'] > last_history_date].reset_index(drop=True)
+
+    # Để Streamlit có thể vẽ lại biểu đồ, cần gửi lại dữ liệu lịch sử và dự đoán.
+    # Hoặc frontend sẽ tự vẽ lại biểu đồ từ dữ liệu mà nó đang có.
+    # Ở đây ta gửi dữ liệu dự đoán (JSON, NDJSON hoặc Arrow tuỳ header Accept).
+    # Frontend sẽ có trách nhiệm hiển thị.
+    return {"forecast": future_forecast.assign(ds=future_forecast['ds'].dt.strftime("%Y-%m-%d"))}
+
+
+def rule_index(task, min_support, min_confidence):
+    # Cập nhật giỏ hàng bằng các dòng thô mới rồi lấy (hoặc dựng) bộ luật cho ngưỡng đã chọn
+    with stage("main_api", task, "aggregate"):
+        _basket.update(_snapshot.loader.frame, _snapshot.loader.generation)
+    with stage("main_api", task, "fit"):
+        return _rule_indexes.get(_basket, min_support, min_confidence)
+
+
+def compute_recommendations(df, min_support, min_confidence):
+    if df.empty:
+        raise TaskError(400, "Không có dữ liệu hoặc dữ liệu bị lỗi để đề xuất sản phẩm.")
+
+    # Luật A -> B trên toàn bộ danh mục sản phẩm (ma trận thưa), thay cho Apriori trên ma trận dày
+    rules = rule_index("recommend_products", min_support, min_confidence)
+
+    # Trả cả bảng luật dạng cột; API lọc/sắp/phân trang trên bảng này rồi mới mã hoá
+    if not len(rules):
+        return {"recommendations": rules.to_frame(), "message": "Không tìm thấy luật đề xuất nào với ngưỡng đã chọn."}
+
+    return {"recommendations": rules.to_frame()}
+
+
+def compute_item_recommendations(df, stock_codes, min_support, min_confidence, top_n):
+    if df.empty:
+        raise TaskError(400, "Không có dữ liệu hoặc dữ liệu bị lỗi để đề xuất sản phẩm.")
+
+    recommendations = rule_index("recommend_for_items", min_support, min_confidence).recommend(stock_codes, top_n=top_n)
+    if not recommendations:
+        return {"recommendations": [], "message": "Không có luật nào cho các sản phẩm đã chọn."}
+    return {"recommendations": recommendations}
+
+
+def compute_customer_segments(df, n_clusters):
+    if df.empty:
+        raise TaskError(400, "Không có dữ liệu hoặc dữ liệu bị lỗi để phân đoạn khách hàng.")
+
+    # RFM được cộng dồn từ các dòng thô mới thay vì tính lại trên toàn bộ lịch sử
+    with stage("main_api", "segment_customers", "aggregate"):
+        _rfm.update(_snapshot.loader.frame, _snapshot.loader.generation)
+        rfm_df = _rfm.rfm()
+    if rfm_df.empty or rfm_df.shape[0] < n_clusters:
+        raise TaskError(400, f"Không đủ dữ liệu khách hàng để phân cụm (cần ít nhất {n_clusters} khách hàng).")
+
+    with stage("main_api", "segment_customers", "fit"):
+        segmented_rfm_df = _segmenter.segment(rfm_df, n_clusters, version=_rfm.version)
+
+    if segmented_rfm_df.empty:
+        raise TaskError(500, "Lỗi trong quá trình phân đoạn khách hàng.")
+
+    # Trả về tóm tắt của các cụm
+    cluster_summary = segmented_rfm_df.groupby('Cluster_Ranked').agg(
+        AvgRecency=('Recency', 'mean'),
+        AvgFrequency=('Frequency', 'mean'),
+        AvgMonetary=('Monetary', 'mean'),
+        NumCustomers=('CustomerID', 'nunique')
+    ).sort_values(by='AvgMonetary', ascending=False).reset_index()
+
+    return {"cluster_summary": cluster_summary}
+
+
+# Loại job -> hàm tính, nhận (df, **params)
+TASKS = {
+    "predict_sales": compute_sales_forecast,
+    "recommend_products": compute_recommendations,
+    "recommend_for_items": compute_item_recommendations,
+    "segment_customers": compute_customer_segments,
+}
+
+
+def run_task(kind, params):
+    """
+    Điểm vào của worker: lấy bản dữ liệu mới nhất rồi chạy hàm tính của loại job.
+    df là khung nông trên dữ liệu của snapshot, hàm tính có thể thêm cột mà không làm hỏng snapshot.
+    Trả về (kết quả, thời gian các công đoạn) để tiến trình API ghi vào /metrics.
+    """
+    with collect_stages() as stages:
+        frame, _ = _snapshot.get()
+        result = TASKS[kind](frame.copy(deep=False), **params)
+    return result, stages
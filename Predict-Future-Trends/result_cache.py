@@ -0,0 +1,68 @@
+import os
+import time
+from collections import OrderedDict
+
+# Số kết quả tối đa giữ trong bộ nhớ và thời gian sống của mỗi kết quả (giây)
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", 128))
+RESULT_CACHE_TTL = float(os.environ.get("RESULT_CACHE_TTL", 600))
+
+
+class ResultCache:
+    """
+    Cache kết quả mô hình theo khoá (endpoint, phiên bản dữ liệu, tham số):
+    LRU giới hạn số phần tử + hết hạn theo TTL.
+    Các request giống nhau đang chạy đồng thời được gộp ở JobManager (cùng key -> cùng job),
+    cache chỉ đếm số lần gộp qua note_coalesced().
+    """
+
+    def __init__(self, max_entries=RESULT_CACHE_MAX_ENTRIES, ttl=RESULT_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (hết hạn lúc, kết quả)
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """
+        Trả về kết quả đã cache hoặc None (không có/hết hạn).
+        """
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return entry[1]
+            del self.entries[key]
+            self.expirations += 1
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def note_coalesced(self):
+        self.coalesced += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "ttl_s": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
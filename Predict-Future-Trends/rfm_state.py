@@ -0,0 +1,187 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+from sklearn.cluster import MiniBatchKMeans
+
+# Mã khách hàng thay thế khi thiếu (xem Web-Services/validation.py) -> không tính vào RFM
+UNKNOWN_CUSTOMER_IDS = ["unknown CustomerID", "Unknown", "nan", ""]
+# Fit lại K-Means khi khoảng cách trung bình tới tâm cụm tăng quá ngưỡng này (tương đối)
+# hoặc số khách hàng tăng quá RFM_GROWTH_THRESHOLD so với lần fit trước
+RFM_DRIFT_THRESHOLD = float(os.environ.get("RFM_DRIFT_THRESHOLD", 0.15))
+RFM_GROWTH_THRESHOLD = float(os.environ.get("RFM_GROWTH_THRESHOLD", 0.2))
+RFM_RANDOM_STATE = 42
+
+FEATURES = ["Recency", "Frequency", "Monetary"]
+
+
+class RFMState:
+    """
+    Bộ tích luỹ RFM theo khách hàng, cập nhật tăng dần từ các dòng thô mới:
+    ngày mua gần nhất, số hoá đơn khác nhau, tổng tiền.
+    Thứ tự dòng thô là thứ tự ghi (IncrementalLoader), nên chỉ cần nhớ số dòng đã cộng.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rows_applied = 0
+        self.generation = None
+        self.reset()
+
+    def reset(self):
+        self.customers = pd.DataFrame(
+            {"last_purchase": pd.Series(dtype="datetime64[ns]"),
+             "invoices": pd.Series(dtype="int64"),
+             "monetary": pd.Series(dtype="float64")},
+            index=pd.Index([], name="CustomerID", dtype=object),
+        )
+        self.seen_invoices = pd.MultiIndex.from_arrays([[], []], names=["CustomerID", "invoiceNo"])
+        self.max_date = None
+        self.rows_applied = 0
+
+    def update(self, raw, generation):
+        """
+        Cộng các dòng raw.iloc[rows_applied:] vào trạng thái; tính lại từ đầu nếu generation đổi.
+        Trả về số dòng mới đã xử lý.
+        """
+        with self.lock:
+            if generation != self.generation or len(raw) < self.rows_applied:
+                self.reset()
+                self.generation = generation
+            delta = raw.iloc[self.rows_applied:]
+            self.rows_applied = len(raw)
+            if not delta.empty:
+                self._apply(delta)
+            return len(delta)
+
+    @property
+    def version(self):
+        # Định danh trạng thái hiện tại, dùng để biết kết quả gán cụm đã lưu còn đúng không
+        return self.generation, self.rows_applied
+
+    def _apply(self, delta):
+        customer = delta["customerID"].astype(object).astype(str)
+        valid = ~customer.isin(UNKNOWN_CUSTOMER_IDS) & (delta["quantity"] > 0) & delta["invoiceDate"].notna()
+        if not valid.any():
+            return
+        rows = pd.DataFrame({
+            "CustomerID": customer[valid].to_numpy(),
+            "invoiceNo": delta["invoiceNo"][valid].astype(object).astype(str).to_numpy(),
+            "invoiceDate": delta["invoiceDate"][valid].to_numpy(),
+            "total": (delta["quantity"][valid] * delta["unitPrice"][valid]).to_numpy(),
+        })
+
+        # Hoá đơn có thể trải qua nhiều lô: chỉ đếm cặp (khách, hoá đơn) chưa gặp
+        pairs = pd.MultiIndex.from_frame(rows[["CustomerID", "invoiceNo"]].drop_duplicates())
+        new_pairs = pairs.difference(self.seen_invoices, sort=False)
+        self.seen_invoices = self.seen_invoices.append(new_pairs)
+
+        grouped = rows.groupby("CustomerID", sort=False).agg(
+            last_purchase=("invoiceDate", "max"), monetary=("total", "sum")
+        )
+        grouped["invoices"] = pd.Series(new_pairs.get_level_values(0)).value_counts() \
+            .reindex(grouped.index, fill_value=0).astype("int64")
+
+        combined = grouped.join(self.customers, how="outer", lsuffix="_new")
+        self.customers = pd.DataFrame({
+            "last_purchase": combined[["last_purchase", "last_purchase_new"]].max(axis=1),
+            "invoices": combined["invoices"].fillna(0).astype("int64") + combined["invoices_new"].fillna(0).astype("int64"),
+            "monetary": combined["monetary"].fillna(0.0) + combined["monetary_new"].fillna(0.0),
+        })
+        self.customers.index.name = "CustomerID"
+        batch_max = rows["invoiceDate"].max()
+        self.max_date = batch_max if self.max_date is None else max(self.max_date, batch_max)
+
+    def rfm(self):
+        """
+        Bảng RFM hiện tại: Recency (ngày tính từ ngày cuối dữ liệu + 1), Frequency, Monetary.
+        """
+        with self.lock:
+            customers = self.customers
+            max_date = self.max_date
+        if customers.empty:
+            return pd.DataFrame(columns=["CustomerID"] + FEATURES)
+        reference = pd.Timestamp(max_date).normalize() + pd.Timedelta(days=1)
+        return pd.DataFrame({
+            "CustomerID": customers.index.to_numpy(),
+            "Recency": (reference - customers["last_purchase"]).dt.days.to_numpy(),
+            "Frequency": customers["invoices"].to_numpy(),
+            "Monetary": customers["monetary"].to_numpy(),
+        })
+
+
+class WarmSegmenter:
+    """
+    MiniBatchKMeans trên log1p(RFM) đã chuẩn hoá, giữ mô hình theo từng n_clusters.
+    Lần sau chỉ gán cụm bằng tâm cụm cũ; fit lại (khởi tạo từ tâm cụm cũ) khi độ lệch vượt ngưỡng.
+    """
+
+    def __init__(self, drift_threshold=RFM_DRIFT_THRESHOLD, growth_threshold=RFM_GROWTH_THRESHOLD):
+        self.drift_threshold = drift_threshold
+        self.growth_threshold = growth_threshold
+        self.models = {}       # n_clusters -> dict(model, mean, std, distance, customers, rank)
+        self.assignments = {}  # n_clusters -> (phiên bản RFM, bảng đã gán cụm)
+        self.refits = 0
+
+    @staticmethod
+    def transform(rfm, mean=None, std=None):
+        values = np.log1p(rfm[FEATURES].to_numpy(dtype="float64").clip(min=0))
+        if mean is None:
+            mean = values.mean(axis=0)
+            std = values.std(axis=0)
+            std[std == 0] = 1.0
+        return (values - mean) / std, mean, std
+
+    def _fit(self, rfm, n_clusters, previous=None):
+        X, mean, std = self.transform(rfm)
+        if previous is not None:
+            # Khởi tạo từ tâm cụm cũ (đưa về thang chuẩn hoá mới)
+            centers = previous["model"].cluster_centers_ * previous["std"] + previous["mean"]
+            init, n_init = (centers - mean) / std, 1
+        else:
+            init, n_init = "k-means++", 3
+        model = MiniBatchKMeans(n_clusters=n_clusters, init=init, n_init=n_init,
+                                random_state=RFM_RANDOM_STATE, batch_size=2048)
+        model.fit(X)
+        labels = model.labels_
+        distances = np.linalg.norm(X - model.cluster_centers_[labels], axis=1)
+
+        # Xếp hạng cụm theo Monetary trung bình tăng dần: 0 = nhóm giá trị thấp nhất
+        monetary = pd.Series(rfm["Monetary"].to_numpy()).groupby(labels).mean() \
+            .reindex(range(n_clusters), fill_value=0.0)
+        rank = np.empty(n_clusters, dtype="int64")
+        rank[monetary.sort_values(kind="stable").index.to_numpy()] = np.arange(n_clusters)
+        self.refits += 1
+        return {"model": model, "mean": mean, "std": std, "distance": float(distances.mean()),
+                "customers": len(rfm), "rank": rank}, labels
+
+    def segment(self, rfm, n_clusters, version=None):
+        """
+        Trả về bản sao rfm kèm Cluster và Cluster_Ranked.
+        Nếu RFM chưa đổi (cùng version) thì dùng lại kết quả gán cụm đã lưu.
+        """
+        stored = self.assignments.get(n_clusters)
+        if version is not None and stored is not None and stored[0] == version:
+            return stored[1]
+
+        state = self.models.get(n_clusters)
+        labels = None
+        if state is not None:
+            X, _, _ = self.transform(rfm, state["mean"], state["std"])
+            labels = state["model"].predict(X)
+            distance = float(np.linalg.norm(X - state["model"].cluster_centers_[labels], axis=1).mean())
+            drift = distance / state["distance"] - 1 if state["distance"] else np.inf
+            growth = len(rfm) / state["customers"] - 1 if state["customers"] else np.inf
+            if drift > self.drift_threshold or growth > self.growth_threshold:
+                state, labels = self._fit(rfm, n_clusters, previous=state)
+                self.models[n_clusters] = state
+        else:
+            state, labels = self._fit(rfm, n_clusters)
+            self.models[n_clusters] = state
+
+        segmented = rfm.copy()
+        segmented["Cluster"] = labels
+        segmented["Cluster_Ranked"] = state["rank"][labels]
+        self.assignments[n_clusters] = (version, segmented)
+        return segmented
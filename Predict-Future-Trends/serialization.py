@@ -0,0 +1,179 @@
+import base64
+import binascii
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from segment_store import DATE_FORMAT
+
+try:
+    import orjson
+except ImportError:  # Không có orjson thì dùng json chuẩn (chậm hơn, cùng kết quả)
+    orjson = None
+
+# Mã hoá kết quả của API theo header Accept. Kết quả là dict, bảng lớn (luật, dự đoán...) để nguyên
+# DataFrame đến bước này và được mã hoá theo cột, không qua to_dict(orient="records"):
+#   application/json                      -> một object JSON, bảng thành danh sách dòng
+#   application/x-ndjson                  -> mỗi dòng của bảng một dòng JSON, dòng cuối {"summary": phần còn lại}
+#   application/vnd.apache.arrow.stream   -> Arrow IPC stream của bảng, phần còn lại nằm trong metadata "content"
+
+JSON = "application/json"
+NDJSON = "application/x-ndjson"
+ARROW = "application/vnd.apache.arrow.stream"
+MEDIA_TYPES = (JSON, NDJSON, ARROW)
+
+NDJSON_CHUNK_ROWS = int(os.environ.get("NDJSON_CHUNK_ROWS", 10_000))  # Số dòng mã hoá mỗi lần khi stream
+
+
+def negotiate(accept, offered=MEDIA_TYPES):
+    """
+    Chọn kiểu trả về trong offered theo header Accept (có q); không có header hoặc */* thì lấy kiểu đầu tiên.
+    Trả về None nếu client không nhận kiểu nào.
+    """
+    if not accept:
+        return offered[0]
+    choices = []
+    for i, part in enumerate(accept.split(",")):
+        media, *options = [item.strip() for item in part.split(";")]
+        q = 1.0
+        for option in options:
+            name, _, value = option.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            choices.append((-q, i, media.lower()))
+    for _, _, media in sorted(choices):
+        if media in offered:
+            return media
+        if media == "*/*":
+            return offered[0]
+        if media.endswith("/*"):
+            for candidate in offered:
+                if candidate.startswith(media[:-1]):
+                    return candidate
+    return None
+
+
+def table_key(content):
+    # Khoá của bảng (DataFrame) đầu tiên trong kết quả, None nếu kết quả không có bảng
+    for key, value in content.items():
+        if isinstance(value, pd.DataFrame):
+            return key
+    return None
+
+
+# ------------------------------------------------------------ JSON
+def column_values(series):
+    """
+    Giá trị của một cột dưới dạng list Python thuần (không còn NumPy scalar/Timestamp), NaN/NaT -> None.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        categories = np.asarray(series.cat.categories, dtype=object)
+        codes = series.cat.codes.to_numpy()
+        values = categories[codes]
+        if (codes < 0).any():
+            values[codes < 0] = None
+        return values.tolist()
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        return series.dt.strftime(DATE_FORMAT).astype(object).where(series.notna(), None).tolist()
+    if series.hasnans:
+        return series.astype(object).where(series.notna(), None).tolist()
+    return series.tolist()
+
+
+def frame_records(frame):
+    names = [str(name) for name in frame.columns]
+    columns = [column_values(frame[name]) for name in frame.columns]
+    return [dict(zip(names, row)) for row in zip(*columns)]
+
+
+def _default(value):
+    if isinstance(value, pd.DataFrame):
+        return frame_records(value)
+    if isinstance(value, pd.Timestamp):
+        return value.strftime(DATE_FORMAT) if not pd.isna(value) else None
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    raise TypeError(f"Không mã hoá được kiểu {type(value).__name__}")
+
+
+if orjson is not None:
+    _OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+    def encode_json(content):
+        return orjson.dumps(content, default=_default, option=_OPTIONS)
+
+    def encode_line(content):
+        return orjson.dumps(content, default=_default, option=_OPTIONS | orjson.OPT_APPEND_NEWLINE)
+else:
+    def encode_json(content):
+        return json.dumps(content, default=_default, ensure_ascii=False).encode("utf-8")
+
+    def encode_line(content):
+        return encode_json(content) + b"\n"
+
+
+# ------------------------------------------------------------ NDJSON
+def iter_ndjson(content, chunk_rows=NDJSON_CHUNK_ROWS):
+    """
+    Sinh các khối byte NDJSON: từng dòng của bảng (mã hoá theo khối chunk_rows dòng), dòng cuối là tóm tắt.
+    Kết quả không có bảng thì chỉ có một dòng.
+    """
+    key = table_key(content)
+    if key is None:
+        yield encode_line(content)
+        return
+    frame = content[key]
+    for start in range(0, len(frame), chunk_rows):
+        yield b"".join(encode_line(record) for record in frame_records(frame.iloc[start:start + chunk_rows]))
+    yield encode_line({"summary": {k: v for k, v in content.items() if k != key}})
+
+
+# ------------------------------------------------------------ Arrow
+def encode_arrow(content):
+    """
+    Arrow IPC stream của bảng trong kết quả (None nếu không có bảng); các khoá còn lại ghi vào
+    metadata "content" của schema dưới dạng JSON.
+    """
+    key = table_key(content)
+    if key is None:
+        return None
+    table = pa.Table.from_pandas(content[key], preserve_index=False)
+    rest = {k: v for k, v in content.items() if k != key}
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b"content": encode_json(rest)})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+# ------------------------------------------------------------ phân trang
+def encode_cursor(version, offset, params):
+    """
+    Cursor mờ cho trang kế tiếp: phiên bản dữ liệu (để các trang cùng một bản kết quả),
+    vị trí bắt đầu và tham số lọc/sắp đã dùng.
+    """
+    raw = json.dumps({"v": version, "o": offset, "p": params}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Trả về (phiên bản, vị trí, tham số); ValueError nếu cursor không hợp lệ.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        return data["v"], int(data["o"]), data["p"]
+    except (binascii.Error, UnicodeDecodeError, ValueError, KeyError, TypeError):
+        raise ValueError("cursor không hợp lệ")
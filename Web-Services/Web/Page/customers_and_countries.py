@@ -1,8 +1,12 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
-from pandas.tseries.frequencies import to_offset
-def render_chart_page_customers(df: pd.DataFrame):
+from query_client import QueryClient
+
+# Cửa sổ từ mức này trở lên lấy Top 10 từ sketch Space-Saving thay vì groupby + sort
+SKETCH_MIN_WINDOW = pd.Timedelta(hours=24)
+
+def render_chart_page_customers(client: QueryClient):
 
     #------------------------------------------------------------------------
     data_type = st.sidebar.selectbox(
@@ -13,19 +17,14 @@ def render_chart_page_customers(df: pd.DataFrame):
         "⏱️ Khoảng thời gian nhóm",
         ["30min", "1H", "8H", "1D", "1W"]
     )
-    df["invoiceDate"] = pd.to_datetime(df["invoiceDate"], errors="coerce")
-    df = df.dropna(subset=["invoiceDate"])
-    df = df.set_index("invoiceDate")
-    df["total"] = df["quantity"] * df["unitPrice"]
-    if data_type == "Quantity":
-        grouped = df["quantity"].resample(resample_rule).sum().reset_index()
-    else:
-        grouped = df["total"].resample(resample_rule).sum().reset_index()
-
-    grouped["time_label"] = grouped["invoiceDate"].dt.strftime("%Y-%m-%d %H:%M")
+    # Mọi phép lọc/nhóm chạy ở server (/api/query), trang chỉ nhận kết quả đã tổng hợp
+    bounds = client.bounds()
+    if bounds is None:
+        st.warning("Không có dữ liệu được truyền vào")
+        return
 
         # Tính khoảng thời gian gần nhất cần giữ lại
-    max_time = df.index.max()
+    max_time = bounds[1]
     if resample_rule == "30min":
         time_delta = pd.Timedelta(minutes=30)
     elif resample_rule == "1H":
@@ -40,24 +39,18 @@ def render_chart_page_customers(df: pd.DataFrame):
         time_delta = pd.Timedelta(days=1)  # fallback
 
     min_time = max_time - time_delta
-    recent_df = df[(df.index > min_time) & (df.index <= max_time)]
     start_str = min_time.strftime("%Y-%m-%d %H:%M")
     end_str = max_time.strftime("%Y-%m-%d %H:%M")
 
-    # Lọc dữ liệu trong khoảng thời gian gần nhất
-    recent_df = df[(df.index > min_time) & (df.index <= max_time)]
-
 
 
     #-------------------------------------------------------
     # --- Biểu đồ tròn theo quốc gia ---
     st.subheader("🌍 Biểu đồ tròn theo quốc gia")
     st.markdown(f"Biểu đồ tròn theo quốc gia theo {data_type.lower()} ({start_str} → {end_str})")
-    # Nhóm theo quốc gia và tính tổng
-    if data_type == "Quantity":
-        country_data = recent_df.groupby("country")["quantity"].sum().reset_index()
-    else:
-        country_data = recent_df.groupby("country")["total"].sum().reset_index()
+    # Nhóm theo quốc gia tại server (đọc rollup đã tổng hợp sẵn lúc ingest)
+    value_col = "quantity" if data_type == "Quantity" else "total"
+    country_data, _ = client.query(start=min_time, end=max_time, group_by=["country"], metric=value_col)
 
     # Sắp xếp và vẽ biểu đồ tròn
     country_data = country_data.sort_values(by=country_data.columns[1], ascending=False)
@@ -77,22 +70,26 @@ def render_chart_page_customers(df: pd.DataFrame):
     # ------------------------------------------------------------------------------------
     st.subheader("👤 Top khách hàng theo tổng chi tiêu")
 
-    # Gộp các customerID null thành 'Unknown'
-    customer_df = recent_df.copy()
-    customer_df["customerID"] = customer_df["customerID"].fillna("Unknown")
-    customer_df["customerID"] = customer_df["customerID"].astype(str)
+    top_n = 10
 
-    customer_spending = customer_df.groupby("customerID")["total"].sum().reset_index()
-    customer_spending = customer_spending.rename(columns={"total": "total_spent"})
+    def customer_top(order, approximate=False):
+        # Nhóm theo khách hàng và chọn Top tại server (giữ nhóm null, hiển thị là 'Unknown')
+        customers, _ = client.query(
+            start=min_time, end=max_time, group_by=["customerID"], metric="total",
+            top=top_n, order=order, approximate=approximate,
+        )
+        customers["customerID"] = customers["customerID"].fillna("Unknown").astype(str)
+        return customers.rename(columns={"total": "total_spent"})
 
-    top_n = 10
+    exact_top = st.sidebar.checkbox("🎯 Top chính xác (không dùng sketch)", value=False, key="exact_top")
     col1, col2 = st.columns(2)
 
     with col1:
         st.markdown(f"Top 10 khách hàng chi tiêu cao nhất theo {data_type.lower()} ({start_str} → {end_str})")
 
         # Tạo cột xếp hạng để hiển thị thứ tự
-        top_customers = customer_spending.sort_values(by="total_spent", ascending=False).head(top_n).copy()
+        # Top: đọc sketch đã duy trì lúc ingest (O(K)); có thể bật chế độ chính xác trong sidebar
+        top_customers = customer_top("desc", approximate=not exact_top and max_time - min_time >= SKETCH_MIN_WINDOW)
         top_customers["Thứ tự"] = range(1, len(top_customers) + 1)
 
         fig_top_customers = px.bar(
@@ -110,7 +107,8 @@ def render_chart_page_customers(df: pd.DataFrame):
     with col2:
         st.markdown(f"Top 10 khách hàng chi tiêu thấp nhất theo {data_type.lower()}  ({start_str} → {end_str})")
 
-        bottom_customers = customer_spending.sort_values(by="total_spent", ascending=True).head(top_n).copy()
+        # Sketch chỉ giữ khoá lớn nên Top thấp nhất vẫn tính chính xác (chọn từng phần, không sort cả bảng)
+        bottom_customers = customer_top("asc")
         bottom_customers["Thứ tự"] = range(1, len(bottom_customers) + 1)
 
         fig_bottom_customers = px.bar(
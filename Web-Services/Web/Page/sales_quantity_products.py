@@ -1,8 +1,75 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
+from downsampling import SCATTER_MAX_POINTS
+from query_client import QueryClient
+
+# Cửa sổ từ mức này trở lên lấy Top 10 từ sketch Space-Saving thay vì groupby + sort
+SKETCH_MIN_WINDOW = pd.Timedelta(hours=24)
+# Chế độ biểu đồ phân tán -> mode của /api/scatter
+SCATTER_MODES = {
+    "Tự động (toàn bộ, nhiều điểm thì lưới 2D)": "auto",
+    "Lấy mẫu (giữ ngoại lai)": "sample",
+    "Lưới 2D": "bins",
+    "Toàn bộ điểm": "all",
+}
+
+def time_window(time_range_option, min_data_time, max_time):
+    # (tần suất lấy mẫu, thời điểm bắt đầu) của khoảng thời gian hiển thị
+    if time_range_option == "60 phút gần nhất":
+        return "1min", max_time - pd.Timedelta(minutes=60)
+    if time_range_option == "24 giờ gần nhất":
+        return "1h", max_time - pd.Timedelta(hours=24)
+    if time_range_option == "1 tuần gần nhất":
+        return "8h", max_time - pd.Timedelta(days=7)
+    if time_range_option == "12 tháng gần nhất":
+        return "MS", max_time - pd.DateOffset(months=12)
+    return "1h", min_data_time
+
+def render_timeseries(client, time_range_option, y_col, live_marker=None):
+    """
+    Tổng tiền và biểu đồ đường theo thời gian. Chạy trong fragment riêng: khi realtime, chỉ phần này
+    chạy lại mỗi chu kỳ và chỉ truy vấn lại khi live_marker() đổi (có dòng mới).
+    """
+    marker = live_marker() if live_marker else None
+    cached = st.session_state.get("sales_timeseries")
+    if marker is not None and cached and cached[0] == (time_range_option, y_col, marker):
+        totals, info, grouped = cached[1]
+    else:
+        totals, info = client.query(metric="total")
+        if info["bounds"] is None:
+            return
+        freq, min_time = time_window(
+            time_range_option, pd.Timestamp(info["bounds"]["min"]), pd.Timestamp(info["bounds"]["max"])
+        )
+        # Nhóm theo bucket thời gian tại server (đọc rollup, chỉ các partition trong cửa sổ)
+        grouped, _ = client.query(start=min_time, end=pd.Timestamp(info["bounds"]["max"]), bucket=freq, metric=y_col)
+
+        # Định dạng thời gian hiển thị
+        if freq == "MS":
+            grouped["time_label"] = grouped["bucket"].dt.strftime("%Y-%m")
+        else:
+            grouped["time_label"] = grouped["bucket"].dt.strftime("%Y-%m-%d %H:%M")
+        st.session_state.sales_timeseries = ((time_range_option, y_col, marker), (totals, info, grouped))
+
+    # Tổng tiền toàn bộ
+    start_time = pd.Timestamp(info["bounds"]["min"]).strftime("%Y-%m-%d %H:%M")
+    end_time = pd.Timestamp(info["bounds"]["max"]).strftime("%Y-%m-%d %H:%M")
+    total_amount = totals["total"].sum()
 
-def render_chart_page_sales(df: pd.DataFrame):
+    st.markdown(
+        f"### 💰 Tổng tiền: **£{total_amount:,.2f}** (Từ `{start_time}` đến `{end_time}`)"
+    )
+
+    # Biểu đồ
+    st.subheader(f"📉 Biểu đồ đường theo thời gian ({time_range_option.lower()}) (`{start_time}` - > `{end_time}`) ")
+    st.line_chart(grouped.set_index("time_label")[y_col], use_container_width=True)
+
+def render_chart_page_sales(client: QueryClient, live_marker=None, refresh=None):
+    """
+    live_marker: hàm trả về dấu hiệu dữ liệu mới (None khi tắt realtime); refresh: chu kỳ (giây)
+    chạy lại riêng biểu đồ đường. Các biểu đồ còn lại chỉ vẽ lại khi cả trang chạy lại.
+    """
     st.title("📊 Biểu đồ thống kê")
 
     # Sidebar: chọn kiểu dữ liệu hiển thị
@@ -19,79 +86,71 @@ def render_chart_page_sales(df: pd.DataFrame):
         key="time_range_option"
     )
 
-    # Tính total
-    df["total"] = df["quantity"] * df["unitPrice"]
-    df["invoiceDate"] = pd.to_datetime(df["invoiceDate"])
-    df = df.set_index("invoiceDate").sort_index()
+    # Mọi phép lọc/nhóm chạy ở server (/api/query), trang chỉ nhận kết quả đã tổng hợp
+    y_col = "quantity" if data_type == "Quantity" else "total"
+    bounds = client.bounds()
+    if bounds is None:
+        st.warning("Không có dữ liệu được truyền vào")
+        return
 
     # Lấy thời gian hiện tại
-    max_time = df.index.max()
-
-    # Thiết lập khoảng thời gian và tần suất lấy mẫu
-    if time_range_option == "60 phút gần nhất":
-        freq = "1min"
-        min_time = max_time - pd.Timedelta(minutes=60)
-    elif time_range_option == "24 giờ gần nhất":
-        freq = "1H"
-        min_time = max_time - pd.Timedelta(hours=24)
-    elif time_range_option == "1 tuần gần nhất":
-        freq = "8H"
-        min_time = max_time - pd.Timedelta(days=7)
-    elif time_range_option == "12 tháng gần nhất":
-        freq = "1M"
-        min_time = max_time - pd.DateOffset(months=12)
-    else:
-        freq = "1H"
-        min_time = df.index.min()
-
-    # Cắt khoảng thời gian
-    recent_df = df[(df.index > min_time) & (df.index <= max_time)]
+    min_data_time, max_time = bounds
 
-    # Nhóm và gán nhãn
-    if data_type == "Quantity":
-        grouped = recent_df["quantity"].resample(freq).sum().reset_index()
-        y_col = "quantity"
-    else:
-        grouped = recent_df["total"].resample(freq).sum().reset_index()
-        y_col = "total"
+    # Khoảng thời gian của các biểu đồ bên dưới (tần suất lấy mẫu chỉ dùng cho biểu đồ đường)
+    _, min_time = time_window(time_range_option, min_data_time, max_time)
+    start_time = min_data_time.strftime("%Y-%m-%d %H:%M")
+    end_time = max_time.strftime("%Y-%m-%d %H:%M")
 
-    # Định dạng thời gian hiển thị
-    if freq in ["1min", "1H", "8H"]:
-        grouped["time_label"] = grouped["invoiceDate"].dt.strftime("%Y-%m-%d %H:%M")
-    elif freq == "1M":
-        grouped["time_label"] = grouped["invoiceDate"].dt.strftime("%Y-%m")
-
-    # Tổng tiền toàn bộ
-    start_time = df.index.min().strftime("%Y-%m-%d %H:%M")
-    end_time = df.index.max().strftime("%Y-%m-%d %H:%M")
-    total_amount = df["total"].sum()
-
-    st.markdown(
-        f"### 💰 Tổng tiền: **£{total_amount:,.2f}** (Từ `{start_time}` đến `{end_time}`)"
+    # Tổng tiền và biểu đồ đường cập nhật theo luồng realtime mà không chạy lại cả trang
+    st.fragment(run_every=refresh if live_marker else None)(render_timeseries)(
+        client, time_range_option, y_col, live_marker
     )
 
-    # Biểu đồ
-    st.subheader(f"📉 Biểu đồ đường theo thời gian ({time_range_option.lower()}) (`{start_time}` - > `{end_time}`) ")
-    st.line_chart(grouped.set_index("time_label")[y_col], use_container_width=True)
-
 
 
     # ------------------------------------------------------------------------------
     st.subheader("📌 Biểu đồ phân tán: Giá cả vs Số lượng")
 
-    scatter_df = recent_df.copy()
-    scatter_df = scatter_df[(scatter_df["unitPrice"] > 0) & (scatter_df["quantity"] > 0)]
+    scatter_mode = st.sidebar.selectbox(
+        "🔬 Chế độ biểu đồ phân tán",
+        list(SCATTER_MODES),
+        key="scatter_mode"
+    )
+    max_points = st.sidebar.number_input(
+        "Số điểm tối đa trước khi giảm mẫu", min_value=500, value=SCATTER_MAX_POINTS, step=500, key="scatter_max_points"
+    )
+
+    # Server lọc điểm dương trong cửa sổ và giảm mẫu/gộp lưới trước khi gửi về
+    scatter_df, scatter_info = client.scatter(min_time, max_time, SCATTER_MODES[scatter_mode], int(max_points))
+    total_points = scatter_info["total_points"]
 
     if scatter_df.empty:
         st.warning("Không có dữ liệu phù hợp để hiển thị biểu đồ phân tán.")
+    elif scatter_info["mode"] == "bins":
+        fig_scatter = px.scatter(
+            scatter_df,
+            x="unitPrice",
+            y="quantity",
+            size="count",
+            color="count",
+            log_x=True,
+            log_y=True,
+            labels={"unitPrice": "Giá sản phẩm (£)", "quantity": "Số lượng bán", "count": "Số dòng"},
+            title=f"Mật độ Giá - Số lượng bán trên lưới 2D ({total_points:,} dòng) (`{start_time}` - > `{end_time}`)",
+        )
+        st.plotly_chart(fig_scatter, use_container_width=True)
     else:
+        # Chế độ lấy mẫu giảm điểm khi vượt ngưỡng để payload gửi lên trình duyệt không phình to
+        if len(scatter_df) < total_points:
+            st.caption(f"Hiển thị {len(scatter_df):,}/{total_points:,} điểm (lấy mẫu, giữ các điểm ngoại lai).")
+
         fig_scatter = px.scatter(
             scatter_df,
             x="unitPrice",
             y="quantity",
             hover_data=["stockCode", "description"],
             labels={"unitPrice": "Giá sản phẩm (£)", "quantity": "Số lượng bán"},
-            title="Mối quan hệ giữa Giá và Số lượng bán (`{start_time}` - > `{end_time}`)",
+            title=f"Mối quan hệ giữa Giá và Số lượng bán (`{start_time}` - > `{end_time}`)",
             opacity=0.6,
         )
         fig_scatter.update_traces(marker=dict(size=6, line=dict(width=0.5, color='DarkSlateGrey')))
@@ -105,23 +164,22 @@ def render_chart_page_sales(df: pd.DataFrame):
     chart_label = "Quantity" if data_type == "Quantity" else "Total (£)"
     col1, col2 = st.columns(2)
 
-    # Lọc dữ liệu gần nhất (đã có recent_df)
-    product_df = recent_df.copy()
-
-    # Nhóm và tính tổng
-    if data_type == "Quantity":
-        product_data = product_df.groupby(["stockCode", "description"])["quantity"].sum().reset_index()
-        product_data = product_data.rename(columns={"quantity": "value"})
-    else:
-        product_data = product_df.groupby(["stockCode", "description"])["total"].sum().reset_index()
-        product_data = product_data.rename(columns={"total": "value"})
+    def product_top(order, approximate=False):
+        # Nhóm theo sản phẩm và chọn Top 10 tại server, chỉ nhận về 10 dòng
+        products, _ = client.query(
+            start=min_time, end=max_time, group_by=["stockCode", "description"], metric=y_col,
+            top=10, order=order, approximate=approximate,
+        )
+        products = products.rename(columns={y_col: "value"})
+        products["product_label"] = products["stockCode"].astype(str) + " - " + products["description"].astype(str)
+        return products
 
-    # Gắn nhãn sản phẩm
-    product_data["product_label"] = product_data["stockCode"] + " - " + product_data["description"]
+    # Top: đọc sketch đã duy trì lúc ingest (O(K)); có thể bật chế độ chính xác trong sidebar
+    exact_top = st.sidebar.checkbox("🎯 Top chính xác (không dùng sketch)", value=False, key="exact_top")
+    top_products = product_top("desc", approximate=not exact_top and max_time - min_time >= SKETCH_MIN_WINDOW)
 
     with col1:
         st.markdown("#### 🏆 Top 10 sản phẩm bán **chạy nhất**")
-        top_products = product_data.sort_values(by="value", ascending=False).head(10)
 
         fig_bar_top = px.bar(
             top_products,
@@ -135,7 +193,8 @@ def render_chart_page_sales(df: pd.DataFrame):
 
     with col2:
         st.markdown("#### 📉 Top 10 sản phẩm bán **tệ nhất**")
-        bottom_products = product_data.sort_values(by="value", ascending=True).head(10)
+        # Sketch chỉ giữ khoá lớn nên Top thấp nhất vẫn tính chính xác (chọn từng phần, không sort cả bảng)
+        bottom_products = product_top("asc")
 
         fig_bar_bottom = px.bar(
             bottom_products,
@@ -1,9 +1,26 @@
 import streamlit as st
 import pandas as pd
-import json
-from streamlit_autorefresh import st_autorefresh
+import os
+import time
 from Page.sales_quantity_products import render_chart_page_sales as render_chart_sales
 from Page.customers_and_countries import render_chart_page_customers as render_chart_customers
+from live_client import LiveSubscriber
+from query_client import QueryClient
+from segment_store import data_signature
+from metrics import serve_metrics, stage, start_profiler_from_env
+
+# Thư mục chứa segments/ do Web-Services ghi ra
+DATA_DIR = os.environ.get("RETAIL_DATA_DIR", os.path.dirname(os.path.abspath(__file__)))
+# Cổng phục vụ /metrics của dashboard (Streamlit không có API riêng); bỏ trống thì không bật
+METRICS_PORT = os.environ.get("DASHBOARD_METRICS_PORT")
+# Luồng sự kiện (SSE) của Web-Services; chu kỳ kiểm tra (giây) chỉ đọc trạng thái trong bộ nhớ
+LIVE_STREAM_URL = os.environ.get("LIVE_STREAM_URL", "http://localhost:8000/api/stream")
+LIVE_CHECK_INTERVAL = float(os.environ.get("LIVE_CHECK_INTERVAL", 1))
+# Khoảng cách tối thiểu (giây) giữa hai lần chạy lại cả trang khi có dữ liệu mới; giữa hai lần đó
+# chỉ các fragment realtime (biểu đồ đường, bảng luồng realtime) tự cập nhật
+LIVE_FULL_RERUN_INTERVAL = float(os.environ.get("LIVE_FULL_RERUN_INTERVAL", 30))
+# API truy vấn tổng hợp của Web-Services; không kết nối được thì truy vấn thẳng trên DATA_DIR
+QUERY_API_URL = os.environ.get("QUERY_API_URL", "http://localhost:8000/api")
 
 
 
@@ -18,7 +35,7 @@ page = st.sidebar.radio(
 
 st.sidebar.markdown("---")
 st.sidebar.write("⚙️ Setting")
-# 🚀 Chỉ thực hiện autorefresh nếu đang bật realtime
+# 🚀 Chỉ cập nhật khi đang bật realtime
 if "realtime" not in st.session_state:
     st.session_state.realtime = True
 
@@ -26,51 +43,96 @@ if "realtime" not in st.session_state:
 if st.sidebar.button("🔁 Tắt Realtime" if st.session_state.realtime else "▶️ Turn on realtime"):
     st.session_state.realtime = not st.session_state.realtime
 
-# ✅ CHỈ GỌI MỘT LẦN nếu realtime đang bật
-if st.session_state.realtime:
-    from streamlit_autorefresh import st_autorefresh
-    st_autorefresh(interval=2000, key="realtime_refresh")
-
-# Hàm đọc dữ liệu
-def read_data(path="received_data.jsonl"):
-    rows = []
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            for line in f:
-                rows.append(json.loads(line))
-        return pd.DataFrame(rows)
-    except Exception as e:
-        st.error(f"Lỗi đọc file: {e}")
-        return pd.DataFrame()
-
-# Đọc dữ liệu
-df = read_data()
+# Một kết nối SSE cho cả tiến trình, mọi phiên dùng chung
+@st.cache_resource
+def get_subscriber(url):
+    return LiveSubscriber(url).start()
+
+def live_marker():
+    # Vị trí dòng mới nhất theo SSE; mất kết nối thì dùng dấu hiệu file (manifest + log) thay thế
+    marker = get_subscriber(LIVE_STREAM_URL).marker()
+    return ("sse", marker) if marker is not None else ("file", data_signature(DATA_DIR))
+
+# Ghi nhận trạng thái dữ liệu trước khi đọc, để không bỏ sót dòng ghi trong lúc đang vẽ
+st.session_state.live_marker = live_marker()
+st.session_state.full_run_at = time.monotonic()
+
+@st.fragment(run_every=LIVE_CHECK_INTERVAL)
+def watch_updates():
+    """
+    Chạy lại riêng phần này mỗi LIVE_CHECK_INTERVAL giây; chỉ chạy lại cả trang khi có dữ liệu mới
+    và lần chạy lại cả trang gần nhất đã cách ít nhất LIVE_FULL_RERUN_INTERVAL giây.
+    """
+    marker = live_marker()
+    if (marker != st.session_state.live_marker
+            and time.monotonic() - st.session_state.full_run_at >= LIVE_FULL_RERUN_INTERVAL):
+        st.rerun()
+    st.caption("🟢 Realtime (SSE)" if marker[0] == "sse" else "🟡 Realtime (theo dõi file, chưa kết nối SSE)")
 
-# Xử lý dữ liệu nếu có
-if not df.empty and "invoiceDate" in df.columns:
-    df["invoiceDate"] = pd.to_datetime(df["invoiceDate"], errors="coerce")
-    df = df.dropna(subset=["invoiceDate"])
-    df["minute"] = df["invoiceDate"].dt.strftime("%Y-%m-%d %H:%M")
-
-    if "CustomerID" in df.columns:
-        df["CustomerID"] = df["CustomerID"].astype(str)
+if st.session_state.realtime:
+    watch_updates()
 
-    grouped = df.groupby("minute")["quantity"].sum().reset_index()
+# Server /metrics và profiler lấy mẫu: khởi động một lần cho cả tiến trình Streamlit
+@st.cache_resource
+def start_instrumentation():
+    start_profiler_from_env("dashboard")
+    return serve_metrics(int(METRICS_PORT)) if METRICS_PORT else None
 
-    if page == "Sales,Quantily and Products":
-        render_chart_sales(df)
+start_instrumentation()
 
-    elif page == "Customers and Countries":
-        render_chart_customers(df)
+# Client truy vấn dùng chung cho mọi phiên: các trang chỉ nhận kết quả đã tổng hợp, không giữ dòng thô
+@st.cache_resource
+def get_query_client(url, path):
+    return QueryClient(url, path)
 
-    # Trang 3: Thông tin
-    elif page == "Information":
-        st.title("ℹ️ Thông tin hệ thống")
-        st.markdown("""
-        - ✅ Dashboard realtime dữ liệu từ FastAPI.
-        - 🔄 Tự động làm mới mỗi giây.
-        - 📁 File dữ liệu: `received_data.jsonl`.
-        """)
+client = get_query_client(QUERY_API_URL, DATA_DIR)
 
-else:
-    st.warning("Không có dữ liệu được truyền vào")
+def render_page(render, name, live=False):
+    # live: trang có fragment realtime riêng (nhận hàm live_marker và chu kỳ kiểm tra)
+    options = {}
+    if live and st.session_state.realtime:
+        options = {"live_marker": live_marker, "refresh": LIVE_CHECK_INTERVAL}
+    try:
+        with stage("dashboard", name, "render"):
+            render(client, **options)
+    except Exception as e:
+        st.error(f"Lỗi truy vấn dữ liệu: {e}")
+    if client.last_source == "local":
+        st.sidebar.caption("🟡 Truy vấn cục bộ (chưa kết nối API)")
+
+if page == "Sales,Quantily and Products":
+    render_page(render_chart_sales, "sales", live=True)
+
+elif page == "Customers and Countries":
+    render_page(render_chart_customers, "customers")
+
+# Trang 3: Thông tin
+elif page == "Information":
+    st.title("ℹ️ Thông tin hệ thống")
+    st.markdown("""
+    - ✅ Dashboard realtime dữ liệu từ FastAPI.
+    - 🔄 Nhận thay đổi qua Server-Sent Events (`/api/stream`), chỉ vẽ lại khi có dữ liệu mới.
+    - 📁 Dữ liệu: segment Parquet trong thư mục `segments/`.
+    - 📊 Các trang lọc/nhóm dữ liệu tại server qua `/api/query`, `/api/scatter`, chỉ nhận kết quả đã tổng hợp.
+    """)
+
+    # Trạng thái cộng dồn từ các sự kiện delta (không đọc file), vẽ lại trong fragment riêng
+    @st.fragment(run_every=LIVE_CHECK_INTERVAL if st.session_state.realtime else None)
+    def live_panel():
+        subscriber = get_subscriber(LIVE_STREAM_URL)
+        with subscriber.lock:
+            position = subscriber.position
+            records = list(subscriber.records)[-20:]
+            buckets = list(subscriber.buckets.items())[-60:]
+        st.subheader("📡 Luồng realtime")
+        st.write(f"Kết nối: {'🟢' if subscriber.connected else '🔴'} · Tổng số dòng đã ghi: {position if position is not None else '—'}")
+        if buckets:
+            live = pd.DataFrame(
+                [(bucket, quantity, total) for bucket, (quantity, total) in buckets],
+                columns=["bucket", "quantity", "total"],
+            )
+            st.bar_chart(live.set_index("bucket")["quantity"])
+        if records:
+            st.dataframe(pd.DataFrame(records[::-1]), use_container_width=True)
+
+    live_panel()
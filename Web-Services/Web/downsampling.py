@@ -0,0 +1,48 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# Số điểm tối đa gửi nguyên trạng lên biểu đồ phân tán, vượt quá sẽ tự động giảm mẫu
+SCATTER_MAX_POINTS = int(os.environ.get("SCATTER_MAX_POINTS", 5000))
+# Tỉ lệ điểm ngoại lai (theo x hoặc y) luôn được giữ lại khi lấy mẫu
+OUTLIER_QUANTILE = 0.995
+HEATMAP_BINS = 60
+
+
+def sample_points(df, x, y, max_points=SCATTER_MAX_POINTS, seed=0):
+    """
+    Lấy mẫu ngẫu nhiên đều tối đa max_points điểm nhưng luôn giữ các điểm ngoại lai
+    (vượt phân vị OUTLIER_QUANTILE theo x hoặc y) để không mất đuôi phân phối.
+    """
+    if len(df) <= max_points:
+        return df
+    x_values = df[x].to_numpy()
+    y_values = df[y].to_numpy()
+    outlier = (x_values > np.quantile(x_values, OUTLIER_QUANTILE)) | (y_values > np.quantile(y_values, OUTLIER_QUANTILE))
+
+    outlier_index = np.flatnonzero(outlier)
+    rng = np.random.default_rng(seed)
+    if len(outlier_index) > max_points // 5:
+        # Quá nhiều ngoại lai: giữ những điểm xa nhất
+        score = np.maximum(x_values[outlier_index] / x_values.max(), y_values[outlier_index] / y_values.max())
+        outlier_index = outlier_index[np.argsort(score)[-(max_points // 5):]]
+
+    rest_index = np.flatnonzero(~outlier)
+    take = min(len(rest_index), max_points - len(outlier_index))
+    sample_index = rng.choice(rest_index, size=take, replace=False)
+    return df.iloc[np.sort(np.concatenate([outlier_index, sample_index]))]
+
+
+def bin_points(df, x, y, bins=HEATMAP_BINS):
+    """
+    Gộp điểm vào lưới 2D (thang log vì giá và số lượng lệch phải mạnh).
+    Trả về DataFrame (x, y, count) chỉ gồm các ô có điểm.
+    """
+    log_x = np.log10(df[x].to_numpy())
+    log_y = np.log10(df[y].to_numpy())
+    counts, x_edges, y_edges = np.histogram2d(log_x, log_y, bins=bins)
+    x_centers = 10 ** ((x_edges[:-1] + x_edges[1:]) / 2)
+    y_centers = 10 ** ((y_edges[:-1] + y_edges[1:]) / 2)
+    ix, iy = np.nonzero(counts)
+    return pd.DataFrame({x: x_centers[ix], y: y_centers[iy], "count": counts[ix, iy].astype("int64")})
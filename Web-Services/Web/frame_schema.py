@@ -0,0 +1,59 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from segment_store import parse_dates
+
+# Kiểu dữ liệu gọn cho frame giữ trong bộ nhớ (dashboard, worker của main_api):
+#   cột chuỗi -> category (mã int + danh mục dùng chung), quantity -> int32, unitPrice -> float32,
+#   invoiceDate -> datetime64 (parse một lần khi nạp, các trang không parse lại).
+
+CATEGORY_COLUMNS = ["invoiceNo", "stockCode", "description", "country", "customerID"]
+# Ngân sách bộ nhớ của frame (MB) để cảnh báo; 0 = chỉ báo cáo, không cảnh báo
+FRAME_MEMORY_BUDGET_MB = float(os.environ.get("FRAME_MEMORY_BUDGET_MB", 0))
+# float32 giữ đúng tới xu (sai số < 0.005) với giá trị tuyệt đối dưới 2^16
+FLOAT32_EXACT_CENTS = 2 ** 16
+INT32_RANGE = (np.iinfo(np.int32).min, np.iinfo(np.int32).max)
+
+
+def compact_frame(df):
+    """
+    Đổi kiểu các cột về dạng gọn (tại chỗ trên DataFrame vừa đọc) và trả về chính DataFrame đó.
+    Kiểu số luôn là int32/float32 (cả lô rỗng) để các lô nối vào nhau không đổi kiểu. Validation khi ghi
+    đã bỏ các dòng ngoài khoảng này; dữ liệu cũ có quantity vượt int32 bị kẹp về biên, unitPrice từ 2^16
+    trở lên mất phần xu. int32 * float32 vẫn cho float64 nên cột total tính trên trang không mất độ chính xác.
+    """
+    for column in CATEGORY_COLUMNS:
+        if column in df.columns and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype("category")
+
+    # quantity có giá trị rỗng (dữ liệu cũ) thì không ép được về int, giữ nguyên
+    if "quantity" in df.columns and not df["quantity"].hasnans:
+        df["quantity"] = df["quantity"].clip(*INT32_RANGE).astype("int32")
+
+    if "unitPrice" in df.columns:
+        df["unitPrice"] = df["unitPrice"].astype("float32")
+
+    if "invoiceDate" in df.columns and not pd.api.types.is_datetime64_any_dtype(df["invoiceDate"]):
+        df["invoiceDate"] = parse_dates(df["invoiceDate"])
+    return df
+
+
+def memory_report(df, budget_mb=FRAME_MEMORY_BUDGET_MB):
+    """
+    Dung lượng frame theo cột (MB) và so với ngân sách.
+    """
+    usage = df.memory_usage(deep=True, index=True)
+    total_mb = usage.sum() / 2 ** 20
+    return {
+        "rows": len(df),
+        "total_mb": round(total_mb, 2),
+        "bytes_per_row": round(usage.sum() / len(df), 1) if len(df) else 0.0,
+        "columns": {
+            column: {"dtype": str(df[column].dtype), "mb": round(usage[column] / 2 ** 20, 2)}
+            for column in df.columns
+        },
+        "budget_mb": budget_mb or None,
+        "over_budget": bool(budget_mb) and total_mb > budget_mb,
+    }
@@ -0,0 +1,325 @@
+import glob
+import heapq
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from segment_store import DATE_FORMAT, read_from_position
+
+# Top-K xấp xỉ (Space-Saving) cho panel "Top sản phẩm" và "Top khách hàng":
+#   heavy_hitters/hour/<YYYY-MM-DD>.json -> sketch theo từng giờ
+#   heavy_hitters/day/<YYYY-MM>.json     -> sketch theo từng ngày (cho cửa sổ dài)
+# Mỗi bucket giữ một sketch cho mỗi chỉ số trong SKETCHES, bộ nhớ tối đa CAPACITY khoá/sketch.
+
+HEAVY_HITTER_DIR_NAME = "heavy_hitters"
+META_NAME = "meta.json"
+CAPACITY = int(os.environ.get("HEAVY_HITTER_CAPACITY", 200))
+
+# Tên sketch -> (cột khoá, cột trọng số)
+SKETCHES = {
+    "products_quantity": ("product_label", "quantity"),
+    "products_total": ("product_label", "total"),
+    "customers_total": ("customerID", "total"),
+}
+
+# granularity -> (tần suất floor, định dạng tên file)
+LEVELS = {
+    "hour": ("h", "%Y-%m-%d"),
+    "day": ("D", "%Y-%m"),
+}
+
+
+class SpaceSaving:
+    """
+    Sketch Space-Saving có trọng số: giữ tối đa capacity khoá, mỗi khoá có (count, error).
+    count là cận trên của tổng thật, count - error là cận dưới. Cận chỉ đúng khi count không giảm nên
+    trọng số không dương (hoá đơn huỷ, điều chỉnh giá) bị bỏ qua: sketch đếm doanh số gộp, không trừ huỷ.
+    """
+
+    def __init__(self, capacity=CAPACITY, counters=None):
+        self.capacity = capacity
+        self.counters = counters or {}
+        self._rebuild_heap()
+
+    def _rebuild_heap(self):
+        # Heap (count, khoá) để tìm khoá nhỏ nhất khi thay thế; count trong heap có thể cũ (nhỏ hơn thật)
+        self.heap = [(counter[0], key) for key, counter in self.counters.items()]
+        heapq.heapify(self.heap)
+
+    def _min_key(self):
+        # Bỏ các mục của khoá đã bị thay, đẩy lại mục cũ với count hiện tại cho tới khi đỉnh heap đúng
+        while True:
+            count, key = self.heap[0]
+            counter = self.counters.get(key)
+            if counter is None:
+                heapq.heappop(self.heap)
+            elif counter[0] != count:
+                heapq.heapreplace(self.heap, (counter[0], key))
+            else:
+                return key
+
+    def update(self, key, weight):
+        if weight <= 0:
+            return
+        counter = self.counters.get(key)
+        if counter is not None:
+            counter[0] += weight
+        elif len(self.counters) < self.capacity:
+            self.counters[key] = [weight, 0.0]
+            heapq.heappush(self.heap, (weight, key))
+        else:
+            # Thay khoá có count nhỏ nhất, kế thừa count đó làm sai số
+            min_count = self.counters.pop(self._min_key())[0]
+            self.counters[key] = [min_count + weight, min_count]
+            heapq.heapreplace(self.heap, (min_count + weight, key))
+
+    def update_many(self, keys, weights):
+        # Chỉ cộng các dòng có trọng số dương; cộng dồn trong lô trước (vector hoá),
+        # sau đó mới cập nhật sketch theo thứ tự trọng số giảm dần
+        weights = np.asarray(weights, dtype="float64")
+        positive = weights > 0
+        totals = pd.Series(weights[positive]).groupby(np.asarray(keys)[positive], sort=False).sum()
+        for key, weight in totals.sort_values(ascending=False).items():
+            self.update(key, float(weight))
+
+    def floor(self):
+        # Cận trên của count mọi khoá sketch không giữ: count nhỏ nhất khi đã đầy, 0 nếu chưa đầy
+        if len(self.counters) < self.capacity:
+            return 0.0
+        return self.counters[self._min_key()][0]
+
+    def merge(self, other):
+        """
+        Gộp Space-Saving: khoá chỉ có ở một bên được cộng floor() của bên kia vào cả count và error,
+        nên count vẫn là cận trên và count - error vẫn là cận dưới; sau đó giữ capacity khoá lớn nhất.
+        """
+        own_floor, other_floor = self.floor(), other.floor()
+        for key, counter in self.counters.items():
+            if key not in other.counters:
+                counter[0] += other_floor
+                counter[1] += other_floor
+        for key, (count, error) in other.counters.items():
+            counter = self.counters.get(key)
+            if counter is None:
+                self.counters[key] = [count + own_floor, error + own_floor]
+            else:
+                counter[0] += count
+                counter[1] += error
+        if len(self.counters) > self.capacity:
+            keep = heapq.nlargest(self.capacity, self.counters.items(), key=lambda item: item[1][0])
+            self.counters = {key: counter for key, counter in keep}
+        self._rebuild_heap()
+
+    def top(self, k):
+        return heapq.nlargest(k, ((key, c[0], c[1]) for key, c in self.counters.items()), key=lambda item: item[1])
+
+    def to_dict(self):
+        return {"capacity": self.capacity, "counters": {key: list(c) for key, c in self.counters.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["capacity"], {key: list(c) for key, c in data["counters"].items()})
+
+
+def heavy_hitter_dir(root, level=None):
+    path = os.path.join(root, HEAVY_HITTER_DIR_NAME)
+    return os.path.join(path, level) if level else path
+
+
+def read_meta(root):
+    try:
+        with open(os.path.join(heavy_hitter_dir(root), META_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def write_meta(root, meta):
+    path = os.path.join(heavy_hitter_dir(root), META_NAME)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(path + ".tmp", path)
+
+
+def sketch_columns(df):
+    return pd.DataFrame({
+        "product_label": df["stockCode"].astype(str) + " - " + df["description"].astype(str),
+        "customerID": df["customerID"].astype(object).fillna("Unknown").astype(str),
+        "quantity": df["quantity"].astype("float64"),
+        "total": df["quantity"] * df["unitPrice"],
+    }, index=df.index)
+
+
+class HeavyHitterStore:
+    """
+    Phía ghi (chạy trong Web-Services): cập nhật sketch theo giờ/ngày sau mỗi nhóm ghi.
+    Mỗi file lưu watermark rows_applied để khôi phục không bị cộng trùng.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+        self.files = {}   # (level, file_key) -> {"rows_applied": int, "buckets": {bucket: {name: SpaceSaving}}}
+        self.dirty = set()
+        for level in LEVELS:
+            os.makedirs(heavy_hitter_dir(root, level), exist_ok=True)
+        self.position = read_meta(root).get("rows_applied", 0)
+
+    def _file(self, level, key):
+        cache_key = (level, key)
+        if cache_key not in self.files:
+            path = os.path.join(heavy_hitter_dir(self.root, level), f"{key}.json")
+            entry = {"rows_applied": 0, "buckets": {}}
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                entry["rows_applied"] = data["rows_applied"]
+                entry["buckets"] = {
+                    bucket: {name: SpaceSaving.from_dict(s) for name, s in sketches.items()}
+                    for bucket, sketches in data["buckets"].items()
+                }
+            self.files[cache_key] = entry
+        return self.files[cache_key]
+
+    def apply(self, df, first_position):
+        if df.empty:
+            return
+        positions = np.arange(first_position, first_position + len(df))
+        columns = sketch_columns(df)
+        with self.lock:
+            for level, (freq, fmt) in LEVELS.items():
+                buckets = df["invoiceDate"].dt.floor(freq)
+                for bucket, index in df.groupby(buckets.to_numpy(), sort=False).indices.items():
+                    bucket = pd.Timestamp(bucket)
+                    entry = self._file(level, bucket.strftime(fmt))
+                    index = index[positions[index] >= entry["rows_applied"]]
+                    if not len(index):
+                        continue
+                    sketches = entry["buckets"].setdefault(
+                        bucket.isoformat(), {name: SpaceSaving() for name in SKETCHES}
+                    )
+                    rows = columns.iloc[index]
+                    for name, (key_col, weight_col) in SKETCHES.items():
+                        sketches[name].update_many(rows[key_col].to_numpy(), rows[weight_col].to_numpy())
+                    self.dirty.add((level, bucket.strftime(fmt)))
+            self.position = max(self.position, first_position + len(df))
+
+    def flush(self):
+        with self.lock:
+            dirty = list(self.dirty)
+            self.dirty = set()
+            position = self.position
+            payloads = {}
+            for level, key in dirty:
+                entry = self.files[(level, key)]
+                entry["rows_applied"] = position
+                payloads[(level, key)] = {
+                    "rows_applied": position,
+                    "buckets": {
+                        bucket: {name: sketch.to_dict() for name, sketch in sketches.items()}
+                        for bucket, sketches in entry["buckets"].items()
+                    },
+                }
+        for (level, key), payload in payloads.items():
+            path = os.path.join(heavy_hitter_dir(self.root, level), f"{key}.json")
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(payload, f)
+            os.replace(path + ".tmp", path)
+        if payloads:
+            write_meta(self.root, {**read_meta(self.root), "rows_applied": position})
+
+        # Chỉ giữ trong bộ nhớ các file vừa ghi (đang nhận dữ liệu)
+        with self.lock:
+            for cache_key in list(self.files):
+                if cache_key not in self.dirty and cache_key not in payloads:
+                    del self.files[cache_key]
+        return len(payloads)
+
+    def prune(self, level, before):
+        """
+        Xoá các file sketch của level nằm trọn trước thời điểm before (retention) và ghi mốc còn giữ
+        vào meta.json. Không gọi song song với flush. Trả về (số file, số byte đã xoá).
+        """
+        cutoff = pd.Timestamp(before).strftime(LEVELS[level][1])
+        files, reclaimed = 0, 0
+        with self.lock:
+            for path in glob.glob(os.path.join(heavy_hitter_dir(self.root, level), "*.json")):
+                key = os.path.basename(path)[:-len(".json")]
+                if key >= cutoff:
+                    continue
+                self.files.pop((level, key), None)
+                self.dirty.discard((level, key))
+                try:
+                    reclaimed += os.path.getsize(path)
+                    os.remove(path)
+                    files += 1
+                except FileNotFoundError:
+                    pass
+        if files:
+            meta = read_meta(self.root)
+            retained = meta.setdefault("retained_from", {})
+            horizon = pd.Timestamp(cutoff).strftime(DATE_FORMAT)
+            retained[level] = max(retained.get(level, horizon), horizon)
+            write_meta(self.root, meta)
+        return files, reclaimed
+
+    def catch_up(self, store):
+        if store.total_rows <= self.position:
+            return 0
+        start = self.position
+        df = read_from_position(self.root, start).to_pandas()
+        self.apply(df, start)
+        self.flush()
+        return len(df)
+
+
+# ---------------------------------------------------------------- phía đọc
+_read_cache = {}
+_read_lock = threading.Lock()
+
+
+def read_sketch_file(path):
+    mtime = os.stat(path).st_mtime_ns
+    with _read_lock:
+        cached = _read_cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    with open(path, "r", encoding="utf-8") as f:
+        buckets = json.load(f)["buckets"]
+    with _read_lock:
+        _read_cache[path] = (mtime, buckets)
+    return buckets
+
+
+def query_top(root, name, start, end, k=10):
+    """
+    Top k khoá của sketch name trong cửa sổ (start, end]: gộp sketch các bucket trong cửa sổ.
+    Cửa sổ từ 7 ngày trở lên, hoặc bắt đầu trước mốc retention đã xoá sketch theo giờ, dùng sketch theo ngày.
+    Trả về DataFrame (key, value, error).
+    """
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    hour_from = read_meta(root).get("retained_from", {}).get("hour")
+    if end - start >= pd.Timedelta(days=7) or (hour_from is not None and start < pd.Timestamp(hour_from)):
+        level = "day"
+    else:
+        level = "hour"
+    freq, fmt = LEVELS[level]
+    low, high = start.floor(freq), end
+    merged = SpaceSaving()
+
+    for path in sorted(glob.glob(os.path.join(heavy_hitter_dir(root, level), "*.json"))):
+        key = os.path.basename(path)[:-len(".json")]
+        if key < low.strftime(fmt) or key > high.strftime(fmt):
+            continue
+        try:
+            buckets = read_sketch_file(path)
+        except FileNotFoundError:
+            continue
+        for bucket, sketches in buckets.items():
+            if low <= pd.Timestamp(bucket) <= high and name in sketches:
+                merged.merge(SpaceSaving.from_dict(sketches[name]))
+
+    return pd.DataFrame(merged.top(k), columns=["key", "value", "error"])
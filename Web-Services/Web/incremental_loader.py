@@ -0,0 +1,157 @@
+import json
+import os
+import threading
+
+import pandas as pd
+
+from frame_schema import compact_frame
+from segment_store import log_path, read_manifest, read_segment_table, records_to_table
+
+
+def append_frames(base, delta):
+    """
+    Nối delta vào base mà vẫn giữ kiểu category: hợp nhất danh mục trước khi concat
+    (concat hai cột category khác danh mục sẽ bị đổi về object).
+    """
+    if base is None or base.empty:
+        return delta
+    if delta is None or delta.empty:
+        return base
+    base = base.copy(deep=False)
+    delta = delta.copy(deep=False)
+    for column in base.columns:
+        if isinstance(base[column].dtype, pd.CategoricalDtype) and column in delta.columns:
+            new = pd.Index(delta[column].cat.categories).difference(base[column].cat.categories)
+            if len(new):
+                base[column] = base[column].cat.add_categories(new)
+            delta[column] = delta[column].cat.set_categories(base[column].cat.categories)
+    return pd.concat([base, delta], ignore_index=True)
+
+
+class IncrementalLoader:
+    """
+    Giữ DataFrame đã có kiểu trong bộ nhớ và chỉ đọc phần mới:
+    segment mới xuất hiện trong manifest và các dòng mới được nối vào log đang ghi
+    (nhớ byte offset + định danh file để phát hiện niêm phong/cắt ngắn/xoay vòng).
+
+    Thứ tự dòng trong frame là thứ tự ghi, nên khi generation không đổi thì frame mới
+    luôn có frame cũ làm tiền tố; generation tăng khi dữ liệu cũ bị thay (ví dụ log bị cắt ngắn
+    hoặc retention xoá các segment đầu).
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+        self.segment_files = []
+        self.segment_frame = None
+        self.log_identity = None
+        self.log_offset = 0
+        self.log_frame = None
+        self.frame = pd.DataFrame()
+        self.manifest_version = None
+        self.rows_dropped = 0
+        self.generation = 0
+
+    def refresh(self):
+        """
+        Cập nhật frame; trả về True nếu có dữ liệu mới.
+        """
+        with self.lock:
+            manifest = read_manifest(self.root)
+            segments_changed = self._refresh_segments(manifest)
+            if segments_changed is None:
+                # Không đọc được segment mới: chưa đọc log để giữ đúng thứ tự dòng, thử lại lần sau
+                return False
+            log_change = self._refresh_log(manifest)
+            self.manifest_version = manifest["version"]
+            if manifest.get("rows_dropped", 0) != self.rows_dropped:
+                self.rows_dropped = manifest.get("rows_dropped", 0)
+                self.generation += 1  # Frame mới không còn các dòng đầu của frame cũ
+
+            if segments_changed or log_change is True:
+                self.frame = append_frames(self.segment_frame, self.log_frame)
+            elif log_change is not None:
+                self.frame = append_frames(self.frame, log_change)
+            if self.frame is None:
+                self.frame = pd.DataFrame()
+            return segments_changed or log_change is not None
+
+    def _refresh_segments(self, manifest):
+        files = [segment["file"] for segment in manifest["segments"]]
+        if files == self.segment_files:
+            return False
+
+        known = len(self.segment_files)
+        if files[:known] == self.segment_files:
+            new_segments = manifest["segments"][known:]
+            segment_frame = self.segment_frame
+        else:
+            # Compaction/retention đã thay segment cũ -> đọc lại toàn bộ segment
+            new_segments = manifest["segments"]
+            segment_frame = None
+
+        try:
+            for segment in new_segments:
+                delta = compact_frame(read_segment_table(self.root, segment).to_pandas())
+                segment_frame = append_frames(segment_frame, delta)
+        except (FileNotFoundError, OSError):
+            # Segment vừa bị xoá bởi compaction, giữ trạng thái cũ và thử lại ở lần refresh sau
+            return None
+
+        self.segment_files = files
+        self.segment_frame = segment_frame
+        return True
+
+    def _refresh_log(self, manifest):
+        """
+        Trả về None nếu log không đổi, DataFrame các dòng mới nếu log chỉ được nối thêm,
+        hoặc True nếu log đã bị thay (niêm phong/cắt ngắn) và phải dựng lại phần log.
+        """
+        path = log_path(self.root, manifest["active_log"])
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            if read_manifest(self.root)["version"] != manifest["version"]:
+                # Log vừa bị niêm phong sau khi đọc manifest: giữ phần log đã đọc (frame vẫn là snapshot
+                # nhất quán của manifest cũ), lần refresh sau đọc segment mới và log kế tiếp
+                return None
+            stat = None
+
+        identity = (manifest["active_log"], stat.st_ino if stat else None)
+        size = stat.st_size if stat else 0
+        reset = identity != self.log_identity or size < self.log_offset
+        if identity == self.log_identity and size < self.log_offset:
+            self.generation += 1  # Log bị cắt ngắn: các dòng đã đọc không còn hợp lệ
+        if reset:
+            had_rows = self.log_frame is not None and not self.log_frame.empty
+            self.log_identity = identity
+            self.log_offset = 0
+            self.log_frame = None
+            if size == 0:
+                return True if had_rows else None
+
+        if size <= self.log_offset:
+            return None
+
+        try:
+            with open(path, "rb") as f:
+                f.seek(self.log_offset)
+                data = f.read(size - self.log_offset)
+        except FileNotFoundError:
+            return True if reset else None
+
+        # Chỉ nhận các dòng đã ghi trọn vẹn, phần dở dang để lần sau
+        end = data.rfind(b"\n") + 1
+        if end == 0:
+            return True if reset else None
+        self.log_offset += end
+
+        records = []
+        for line in data[:end].splitlines():
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+        delta = compact_frame(records_to_table(records).to_pandas())
+        self.log_frame = append_frames(self.log_frame, delta)
+        return True if reset else delta
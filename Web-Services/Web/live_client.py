@@ -0,0 +1,100 @@
+import json
+import threading
+import time
+import urllib.request
+from collections import OrderedDict, deque
+
+# Nghe /api/stream (SSE) của Web-Services trong một luồng nền, dùng chung cho mọi phiên dashboard
+# của tiến trình. Trạng thái được cập nhật bằng cách cộng dồn các sự kiện delta, không đọc lại file.
+
+RETRY_SECONDS = 3.0
+READ_TIMEOUT = 60.0        # Lớn hơn chu kỳ heartbeat của server
+LIVE_BUCKETS = 24 * 60     # Số bucket phút gần nhất giữ trong bộ nhớ
+LIVE_RECORDS = 1000        # Số dòng mới nhất giữ trong bộ nhớ
+
+
+def iter_sse(response):
+    """
+    Tách luồng SSE thành các sự kiện (event, data, id).
+    """
+    event, data, event_id = "message", [], None
+    for raw in response:
+        line = raw.decode("utf-8").rstrip("\r\n")
+        if not line:
+            if data:
+                yield event, "\n".join(data), event_id
+            event, data, event_id = "message", [], None
+        elif line.startswith(":"):
+            continue  # heartbeat
+        else:
+            field, _, value = line.partition(":")
+            value = value[1:] if value.startswith(" ") else value
+            if field == "event":
+                event = value
+            elif field == "data":
+                data.append(value)
+            elif field == "id":
+                event_id = value
+
+
+class LiveSubscriber:
+    """
+    position: tổng số dòng đã ghi theo sự kiện mới nhất (None khi chưa kết nối lần nào).
+    buckets: bucket phút -> [quantity, total] cộng dồn từ các delta; records: các dòng mới nhất.
+    Khi nhận "reset" (lỡ sự kiện), bucket/records được xoá và position nhảy tới vị trí mới.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.lock = threading.Lock()
+        self.connected = False
+        self.position = None
+        self.last_event_at = None
+        self.buckets = OrderedDict()
+        self.records = deque(maxlen=LIVE_RECORDS)
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True, name="live-subscriber")
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            headers = {"Accept": "text/event-stream"}
+            if self.position is not None:
+                headers["Last-Event-ID"] = str(self.position)
+            try:
+                request = urllib.request.Request(self.url, headers=headers)
+                with urllib.request.urlopen(request, timeout=READ_TIMEOUT) as response:
+                    self.connected = True
+                    for event, data, _ in iter_sse(response):
+                        self._apply(event, json.loads(data))
+            except Exception:
+                pass
+            self.connected = False
+            time.sleep(RETRY_SECONDS)
+
+    def _apply(self, event, data):
+        with self.lock:
+            if event == "delta":
+                for bucket in data["buckets"]:
+                    entry = self.buckets.setdefault(bucket["bucket"], [0, 0.0])
+                    entry[0] += bucket["quantity"]
+                    entry[1] += bucket["total"]
+                while len(self.buckets) > LIVE_BUCKETS:
+                    self.buckets.popitem(last=False)
+                self.records.extend(data["records"])
+                self.position = data["end"]
+            elif event == "reset" or (event == "hello" and self.position is None):
+                if event == "reset":
+                    self.buckets.clear()
+                    self.records.clear()
+                self.position = data["position"]
+            self.last_event_at = time.time()
+
+    def marker(self):
+        """
+        Giá trị đổi khi có dữ liệu mới; None nếu đang mất kết nối.
+        """
+        return self.position if self.connected else None
@@ -0,0 +1,323 @@
+import atexit
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Đo thời gian theo công đoạn (histogram) và bộ đếm, xuất theo định dạng văn bản Prometheus ở /metrics.
+# Mỗi tiến trình có REGISTRY riêng; worker của process pool gửi thời gian công đoạn về
+# tiến trình API kèm kết quả job (xem collect_stages/observe_stages).
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+# Profiler lấy mẫu (tuỳ chọn): đặt PROFILE_DIR để mọi tiến trình ghi stack gộp (định dạng folded,
+# dùng được với flamegraph.pl/speedscope) vào <PROFILE_DIR>/<service>-<pid>.folded
+PROFILE_DIR = os.environ.get("PROFILE_DIR")
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", 0.01))            # Giây giữa hai lần lấy mẫu
+PROFILE_FLUSH_INTERVAL = float(os.environ.get("PROFILE_FLUSH_INTERVAL", 10))  # Giây giữa hai lần ghi file
+# Endpoint GET /debug/profile (không xác thực, giữ một luồng trong tối đa 60 giây): chỉ mở khi PROFILE_ENDPOINT=1
+PROFILE_ENDPOINT = os.environ.get("PROFILE_ENDPOINT", "").lower() in ("1", "true", "yes")
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_labels(names, values, extra=()):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{value}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = defaultdict(float)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self.lock:
+            self.values[key] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            items = list(self.values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{format_labels(self.labelnames, key)} {format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """
+    Histogram theo bucket cố định: mỗi bộ nhãn giữ số lần rơi vào từng bucket, tổng và số lần đo.
+    """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        self.values = {}  # nhãn -> [số lần theo bucket, tổng, số lần]
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            items = [(key, (list(counts), total, count)) for key, (counts, total, count) in self.values.items()]
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                labels = format_labels(self.labelnames, key, [("le", format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_bucket{format_labels(self.labelnames, key, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, key)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def _get(self, cls, name, documentation, labelnames, **options):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, documentation, labelnames, **options)
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get(Counter, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "retail_stage_duration_seconds", "Thời gian từng công đoạn xử lý", ("service", "task", "stage")
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "retail_http_request_duration_seconds", "Thời gian xử lý request HTTP", ("service", "method", "route", "status")
+)
+
+# Danh sách thời gian công đoạn của job đang chạy trong luồng hiện tại (xem collect_stages)
+_collector = threading.local()
+
+
+def observe_stage(service, task, name, seconds):
+    STAGE_SECONDS.observe(seconds, service=service, task=task, stage=name)
+    stages = getattr(_collector, "stages", None)
+    if stages is not None:
+        stages.append((service, task, name, seconds))
+
+
+@contextmanager
+def stage(service, task, name):
+    """
+    Đo thời gian một công đoạn: with stage("ingest", "ingest", "validate"): ...
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(service, task, name, time.perf_counter() - started)
+
+
+@contextmanager
+def collect_stages():
+    """
+    Gom các công đoạn đo được trong khối (để gửi từ worker về tiến trình API).
+    """
+    _collector.stages = []
+    try:
+        yield _collector.stages
+    finally:
+        _collector.stages = None
+
+
+def observe_stages(stages):
+    for service, task, name, seconds in stages:
+        STAGE_SECONDS.observe(seconds, service=service, task=task, stage=name)
+
+
+def track_requests(app, service):
+    """
+    Middleware FastAPI: đo thời gian mỗi request theo route (mẫu đường dẫn, không theo giá trị tham số).
+    """
+    @app.middleware("http")
+    async def measure_request(request, call_next):
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            route = request.scope.get("route")
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - started,
+                service=service,
+                method=request.method,
+                route=getattr(route, "path", "unmatched"),
+                status=status,
+            )
+
+
+def serve_metrics(port, registry=REGISTRY):
+    """
+    Phục vụ /metrics bằng HTTP server riêng (cho tiến trình không có API, ví dụ dashboard).
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-server").start()
+    return server
+
+
+# ------------------------------------------------------------ profiler lấy mẫu
+class SamplingProfiler:
+    """
+    Lấy mẫu stack của mọi luồng mỗi interval giây (sys._current_frames), đếm theo stack gộp.
+    Chi phí tỉ lệ với tần suất lấy mẫu, không phụ thuộc số lời gọi hàm như cProfile.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL, ignore=()):
+        self.interval = interval
+        self.ignore = set(ignore)  # id các luồng không lấy mẫu
+        self.lock = threading.Lock()
+        self.counts = defaultdict(int)
+        self.samples = 0
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True, name="sampling-profiler")
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        own = threading.get_ident()
+        stacks = []
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own or thread_id in self.ignore:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            stacks.append(";".join(reversed(stack)))
+        with self.lock:
+            for key in stacks:
+                self.counts[key] += 1
+            self.samples += 1
+
+    def folded(self):
+        with self.lock:
+            items = sorted(self.counts.items(), key=lambda item: -item[1])
+        return "".join(f"{stack} {count}\n" for stack, count in items)
+
+
+def profile_for(seconds, interval=PROFILE_INTERVAL):
+    """
+    Lấy mẫu tiến trình hiện tại trong seconds giây (chặn luồng gọi), trả về stack gộp.
+    """
+    profiler = SamplingProfiler(interval, ignore=[threading.get_ident()]).start()
+    time.sleep(seconds)
+    profiler.stop()
+    return profiler.folded()
+
+
+def start_profiler_from_env(service):
+    """
+    Bật profiler cho cả vòng đời tiến trình nếu có PROFILE_DIR; ghi file định kỳ và khi thoát.
+    """
+    if not PROFILE_DIR:
+        return None
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{service}-{os.getpid()}.folded")
+    profiler = SamplingProfiler().start()
+
+    def write():
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(profiler.folded())
+        os.replace(path + ".tmp", path)
+
+    def flush_periodically():
+        while not profiler.stopped.wait(PROFILE_FLUSH_INTERVAL):
+            write()
+
+    threading.Thread(target=flush_periodically, daemon=True, name="profile-writer").start()
+    atexit.register(write)
+    return profiler
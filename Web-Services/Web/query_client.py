@@ -0,0 +1,94 @@
+import json
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import pandas as pd
+
+from downsampling import SCATTER_MAX_POINTS
+from metrics import stage
+from query_engine import run_query, run_scatter
+
+# Gọi /api/query, /api/scatter của Web-Services cho các trang dashboard (chỉ nhận kết quả đã tổng hợp).
+# Khi không kết nối được server, chạy cùng truy vấn ngay trên thư mục dữ liệu (vẫn cắt theo thời gian).
+
+REQUEST_TIMEOUT = 30.0
+RETRY_SECONDS = 10.0  # Sau khi lỗi kết nối, chạy cục bộ bấy nhiêu giây rồi mới thử lại server
+
+
+def to_param(value):
+    if isinstance(value, pd.Timestamp):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(value, (list, tuple)):
+        return ",".join(value)
+    if isinstance(value, bool):
+        return str(value).lower()
+    return str(value)
+
+
+class QueryClient:
+    """
+    url: địa chỉ gốc của API (ví dụ http://localhost:8000/api); data_dir: thư mục dữ liệu cho chế độ cục bộ.
+    """
+
+    def __init__(self, url, data_dir=None):
+        self.url = url.rstrip("/") if url else None
+        self.data_dir = data_dir
+        self.offline_until = 0.0
+        self.last_source = None  # "server" hoặc "local"
+
+    def _request(self, endpoint, params):
+        query = urllib.parse.urlencode({k: to_param(v) for k, v in params.items() if v is not None})
+        with urllib.request.urlopen(f"{self.url}/{endpoint}?{query}", timeout=REQUEST_TIMEOUT) as response:
+            return json.loads(response.read())
+
+    def _call(self, endpoint, local, params):
+        with stage("dashboard", "query", endpoint):
+            if self.url and time.time() >= self.offline_until:
+                try:
+                    result = self._request(endpoint, params)
+                    self.last_source = "server"
+                    return result
+                except urllib.error.HTTPError:
+                    raise  # Server trả lỗi (tham số sai...): không chạy lại cục bộ
+                except OSError:
+                    if self.data_dir is None:
+                        raise
+                    self.offline_until = time.time() + RETRY_SECONDS
+            self.last_source = "local"
+            return local()
+
+    def query(self, start=None, end=None, bucket=None, group_by=(), metric="quantity", top=None, order="desc",
+              approximate=False):
+        """
+        Trả về (DataFrame kết quả, thông tin truy vấn); cột bucket (nếu có) đã là datetime.
+        """
+        params = {
+            "from": start, "to": end, "bucket": bucket, "group_by": list(group_by) or None,
+            "metric": metric, "top": top, "order": order, "approximate": approximate or None,
+        }
+        result = self._call("query", lambda: run_query(
+            self.data_dir, start, end, bucket, group_by, metric, top, order, approximate
+        ), params)
+        rows = result.pop("rows")
+        columns = (["bucket"] if bucket else []) + list(group_by) + [metric]
+        frame = pd.DataFrame.from_records(rows) if rows else pd.DataFrame(columns=columns)
+        if "bucket" in frame.columns:
+            frame["bucket"] = pd.to_datetime(frame["bucket"])
+        return frame, result
+
+    def bounds(self):
+        """
+        (invoiceDate nhỏ nhất, lớn nhất) của toàn bộ dữ liệu, None nếu chưa có dữ liệu.
+        """
+        _, info = self.query(metric="rows")
+        if info["bounds"] is None:
+            return None
+        return pd.Timestamp(info["bounds"]["min"]), pd.Timestamp(info["bounds"]["max"])
+
+    def scatter(self, start=None, end=None, mode="auto", max_points=SCATTER_MAX_POINTS):
+        params = {"from": start, "to": end, "mode": mode, "max_points": max_points}
+        result = self._call("scatter", lambda: run_scatter(self.data_dir, start, end, mode, max_points), params)
+        rows = result.pop("rows")
+        return pd.DataFrame.from_records(rows) if rows else pd.DataFrame(columns=["unitPrice", "quantity"]), result
@@ -0,0 +1,273 @@
+import os
+import threading
+
+import pandas as pd
+from pandas.tseries.frequencies import to_offset
+from pandas.tseries.offsets import Day, Tick
+
+from downsampling import SCATTER_MAX_POINTS, bin_points, sample_points
+from heavy_hitters import query_top
+from rollups import load_rollup, retained_from
+from segment_store import DATE_FORMAT, data_signature, log_path, read_log_table, read_manifest, read_table
+
+# Truy vấn tổng hợp chạy cạnh dữ liệu (/api/query, /api/scatter của Web-Services; dashboard gọi qua query_client):
+#   - nhóm theo country/stockCode -> đọc rollup, chỉ mở các partition giao với khoảng thời gian
+#   - nhóm theo description/customerID -> đọc dòng thô nhưng bỏ qua segment nằm ngoài khoảng (min/max_date
+#     trong manifest) và đẩy điều kiện thời gian xuống Parquet
+# Kết quả chỉ gồm các nhóm đã tổng hợp (tuỳ chọn top N), không trả về dòng thô.
+
+METRICS = ("quantity", "total", "rows")
+GROUP_COLUMNS = ("country", "stockCode", "description", "customerID")
+ROLLUP_GROUP_COLUMNS = {"country", "stockCode"}
+SCATTER_MODES = ("auto", "sample", "bins", "all")
+
+# Độ dài một bucket của từng granularity rollup (tháng lấy cận trên)
+GRANULARITY_SPAN = {
+    "minute": pd.Timedelta(minutes=1),
+    "hour": pd.Timedelta(hours=1),
+    "day": pd.Timedelta(days=1),
+    "month": pd.Timedelta(days=31),
+}
+# Cửa sổ phải chứa ít nhất bấy nhiêu bucket rollup (bucket ở hai đầu cửa sổ được tính trọn)
+ROLLUP_MIN_BUCKETS = int(os.environ.get("QUERY_ROLLUP_MIN_BUCKETS", 24))
+# Số nhóm tối đa trả về khi không chỉ định top
+QUERY_MAX_GROUPS = int(os.environ.get("QUERY_MAX_GROUPS", 10_000))
+
+# Top xấp xỉ từ sketch Space-Saving: (cột nhóm, chỉ số) -> tên sketch
+SKETCH_FOR_GROUP = {
+    (("stockCode", "description"), "quantity"): "products_quantity",
+    (("stockCode", "description"), "total"): "products_total",
+    (("customerID",), "total"): "customers_total",
+}
+
+
+def parse_time(value):
+    if value is None or value == "":
+        return None
+    return pd.Timestamp(value)  # ValueError nếu không hợp lệ
+
+
+def parse_bucket(bucket):
+    if not bucket:
+        return None
+    try:
+        return to_offset(bucket)
+    except ValueError:
+        raise ValueError(f"bucket không hợp lệ: {bucket}")
+
+
+def format_time(value):
+    return value.strftime(DATE_FORMAT) if value is not None and not pd.isna(value) else None
+
+
+# ------------------------------------------------------------ biên thời gian
+_bounds_cache = {}
+_bounds_lock = threading.Lock()
+
+
+def data_bounds(root):
+    """
+    (invoiceDate nhỏ nhất, lớn nhất) lấy từ min/max_date trong manifest và log đang ghi,
+    cache theo data_signature. None nếu chưa có dữ liệu.
+    """
+    signature = data_signature(root)
+    with _bounds_lock:
+        cached = _bounds_cache.get(root)
+        if cached and cached[0] == signature:
+            return cached[1]
+
+    manifest = read_manifest(root)
+    lows = [pd.Timestamp(s["min_date"]) for s in manifest["segments"] if s.get("min_date")]
+    highs = [pd.Timestamp(s["max_date"]) for s in manifest["segments"] if s.get("max_date")]
+    dates = read_log_table(log_path(root, manifest["active_log"])).column("invoiceDate").to_pandas().dropna()
+    if len(dates):
+        lows.append(dates.min())
+        highs.append(dates.max())
+    bounds = (min(lows), max(highs)) if lows else None
+
+    with _bounds_lock:
+        _bounds_cache[root] = (signature, bounds)
+    return bounds
+
+
+# ------------------------------------------------------------ chọn rollup
+def fixed_span(offset):
+    # Độ dài cố định của bucket (Tick, và Day vì từ pandas 3 Day không còn là Tick); None nếu theo lịch
+    if isinstance(offset, Tick):
+        return pd.Timedelta(offset.nanos, unit="ns")
+    if isinstance(offset, Day):
+        return offset.n * pd.Timedelta(days=1)
+    return None
+
+
+def bucket_aligned(offset, granularity):
+    # Bucket kết quả phải ghép trọn từ các bucket rollup
+    if granularity == "minute":
+        return True
+    span = fixed_span(offset)
+    if span is not None:
+        return granularity != "month" and span.value % GRANULARITY_SPAN[granularity].value == 0
+    code = offset.rule_code
+    if code[0] in "MQYA":
+        return True
+    return code.startswith("W") and granularity in ("hour", "day")
+
+
+def rollup_granularity(offset, window, start=None, retained=None):
+    """
+    Granularity thô nhất vừa ghép được bucket kết quả vừa đủ mịn so với độ dài cửa sổ.
+    retained: mốc còn giữ của granularity đã bị retention xoá bớt; granularity đó chỉ được dùng khi cửa sổ
+    bắt đầu (start, None là từ đầu dữ liệu) không sớm hơn mốc. Không còn granularity nào ghép được bucket
+    thì dùng granularity mịn nhất còn đủ dữ liệu (bucket kết quả khi đó bị làm thô).
+    """
+    retained = retained or {}
+    covered = [granularity for granularity in ("month", "day", "hour", "minute")
+               if granularity not in retained or (start is not None and start >= retained[granularity])]
+    aligned = [granularity for granularity in covered if offset is None or bucket_aligned(offset, granularity)]
+    for granularity in aligned:
+        if window is None or window >= ROLLUP_MIN_BUCKETS * GRANULARITY_SPAN[granularity]:
+            return granularity
+    return (aligned or covered)[-1]
+
+
+# ------------------------------------------------------------ truy vấn
+def aggregate(frame, time_column, offset, group_by, metric):
+    if offset is None:
+        if not group_by:
+            return pd.DataFrame({metric: [frame[metric].sum()]})
+        return frame.groupby(group_by, observed=True, dropna=False)[metric].sum().reset_index()
+    if not group_by:
+        # Giống resample: giữ cả bucket rỗng (giá trị 0) để biểu đồ đường liền mạch
+        series = frame.set_index(time_column)[metric].resample(offset).sum()
+        return series.rename_axis("bucket").reset_index()
+    keys = [pd.Grouper(key=time_column, freq=offset)] + list(group_by)
+    result = frame.groupby(keys, observed=True, dropna=False)[metric].sum().reset_index()
+    return result.rename(columns={time_column: "bucket"})
+
+
+def raw_covers(root, start):
+    # Dòng thô còn đủ từ start (None là từ đầu dữ liệu): retention chưa xoá segment nào trước đó
+    if not read_manifest(root).get("rows_dropped", 0):
+        return True
+    return start is not None and start >= data_bounds(root)[0]
+
+
+def query_rollup(root, start, end, offset, group_by, metric, window):
+    granularity = rollup_granularity(offset, window, start, retained_from(root))
+    if offset is not None and not bucket_aligned(offset, granularity) and raw_covers(root, start):
+        # Rollup đủ mịn cho bucket đã bị retention xoá nhưng dòng thô còn: đọc dòng thô để giữ đúng bucket
+        return query_raw(root, start, end, offset, group_by, metric)
+    frame = load_rollup(root, granularity, start, end)
+    return aggregate(frame, "bucket", offset, group_by, metric), f"rollup:{granularity}"
+
+
+def query_raw(root, start, end, offset, group_by, metric):
+    columns = ["invoiceDate", "quantity"] + (["unitPrice"] if metric == "total" else []) + list(group_by)
+    frame = read_table(root, columns, start, end).to_pandas()
+    if metric == "total":
+        frame["total"] = frame["quantity"] * frame["unitPrice"]
+    elif metric == "rows":
+        frame["rows"] = 1
+    return aggregate(frame, "invoiceDate", offset, group_by, metric), "raw"
+
+
+def query_sketch(root, start, end, group_by, metric, top):
+    top_keys = query_top(root, SKETCH_FOR_GROUP[(tuple(group_by), metric)], start, end, top)
+    if list(group_by) == ["customerID"]:
+        keys = pd.DataFrame({"customerID": top_keys["key"]})
+    else:
+        # Khoá sketch sản phẩm là "stockCode - description"
+        parts = top_keys["key"].str.split(" - ", n=1, expand=True).reindex(columns=[0, 1])
+        keys = pd.DataFrame({"stockCode": parts[0], "description": parts[1]})
+    return keys.assign(**{metric: top_keys["value"], "error": top_keys["error"]}), "sketch"
+
+
+def run_query(root, start=None, end=None, bucket=None, group_by=(), metric="quantity", top=None, order="desc",
+              approximate=False):
+    """
+    Tổng hợp metric trong [start, end] theo bucket thời gian (tần suất pandas, ví dụ "1min", "8h", "MS")
+    và/hoặc các cột group_by. top: chỉ giữ N dòng có metric lớn nhất (order="desc") hoặc nhỏ nhất ("asc");
+    approximate: dùng sketch Space-Saving cho top (chỉ top lớn nhất của sản phẩm/khách hàng, không chia bucket).
+    Trả về dict gồm các dòng kết quả, nguồn dữ liệu đã dùng và biên thời gian của toàn bộ dữ liệu.
+    """
+    start, end = parse_time(start), parse_time(end)
+    offset = parse_bucket(bucket)
+    group_by = list(group_by or [])
+    if metric not in METRICS:
+        raise ValueError(f"metric phải là một trong {', '.join(METRICS)}")
+    unknown = [column for column in group_by if column not in GROUP_COLUMNS]
+    if unknown:
+        raise ValueError(f"Không nhóm được theo {', '.join(unknown)}")
+    if order not in ("asc", "desc"):
+        raise ValueError("order phải là asc hoặc desc")
+    if top is not None and top < 1:
+        raise ValueError("top phải lớn hơn 0")
+    if top is not None and offset is not None and group_by:
+        raise ValueError("top chỉ dùng khi không vừa chia bucket vừa nhóm theo cột")
+
+    bounds = data_bounds(root)
+    meta = {
+        "bounds": {"min": format_time(bounds[0]), "max": format_time(bounds[1])} if bounds else None,
+        "metric": metric,
+    }
+    if bounds is None:
+        return {**meta, "source": None, "groups": 0, "truncated": False, "rows": []}
+
+    # Độ dài cửa sổ quyết định độ mịn rollup cần dùng; không giới hạn thời gian thì bucket nào cũng chính xác
+    window = None
+    if start is not None or end is not None:
+        window = (end if end is not None else bounds[1]) - (start if start is not None else bounds[0])
+    use_sketch = approximate and top is not None and order == "desc" and offset is None
+    if use_sketch and (tuple(group_by), metric) in SKETCH_FOR_GROUP:
+        result, source = query_sketch(root, start if start is not None else bounds[0],
+                                      end if end is not None else bounds[1], group_by, metric, top)
+    elif ROLLUP_GROUP_COLUMNS.issuperset(group_by):
+        result, source = query_rollup(root, start, end, offset, group_by, metric, window)
+    else:
+        result, source = query_raw(root, start, end, offset, group_by, metric)
+
+    groups = len(result)
+    limit = top if top is not None else QUERY_MAX_GROUPS
+    if top is not None and source != "sketch":
+        result = result.nlargest(top, metric) if order == "desc" else result.nsmallest(top, metric)
+    result = result.head(limit)
+    if "bucket" in result.columns:
+        result = result.assign(bucket=result["bucket"].dt.strftime(DATE_FORMAT))
+
+    return {
+        **meta,
+        "source": source,
+        "groups": groups,
+        "truncated": top is None and groups > limit,
+        "rows": result.astype(object).where(result.notna(), None).to_dict(orient="records"),
+    }
+
+
+def run_scatter(root, start=None, end=None, mode="auto", max_points=SCATTER_MAX_POINTS):
+    """
+    Điểm (unitPrice, quantity) dương trong [start, end] cho biểu đồ phân tán, giảm mẫu ngay tại server:
+    "sample" lấy mẫu giữ ngoại lai khi vượt max_points, "bins" gộp lưới 2D, "all" trả toàn bộ,
+    "auto" trả toàn bộ nếu không vượt max_points, ngược lại gộp lưới 2D.
+    Trường "mode" của kết quả là chế độ đã dùng thật (auto đã được thay bằng all/bins).
+    """
+    start, end = parse_time(start), parse_time(end)
+    if mode not in SCATTER_MODES:
+        raise ValueError(f"mode phải là một trong {', '.join(SCATTER_MODES)}")
+    columns = ["unitPrice", "quantity"] + (["stockCode", "description"] if mode != "bins" else [])
+    frame = read_table(root, columns, start, end).to_pandas()
+    frame = frame[(frame["unitPrice"] > 0) & (frame["quantity"] > 0)]
+
+    total_points = len(frame)
+    if mode == "auto":
+        mode = "all" if total_points <= max_points else "bins"
+    if mode == "bins":
+        points = bin_points(frame, "unitPrice", "quantity") if total_points else frame.assign(count=0)
+    elif mode == "all":
+        points = frame
+    else:
+        points = sample_points(frame, "unitPrice", "quantity", max(1, int(max_points)))
+    return {
+        "mode": mode,
+        "total_points": total_points,
+        "rows": points.astype(object).where(points.notna(), None).to_dict(orient="records"),
+    }
@@ -0,0 +1,280 @@
+import glob
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from segment_store import DATE_FORMAT, read_from_position
+
+# Bảng tổng hợp sẵn theo bucket thời gian, khoá (bucket, country, stockCode):
+#   rollups/<granularity>/<partition>.parquet  -> quantity, total, rows
+#   rollups/meta.json                          -> số dòng thô đã được tổng hợp và lưu xuống đĩa,
+#                                                 mốc bắt đầu dữ liệu còn giữ của granularity bị retention xoá bớt
+# Mỗi file partition lưu watermark riêng trong metadata để khôi phục không bị cộng trùng.
+
+ROLLUP_DIR_NAME = "rollups"
+META_NAME = "meta.json"
+KEY_COLUMNS = ["bucket", "country", "stockCode"]
+VALUE_COLUMNS = ["quantity", "total", "rows"]
+
+# granularity -> (tần suất floor, định dạng tên partition)
+GRANULARITIES = {
+    "minute": ("min", "%Y-%m-%d"),
+    "hour": ("h", "%Y-%m"),
+    "day": ("D", "%Y"),
+    "month": ("MS", None),
+}
+
+CACHE_PARTITIONS = int(os.environ.get("ROLLUP_CACHE_PARTITIONS", 64))
+
+
+def rollup_dir(root, granularity=None):
+    path = os.path.join(root, ROLLUP_DIR_NAME)
+    return os.path.join(path, granularity) if granularity else path
+
+
+def floor_bucket(dates, granularity):
+    if granularity == "month":
+        return dates.dt.to_period("M").dt.to_timestamp()
+    return dates.dt.floor(GRANULARITIES[granularity][0])
+
+
+def partition_key(timestamp, granularity):
+    fmt = GRANULARITIES[granularity][1]
+    return "all" if fmt is None else pd.Timestamp(timestamp).strftime(fmt)
+
+
+def partition_path(root, granularity, key):
+    return os.path.join(rollup_dir(root, granularity), f"{key}.parquet")
+
+
+def aggregate_rows(df, granularity):
+    """
+    Tổng hợp các dòng thô (đã có kiểu) thành bảng (bucket, country, stockCode) -> quantity, total, rows.
+    """
+    frame = pd.DataFrame({
+        "bucket": floor_bucket(df["invoiceDate"], granularity),
+        "country": df["country"].astype(str),
+        "stockCode": df["stockCode"].astype(str),
+        "quantity": df["quantity"].astype("int64"),
+        "total": df["quantity"] * df["unitPrice"],
+        "rows": np.ones(len(df), dtype="int64"),
+    }).dropna(subset=["bucket"])
+    return frame.groupby(KEY_COLUMNS, sort=False).sum()
+
+
+def merge_aggregates(base, delta):
+    if base is None or base.empty:
+        return delta
+    return pd.concat([base, delta]).groupby(level=[0, 1, 2], sort=False).sum()
+
+
+class RollupStore:
+    """
+    Phía ghi (chạy trong Web-Services): cập nhật cube tổng hợp sau mỗi nhóm ghi,
+    lưu các partition bị thay đổi xuống đĩa theo chu kỳ.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+        self.partitions = OrderedDict()  # (granularity, key) -> [DataFrame, watermark]
+        self.dirty = set()
+        self.in_flight = set()  # Partition flush đang ghi: file trên đĩa chưa có dữ liệu mới, không được bỏ khỏi bộ nhớ
+        for granularity in GRANULARITIES:
+            os.makedirs(rollup_dir(root, granularity), exist_ok=True)
+        self.position = self.read_meta().get("rows_applied", 0)
+
+    def read_meta(self):
+        try:
+            with open(os.path.join(rollup_dir(self.root), META_NAME), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def write_meta(self, meta):
+        path = os.path.join(rollup_dir(self.root), META_NAME)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(path + ".tmp", path)
+
+    def _partition(self, granularity, key):
+        cache_key = (granularity, key)
+        if cache_key in self.partitions:
+            self.partitions.move_to_end(cache_key)
+            return self.partitions[cache_key]
+
+        path = partition_path(self.root, granularity, key)
+        if os.path.exists(path):
+            table = pq.read_table(path)
+            metadata = table.schema.metadata or {}
+            watermark = int(metadata.get(b"rows_applied", b"0"))
+            entry = [table.to_pandas().set_index(KEY_COLUMNS), watermark]
+        else:
+            entry = [None, 0]
+        self.partitions[cache_key] = entry
+
+        # Bỏ bớt partition sạch ít dùng khỏi bộ nhớ
+        for old_key in list(self.partitions):
+            if len(self.partitions) <= CACHE_PARTITIONS:
+                break
+            if old_key not in self.dirty and old_key not in self.in_flight and old_key != cache_key:
+                del self.partitions[old_key]
+        return entry
+
+    def apply(self, df, first_position):
+        """
+        Cộng một nhóm dòng thô (vị trí bắt đầu first_position) vào mọi granularity.
+        Dòng có vị trí nhỏ hơn watermark của partition đã được tính, sẽ bị bỏ qua.
+        """
+        if df.empty:
+            return
+        positions = np.arange(first_position, first_position + len(df))
+        with self.lock:
+            for granularity, (_, fmt) in GRANULARITIES.items():
+                buckets = floor_bucket(df["invoiceDate"], granularity)
+                keys = buckets.dt.strftime(fmt) if fmt else pd.Series("all", index=df.index)
+                for key, index in df.groupby(keys.to_numpy(), sort=False).indices.items():
+                    entry = self._partition(granularity, key)
+                    rows = df.iloc[index[positions[index] >= entry[1]]]
+                    if rows.empty:
+                        continue
+                    entry[0] = merge_aggregates(entry[0], aggregate_rows(rows, granularity))
+                    self.dirty.add((granularity, key))
+            self.position = max(self.position, first_position + len(df))
+
+    def flush(self):
+        """
+        Ghi các partition đã thay đổi (file tạm + os.replace) rồi cập nhật meta.json.
+        """
+        with self.lock:
+            dirty = [(k, self.partitions[k][0]) for k in self.dirty]
+            self.in_flight.update(self.dirty)
+            self.dirty = set()
+            position = self.position
+        for i, ((granularity, key), frame) in enumerate(dirty):
+            try:
+                table = pa.Table.from_pandas(frame.reset_index(), preserve_index=False)
+                table = table.replace_schema_metadata({"rows_applied": str(position)})
+                path = partition_path(self.root, granularity, key)
+                pq.write_table(table, path + ".tmp", compression="zstd")
+                os.replace(path + ".tmp", path)
+            except BaseException:
+                # Ghi lỗi: các partition chưa ghi được đánh dấu lại để lần flush sau ghi tiếp
+                with self.lock:
+                    for cache_key, _ in dirty[i:]:
+                        self.dirty.add(cache_key)
+                        self.in_flight.discard(cache_key)
+                raise
+            with self.lock:
+                entry = self.partitions.get((granularity, key))
+                if entry is not None:
+                    entry[1] = max(entry[1], position)
+                self.in_flight.discard((granularity, key))
+        if dirty:
+            self.write_meta({**self.read_meta(), "rows_applied": position})
+        return len(dirty)
+
+    def prune(self, granularity, before):
+        """
+        Xoá các partition của granularity nằm trọn trước thời điểm before (retention) và ghi mốc
+        còn giữ vào meta.json để phía đọc không dùng granularity này cho khoảng đã xoá.
+        Không gọi song song với flush. Trả về (số file, số byte đã xoá).
+        """
+        cutoff = partition_key(before, granularity)
+        files, reclaimed = 0, 0
+        with self.lock:
+            for path in glob.glob(os.path.join(rollup_dir(self.root, granularity), "*.parquet")):
+                key = os.path.basename(path)[:-len(".parquet")]
+                if key >= cutoff:
+                    continue
+                self.partitions.pop((granularity, key), None)
+                self.dirty.discard((granularity, key))
+                try:
+                    reclaimed += os.path.getsize(path)
+                    os.remove(path)
+                    files += 1
+                except FileNotFoundError:
+                    pass
+        if files:
+            meta = self.read_meta()
+            retained = meta.setdefault("retained_from", {})
+            horizon = pd.Timestamp(cutoff).strftime(DATE_FORMAT)
+            retained[granularity] = max(retained.get(granularity, horizon), horizon)
+            self.write_meta(meta)
+        return files, reclaimed
+
+    def catch_up(self, store):
+        """
+        Tổng hợp các dòng đã ghi nhưng chưa có trong rollup (ví dụ sau khi dừng đột ngột
+        hoặc lần đầu bật rollup trên dữ liệu cũ).
+        """
+        if store.total_rows <= self.position:
+            return 0
+        start = self.position
+        df = read_from_position(self.root, start).to_pandas()
+        self.apply(df, start)
+        self.flush()
+        return len(df)
+
+
+# ---------------------------------------------------------------- phía đọc
+_read_cache = {}
+_read_lock = threading.Lock()
+
+
+def read_partition(path):
+    # Cache theo (đường dẫn, mtime) dùng chung cho mọi phiên trong tiến trình
+    mtime = os.stat(path).st_mtime_ns
+    with _read_lock:
+        cached = _read_cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    df = pq.read_table(path).to_pandas()
+    with _read_lock:
+        _read_cache[path] = (mtime, df)
+    return df
+
+
+def retained_from(root):
+    """
+    Mốc bắt đầu dữ liệu còn giữ của các granularity đã bị retention xoá bớt: {granularity: Timestamp}.
+    """
+    try:
+        with open(os.path.join(rollup_dir(root), META_NAME), "r", encoding="utf-8") as f:
+            retained = json.load(f).get("retained_from", {})
+    except FileNotFoundError:
+        return {}
+    return {granularity: pd.Timestamp(value) for granularity, value in retained.items()}
+
+
+def load_rollup(root, granularity, start=None, end=None):
+    """
+    Đọc bảng tổng hợp của một granularity, chỉ mở các partition giao với [start, end].
+    Bucket đầu cửa sổ được làm tròn xuống theo granularity.
+    """
+    low = partition_key(start, granularity) if start is not None else None
+    high = partition_key(end, granularity) if end is not None else None
+    frames = []
+    for path in sorted(glob.glob(os.path.join(rollup_dir(root, granularity), "*.parquet"))):
+        key = os.path.basename(path)[:-len(".parquet")]
+        if (low is not None and key < low) or (high is not None and key > high):
+            continue
+        try:
+            frames.append(read_partition(path))
+        except FileNotFoundError:
+            continue
+    if not frames:
+        return pd.DataFrame(columns=KEY_COLUMNS + VALUE_COLUMNS).astype({"bucket": "datetime64[ns]"})
+
+    df = pd.concat(frames, ignore_index=True)
+    if start is not None:
+        df = df[df["bucket"] >= floor_bucket(pd.Series([pd.Timestamp(start)]), granularity)[0]]
+    if end is not None:
+        df = df[df["bucket"] <= pd.Timestamp(end)]
+    return df
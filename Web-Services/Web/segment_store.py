@@ -0,0 +1,501 @@
+import glob
+import json
+import os
+import threading
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Bộ lưu trữ dạng cột cho dữ liệu giao dịch:
+#   segments/manifest.json      -> danh sách segment đã niêm phong + log đang ghi
+#   segments/log-000007.jsonl   -> log đang ghi (append-only, giới hạn SEGMENT_ROWS dòng)
+#   segments/seg-000003.parquet -> segment bất biến, cột chuỗi được mã hoá dictionary
+# Log đầy sẽ được niêm phong thành segment Parquet; compactor gộp các segment nhỏ.
+# Vị trí dòng (thứ tự ghi) không đổi khi retention xoá các segment đầu: manifest["rows_dropped"]
+# là số dòng đã xoá, vị trí của dòng đầu tiên còn lại.
+
+STORE_DIR_NAME = "segments"
+MANIFEST_NAME = "manifest.json"
+LEGACY_FILE_NAME = "received_data.jsonl"
+
+SEGMENT_ROWS = int(os.environ.get("SEGMENT_ROWS", 50_000))
+COMPACT_TARGET_ROWS = int(os.environ.get("COMPACT_TARGET_ROWS", 1_000_000))
+COMPACT_MIN_SEGMENTS = int(os.environ.get("COMPACT_MIN_SEGMENTS", 4))
+ROW_GROUP_ROWS = 65_536  # Row group nhỏ để đọc đuôi segment chỉ chạm một row group
+READ_RETRIES = 5
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+DICTIONARY_COLUMNS = ["stockCode", "description", "country", "customerID"]
+
+SCHEMA = pa.schema([
+    ("invoiceNo", pa.string()),
+    ("stockCode", pa.dictionary(pa.int32(), pa.string())),
+    ("description", pa.dictionary(pa.int32(), pa.string())),
+    ("quantity", pa.int64()),
+    ("unitPrice", pa.float64()),
+    ("invoiceDate", pa.timestamp("s")),
+    ("customerID", pa.dictionary(pa.int32(), pa.string())),
+    ("country", pa.dictionary(pa.int32(), pa.string())),
+])
+
+
+def store_dir(root):
+    return os.path.join(root, STORE_DIR_NAME)
+
+
+def log_path(root, log_id):
+    return os.path.join(store_dir(root), f"log-{log_id:06d}.jsonl")
+
+
+def segment_path(root, file_name):
+    return os.path.join(store_dir(root), file_name)
+
+
+def empty_manifest():
+    return {"version": 0, "active_log": 1, "next_segment": 1, "segments": [], "rows_dropped": 0}
+
+
+def read_manifest(root):
+    try:
+        with open(os.path.join(store_dir(root), MANIFEST_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return empty_manifest()
+
+
+def write_manifest(root, manifest):
+    # Ghi file tạm rồi os.replace để reader không bao giờ thấy manifest dở dang
+    path = os.path.join(store_dir(root), MANIFEST_NAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def data_signature(root):
+    """
+    Dấu hiệu thay đổi rẻ: phiên bản manifest + (inode, kích thước, mtime) của log đang ghi.
+    """
+    manifest = read_manifest(root)
+    try:
+        stat = os.stat(log_path(root, manifest["active_log"]))
+        log_stat = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    except FileNotFoundError:
+        log_stat = None
+    return manifest["version"], manifest["active_log"], log_stat
+
+
+def parse_dates(series):
+    dates = pd.to_datetime(series, format=DATE_FORMAT, errors="coerce")
+    retry = dates.isna() & series.notna()
+    if retry.any():
+        dates[retry] = pd.to_datetime(series[retry], errors="coerce")
+    return dates
+
+
+def frame_to_table(df):
+    """
+    Chuẩn hoá DataFrame bản ghi thô (kiểu JSON) thành bảng Arrow theo SCHEMA.
+    """
+    n = len(df)
+
+    def column(name):
+        if name in df.columns:
+            return df[name]
+        return pd.Series([None] * n, index=df.index, dtype=object)
+
+    def text(name):
+        values = column(name)
+        return values.where(values.isna(), values.astype(str))
+
+    arrays = {
+        "invoiceNo": pa.array(text("invoiceNo"), type=pa.string(), from_pandas=True),
+        "quantity": pa.array(pd.to_numeric(column("quantity"), errors="coerce").fillna(0).astype("int64")),
+        "unitPrice": pa.array(pd.to_numeric(column("unitPrice"), errors="coerce").astype("float64"), from_pandas=True),
+        "invoiceDate": pa.array(parse_dates(column("invoiceDate")), type=pa.timestamp("s"), from_pandas=True),
+    }
+    for name in DICTIONARY_COLUMNS:
+        arrays[name] = pa.array(text(name), type=pa.string(), from_pandas=True).dictionary_encode()
+
+    return pa.table([arrays[field.name] for field in SCHEMA], schema=SCHEMA)
+
+
+def records_to_table(records):
+    return frame_to_table(pd.DataFrame(records))
+
+
+def read_log_records(path):
+    rows = []
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rows.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue  # Bỏ qua dòng bị ghi dở
+    except FileNotFoundError:
+        pass
+    return rows
+
+
+def read_log_table(path):
+    return records_to_table(read_log_records(path))
+
+
+def read_segment_table(root, segment, columns=None, start=None, end=None):
+    filters = []
+    if start is not None:
+        filters.append(("invoiceDate", ">=", pd.Timestamp(start).to_pydatetime()))
+    if end is not None:
+        filters.append(("invoiceDate", "<=", pd.Timestamp(end).to_pydatetime()))
+    return pq.read_table(
+        segment_path(root, segment["file"]),
+        columns=columns,
+        filters=filters or None,
+        read_dictionary=[c for c in DICTIONARY_COLUMNS if columns is None or c in columns],
+    )
+
+
+def segment_overlaps(segment, start=None, end=None):
+    if segment.get("min_date") is None:
+        return True
+    if start is not None and pd.Timestamp(segment["max_date"]) < pd.Timestamp(start):
+        return False
+    if end is not None and pd.Timestamp(segment["min_date"]) > pd.Timestamp(end):
+        return False
+    return True
+
+
+def filter_table(table, start=None, end=None):
+    df_dates = table.column("invoiceDate").to_pandas()
+    mask = pd.Series(True, index=df_dates.index)
+    if start is not None:
+        mask &= df_dates >= pd.Timestamp(start)
+    if end is not None:
+        mask &= df_dates <= pd.Timestamp(end)
+    return table.filter(pa.array(mask.to_numpy()))
+
+
+def read_table(root, columns=None, start=None, end=None):
+    """
+    Đọc snapshot nhất quán: các segment trong manifest + log đang ghi.
+    Nếu manifest đổi giữa chừng (niêm phong/compaction) thì đọc lại.
+    """
+    for _ in range(READ_RETRIES):
+        manifest = read_manifest(root)
+        try:
+            tables = [
+                read_segment_table(root, segment, columns, start, end)
+                for segment in manifest["segments"]
+                if segment_overlaps(segment, start, end)
+            ]
+        except (FileNotFoundError, OSError):
+            continue  # Segment vừa bị compaction xoá -> đọc lại manifest
+
+        log_table = read_log_table(log_path(root, manifest["active_log"]))
+        if start is not None or end is not None:
+            log_table = filter_table(log_table, start, end)
+        if columns is not None:
+            log_table = log_table.select(columns)
+        tables.append(log_table)
+
+        if read_manifest(root)["version"] == manifest["version"]:
+            schema = tables[-1].schema
+            return pa.concat_tables([t.cast(schema) for t in tables])
+    raise RuntimeError(f"Không đọc được snapshot ổn định từ {store_dir(root)}")
+
+
+def read_from_position(root, position):
+    """
+    Đọc các dòng có vị trí (thứ tự ghi) >= position, bỏ qua các segment nằm trọn phía trước.
+    """
+    for _ in range(READ_RETRIES):
+        manifest = read_manifest(root)
+        tables = []
+        offset = manifest.get("rows_dropped", 0)
+        try:
+            for segment in manifest["segments"]:
+                if offset + segment["rows"] > position:
+                    table = read_segment_table(root, segment)
+                    tables.append(table.slice(max(0, position - offset)))
+                offset += segment["rows"]
+        except (FileNotFoundError, OSError):
+            continue
+        log_table = read_log_table(log_path(root, manifest["active_log"]))
+        tables.append(log_table.slice(max(0, position - offset)))
+
+        if read_manifest(root)["version"] == manifest["version"]:
+            schema = tables[-1].schema
+            return pa.concat_tables([t.cast(schema) for t in tables])
+    raise RuntimeError(f"Không đọc được snapshot ổn định từ {store_dir(root)}")
+
+
+def count_rows(root):
+    """
+    Số dòng đã ghi (segment + các dòng trọn vẹn trong log đang ghi), không đọc dữ liệu segment.
+    """
+    manifest = read_manifest(root)
+    rows = manifest.get("rows_dropped", 0) + sum(segment["rows"] for segment in manifest["segments"])
+    return rows + len(read_log_records(log_path(root, manifest["active_log"])))
+
+
+def read_frame(root, columns=None, start=None, end=None):
+    """
+    Trả về DataFrame có kiểu sẵn (category cho cột chuỗi, datetime cho invoiceDate),
+    không cần json.loads từng dòng.
+    """
+    return read_table(root, columns, start, end).to_pandas()
+
+
+class SegmentStore:
+    """
+    Phía ghi của bộ lưu trữ segment. Chỉ một tiến trình được ghi vào một thư mục.
+    """
+
+    def __init__(self, root, segment_rows=SEGMENT_ROWS):
+        self.root = root
+        self.segment_rows = segment_rows
+        self.lock = threading.Lock()
+        self.maintenance_lock = threading.Lock()
+        os.makedirs(store_dir(root), exist_ok=True)
+        self.manifest = read_manifest(root)
+        self.recover()
+        self.active_rows = len(read_log_records(log_path(root, self.manifest["active_log"])))
+        self.log_file = None
+
+    @property
+    def total_rows(self):
+        # Tổng số dòng đã ghi (kể cả đã bị retention xoá) = vị trí của dòng kế tiếp
+        segment_rows = sum(segment["rows"] for segment in self.manifest["segments"])
+        return self.manifest.get("rows_dropped", 0) + segment_rows + self.active_rows
+
+    # ------------------------------------------------------------------ ghi
+    def append(self, records):
+        """
+        Ghi một lô bản ghi vào log đang ghi (một lần fsync), niêm phong khi đầy.
+        """
+        return self.append_lines("".join(json.dumps(record) + "\n" for record in records), len(records))
+
+    def append_lines(self, text, rows):
+        """
+        Ghi sẵn các dòng JSON đã mã hoá (mỗi dòng kết thúc bằng \\n) với một lần fsync.
+        Trả về vị trí của dòng đầu tiên trong lô.
+        """
+        with self.lock:
+            position = self.total_rows
+            if not rows:
+                return position
+            # Giữ file log mở suốt vòng đời log thay vì open/close mỗi lô
+            if self.log_file is None:
+                self.log_file = open(log_path(self.root, self.manifest["active_log"]), "a", encoding="utf-8")
+            self.log_file.write(text)
+            self.log_file.flush()
+            os.fsync(self.log_file.fileno())
+            self.active_rows += rows
+            if self.active_rows >= self.segment_rows:
+                self._seal_locked()
+        return position
+
+    def append_table(self, table, segment_rows=COMPACT_TARGET_ROWS, manifest_updates=None):
+        """
+        Nhập nhanh một bảng Arrow (theo SCHEMA) thẳng thành các segment, không qua log
+        (dùng khi nạp dữ liệu lớn có sẵn). Log đang ghi được niêm phong trước để giữ thứ tự dòng.
+        manifest_updates: các khoá ghi vào manifest cùng lần cập nhật với segment mới (nguyên tử).
+        Trả về vị trí của dòng đầu tiên.
+        """
+        with self.lock:
+            if self.active_rows:
+                self._seal_locked()
+            position = self.total_rows
+            manifest = dict(self.manifest)
+            manifest["segments"] = list(manifest["segments"])
+            for offset in range(0, table.num_rows, segment_rows):
+                segment_id = self._allocate_segment_id(manifest)
+                manifest["segments"].append(self._write_segment(table.slice(offset, segment_rows), segment_id))
+            manifest.update(manifest_updates or {})
+            manifest["version"] += 1
+            write_manifest(self.root, manifest)
+            self.manifest = manifest
+        return position
+
+    def seal(self):
+        with self.lock:
+            if self.active_rows:
+                self._seal_locked()
+
+    def close(self):
+        with self.lock:
+            if self.log_file is not None:
+                self.log_file.close()
+                self.log_file = None
+
+    def _seal_locked(self):
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
+
+        log_id = self.manifest["active_log"]
+        source = log_path(self.root, log_id)
+        table = read_log_table(source)
+
+        manifest = dict(self.manifest)
+        manifest["segments"] = list(manifest["segments"])
+        if table.num_rows:
+            segment_id = self._allocate_segment_id(manifest)
+            manifest["segments"].append(self._write_segment(table, segment_id))
+        manifest["active_log"] = log_id + 1
+        manifest["version"] += 1
+        write_manifest(self.root, manifest)
+        self.manifest = manifest
+        self.active_rows = 0
+
+        if os.path.exists(source):
+            os.remove(source)
+
+    def _allocate_segment_id(self, manifest):
+        segment_id = manifest["next_segment"]
+        manifest["next_segment"] = segment_id + 1
+        return segment_id
+
+    def _write_segment(self, table, segment_id):
+        file_name = f"seg-{segment_id:06d}.parquet"
+        path = segment_path(self.root, file_name)
+        tmp_path = path + ".tmp"
+        pq.write_table(
+            table, tmp_path, use_dictionary=DICTIONARY_COLUMNS, compression="zstd", row_group_size=ROW_GROUP_ROWS
+        )
+        os.replace(tmp_path, path)
+
+        dates = table.column("invoiceDate").to_pandas().dropna()
+        return {
+            "file": file_name,
+            "rows": table.num_rows,
+            "bytes": os.path.getsize(path),
+            "min_date": dates.min().strftime(DATE_FORMAT) if len(dates) else None,
+            "max_date": dates.max().strftime(DATE_FORMAT) if len(dates) else None,
+        }
+
+    # ------------------------------------------------------------- khôi phục
+    def recover(self):
+        """
+        Dọn dẹp sau khi tiến trình dừng đột ngột và chuyển file received_data.jsonl cũ.
+        """
+        active = self.manifest["active_log"]
+        for path in glob.glob(os.path.join(store_dir(self.root), "log-*.jsonl")):
+            log_id = int(os.path.basename(path)[4:10])
+            if log_id < active:
+                os.remove(path)  # Đã được niêm phong trước khi dừng
+
+        for path in glob.glob(os.path.join(store_dir(self.root), "*.tmp")):
+            os.remove(path)
+
+        legacy = os.path.join(self.root, LEGACY_FILE_NAME)
+        if os.path.exists(legacy):
+            table = read_log_table(legacy)
+            with self.lock:
+                manifest = dict(self.manifest)
+                manifest["segments"] = list(manifest["segments"])
+                if table.num_rows:
+                    segment_id = self._allocate_segment_id(manifest)
+                    manifest["segments"].append(self._write_segment(table, segment_id))
+                manifest["version"] += 1
+                write_manifest(self.root, manifest)
+                self.manifest = manifest
+            os.replace(legacy, legacy + ".migrated")
+
+    # ------------------------------------------------------------ compaction
+    def plan_compaction(self):
+        runs, run, run_rows = [], [], 0
+        for segment in self.manifest["segments"]:
+            if segment["rows"] < COMPACT_TARGET_ROWS and run_rows + segment["rows"] <= COMPACT_TARGET_ROWS:
+                run.append(segment)
+                run_rows += segment["rows"]
+                continue
+            if len(run) >= COMPACT_MIN_SEGMENTS:
+                runs.append(run)
+            run, run_rows = ([segment], segment["rows"]) if segment["rows"] < COMPACT_TARGET_ROWS else ([], 0)
+        if len(run) >= COMPACT_MIN_SEGMENTS:
+            runs.append(run)
+        return runs
+
+    def compact(self):
+        """
+        Gộp các dãy segment nhỏ liên tiếp thành một segment lớn. Trả về số segment đã gộp.
+        """
+        merged = 0
+        with self.maintenance_lock:
+            for run in self.plan_compaction():
+                table = pa.concat_tables([read_segment_table(self.root, s) for s in run]).unify_dictionaries()
+                table = table.combine_chunks()
+
+                # Ghi segment mới ngoài lock để không chặn luồng ingest
+                with self.lock:
+                    segment_id = self._allocate_segment_id(self.manifest)
+                new_segment = self._write_segment(table, segment_id)
+
+                with self.lock:
+                    manifest = dict(self.manifest)
+                    old_files = {s["file"] for s in run}
+                    segments = []
+                    for segment in manifest["segments"]:
+                        if segment["file"] == run[0]["file"]:
+                            segments.append(new_segment)
+                        elif segment["file"] not in old_files:
+                            segments.append(segment)
+                    manifest["segments"] = segments
+                    manifest["version"] += 1
+                    write_manifest(self.root, manifest)
+                    self.manifest = manifest
+
+                # Reader đang đọc file cũ sẽ thấy version đổi và tự đọc lại
+                for file_name in old_files:
+                    try:
+                        os.remove(segment_path(self.root, file_name))
+                    except FileNotFoundError:
+                        pass
+                merged += len(run)
+        return merged
+
+    # ------------------------------------------------------------- retention
+    def drop_prefix(self, before=None, max_position=None):
+        """
+        Xoá dãy segment liên tiếp từ đầu (theo thứ tự ghi) mà mọi dòng đều có invoiceDate < before
+        và vị trí dòng cuối < max_position (ví dụ: đã được tổng hợp/gộp). Log đang ghi không bị xoá.
+        Manifest mới (tăng rows_dropped) được ghi nguyên tử trước khi xoá file; reader đang đọc
+        file cũ sẽ thấy version đổi và tự đọc lại. Trả về (số segment, số dòng, số byte đã xoá).
+        """
+        if before is None and max_position is None:
+            return 0, 0, 0
+        before = pd.Timestamp(before) if before is not None else None
+        with self.maintenance_lock:
+            with self.lock:
+                manifest = dict(self.manifest)
+                position = manifest.get("rows_dropped", 0)
+                dropped = []
+                for segment in manifest["segments"]:
+                    if max_position is not None and position + segment["rows"] > max_position:
+                        break
+                    if before is not None and segment.get("max_date") and pd.Timestamp(segment["max_date"]) >= before:
+                        break
+                    dropped.append(segment)
+                    position += segment["rows"]
+                if not dropped:
+                    return 0, 0, 0
+                manifest["segments"] = manifest["segments"][len(dropped):]
+                manifest["rows_dropped"] = position
+                manifest["version"] += 1
+                write_manifest(self.root, manifest)
+                self.manifest = manifest
+
+            reclaimed = 0
+            for segment in dropped:
+                path = segment_path(self.root, segment["file"])
+                try:
+                    reclaimed += os.path.getsize(path)
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        return len(dropped), sum(segment["rows"] for segment in dropped), reclaimed
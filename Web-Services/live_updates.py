@@ -0,0 +1,138 @@
+import asyncio
+import json
+import os
+from collections import deque
+
+# Đẩy thay đổi tới client (dashboard) qua Server-Sent Events thay vì để client đọc lại file định kỳ.
+# Mỗi nhóm ghi thành công tạo một sự kiện "delta": khoảng vị trí dòng mới, các bucket phút bị đổi
+# (phần cộng thêm) và tối đa LIVE_MAX_ROWS dòng mới nhất. id của sự kiện là vị trí cuối (tổng số dòng).
+
+LIVE_QUEUE_SIZE = int(os.environ.get("LIVE_QUEUE_SIZE", 256))  # Sự kiện chờ gửi tối đa cho mỗi client
+LIVE_HISTORY = int(os.environ.get("LIVE_HISTORY", 256))        # Sự kiện gần nhất giữ lại để client nối lại
+LIVE_MAX_ROWS = int(os.environ.get("LIVE_MAX_ROWS", 500))      # Số dòng mới gửi kèm mỗi sự kiện
+LIVE_HEARTBEAT = float(os.environ.get("LIVE_HEARTBEAT", 15))   # Giây; giữ kết nối qua proxy
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+RESET = object()  # Client chậm bị bỏ sự kiện: báo client tự đọc lại
+CLOSE = object()
+
+
+def build_event(df, first_position):
+    """
+    Tóm tắt một nhóm dòng vừa ghi (DataFrame đã có kiểu) thành sự kiện delta.
+    """
+    dates = df["invoiceDate"]
+    buckets = (
+        df.assign(total=df["quantity"] * df["unitPrice"], bucket=dates.dt.floor("min"))
+        .groupby("bucket")[["quantity", "total"]].sum()
+    )
+    tail = df.tail(LIVE_MAX_ROWS)
+    tail = tail.assign(invoiceDate=tail["invoiceDate"].dt.strftime(DATE_FORMAT))
+    return {
+        "start": first_position,
+        "end": first_position + len(df),
+        "rows": len(df),
+        "min_date": dates.min().strftime(DATE_FORMAT) if dates.notna().any() else None,
+        "max_date": dates.max().strftime(DATE_FORMAT) if dates.notna().any() else None,
+        "buckets": [
+            {"bucket": bucket.strftime(DATE_FORMAT), "quantity": int(row.quantity), "total": float(row.total)}
+            for bucket, row in buckets.iterrows()
+        ],
+        "records": json.loads(tail.to_json(orient="records", force_ascii=False)),
+        "truncated": len(df) > LIVE_MAX_ROWS,
+    }
+
+
+def format_sse(event, data, event_id=None):
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
+
+
+class DeltaBroker:
+    """
+    Nhận nhóm dòng từ writer (listener của GroupCommitWriter, chạy trong luồng ghi)
+    và phát sự kiện cho mọi client đang nghe trên event loop.
+    """
+
+    def __init__(self, queue_size=LIVE_QUEUE_SIZE, history=LIVE_HISTORY):
+        self.queue_size = queue_size
+        self.history = deque(maxlen=history)
+        self.subscribers = set()
+        self.loop = None
+        self.position = 0
+
+    def start(self, position):
+        self.loop = asyncio.get_running_loop()
+        self.position = position
+
+    def close(self):
+        for queue in list(self.subscribers):
+            self._put(queue, CLOSE)
+
+    def publish(self, df, first_position):
+        # Gọi từ luồng ghi: dựng sự kiện ở đây, chuyển việc phát về event loop
+        if self.loop is None or df.empty:
+            return
+        event = build_event(df, first_position)
+        self.loop.call_soon_threadsafe(self._dispatch, event)
+
+    def _dispatch(self, event):
+        self.history.append(event)
+        self.position = max(self.position, event["end"])
+        for queue in list(self.subscribers):
+            self._put(queue, event)
+
+    def _put(self, queue, item):
+        try:
+            queue.put_nowait(item)
+        except asyncio.QueueFull:
+            # Client không theo kịp: bỏ các sự kiện đang chờ, client sẽ đọc lại toàn bộ
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(RESET if item is not CLOSE else CLOSE)
+
+    def _missed(self, last_id):
+        """
+        Sự kiện client đã lỡ kể từ vị trí last_id; None nếu không còn đủ trong lịch sử.
+        """
+        if last_id >= self.position:
+            return []
+        missed = [event for event in self.history if event["end"] > last_id]
+        if not missed or missed[0]["start"] > last_id:
+            return None
+        return missed
+
+    async def stream(self, last_id=None):
+        """
+        Chuỗi SSE cho một client: "hello" (vị trí hiện tại), các sự kiện lỡ khi nối lại
+        (theo Last-Event-ID), sau đó "delta" theo thời gian thực; "reset" khi client cần đọc lại.
+        """
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.add(queue)
+        # Lấy sự kiện lỡ ngay khi đăng ký (chưa nhường event loop) để không trùng hay hụt sự kiện
+        missed = self._missed(last_id) if last_id is not None else []
+        position = self.position
+        try:
+            yield format_sse("hello", {"position": position}, position if last_id is None else None)
+            if missed is None:
+                yield format_sse("reset", {"position": position}, position)
+            else:
+                for event in missed:
+                    yield format_sse("delta", event, event["end"])
+            while True:
+                try:
+                    item = await asyncio.wait_for(queue.get(), LIVE_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if item is CLOSE:
+                    break
+                if item is RESET:
+                    yield format_sse("reset", {"position": self.position}, self.position)
+                else:
+                    yield format_sse("delta", item, item["end"])
+        finally:
+            self.subscribers.discard(queue)
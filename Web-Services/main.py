@@ -1,91 +1,386 @@
-from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
-from datetime import datetime
-import json
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from typing import Optional
+import asyncio
 import os
+import sys
+import threading
+
+# ✅ Xác định đường dẫn tuyệt đối đến thư mục Web (nơi chứa segments/ của bộ lưu trữ dạng cột)
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))  # thư mục chứa main.py
+WEB_DIR = os.environ.get("RETAIL_DATA_DIR", os.path.join(BASE_DIR, "Web"))
+
+# Các module dùng chung với dashboard nằm trong Web/
+sys.path.append(os.path.join(BASE_DIR, "Web"))
+from segment_store import SegmentStore, count_rows, read_from_position, read_manifest
+from rollups import RollupStore
+from heavy_hitters import HeavyHitterStore
+from tail_reader import read_tail
+from query_engine import run_query, run_scatter
+from downsampling import SCATTER_MAX_POINTS
+from write_buffer import GroupCommitWriter, WriterBusyError
+from live_updates import DeltaBroker
+from sharding import MERGE_INTERVAL, ShardMerger, claim_shard, merger_lock, shard_root
+from retention import RETENTION_INTERVAL, RetentionPolicy
+from validation import (LineTooLongError, iter_ndjson_chunks, parse_ndjson_columns, parse_ndjson_records,
+                        records_to_frame, validate_frame)
+from metrics import CONTENT_TYPE, PROFILE_ENDPOINT, REGISTRY, profile_for, stage, start_profiler_from_env, track_requests
 
 app = FastAPI()
+track_requests(app, "ingest")
 
-# ✅ Xác định đường dẫn tuyệt đối đến thư mục Web và file received_data.jsonl
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))  # thư mục chứa main.py
-WEB_DIR = os.path.join(BASE_DIR, "Web")
-DATA_FILE = os.path.join(WEB_DIR, "received_data.jsonl")
+# Số bản ghi nhận được, theo kết quả kiểm tra (accepted/skipped)
+INGEST_ROWS = REGISTRY.counter("retail_ingest_rows_total", "Số bản ghi nhận qua /ingest", ("endpoint", "result"))
+
+# Chu kỳ chạy compactor gộp các segment nhỏ (giây)
+COMPACT_INTERVAL = float(os.environ.get("COMPACT_INTERVAL", 60))
+# Chu kỳ lưu các bảng tổng hợp (rollup, sketch top-K) xuống đĩa (giây)
+ROLLUP_FLUSH_INTERVAL = float(os.environ.get("ROLLUP_FLUSH_INTERVAL", 2))
+
+# "single": một tiến trình ghi thẳng vào store chính (mặc định).
+# "sharded": chạy được nhiều worker (uvicorn --workers N); mỗi worker ghi vào shard riêng,
+# một worker giữ merger.lock gộp các shard theo invoiceDate vào store chính mà reader đọc.
+INGEST_MODE = os.environ.get("INGEST_MODE", "single")
+SHARDED = INGEST_MODE == "sharded"
 
-# Các trường bắt buộc
-REQUIRED_FIELDS = ["description", "quantity", "invoiceDate"]
+os.makedirs(WEB_DIR, exist_ok=True)  # Đảm bảo thư mục Web tồn tại
+store = None          # Store mà writer của tiến trình này ghi vào (store chính hoặc shard)
+merged_store = None   # Store chính; ở chế độ sharded chỉ tiến trình gộp mở
+rollups = None
+heavy_hitters = None
+merger = None
+shard_name = None
+if not SHARDED:
+    store = merged_store = SegmentStore(WEB_DIR)
+    rollups = RollupStore(WEB_DIR)
+    heavy_hitters = HeavyHitterStore(WEB_DIR)
+# Phát các nhóm dòng vừa ghi tới dashboard qua /api/stream (SSE)
+broker = DeltaBroker()
+# Giữ dòng thô trong cửa sổ gần đây, dữ liệu cũ chỉ còn ở rollup (RETENTION_* trong retention.py)
+retention = RetentionPolicy(WEB_DIR)
+# Lưu bảng tổng hợp và retention không chạy song song (retention xoá file mà flush có thể ghi lại)
+aggregates_lock = threading.Lock()
+
+# "durable": trả lời sau khi nhóm chứa lô đã fsync; "queued": trả lời ngay khi lô vào hàng đợi
+INGEST_ACK = os.environ.get("INGEST_ACK", "durable")
+writer = None
+
+# Số điểm tối đa /api/data trả về trong một lần gọi
+MAX_TAIL_POINTS = 10_000
 
 @app.post("/ingest")
 async def ingest_data(request: Request):
-    data = await request.json()
-    valid_records = []
+    with stage("ingest", "ingest", "parse"):
+        data = await request.json()
 
-    def is_valid(record):
-        try:
-            if not all(record.get(field) not in [None, ""] for field in REQUIRED_FIELDS):
-                return False
-            quantity = float(record.get("quantity"))
-            if quantity < 0:
-                return False
-            return True
-        except (ValueError, TypeError):
-            return False
-
-    # Lọc dữ liệu hợp lệ
-    if isinstance(data, list):
-        valid_records = [record for record in data if is_valid(record)]
-    elif isinstance(data, dict):
-        if is_valid(data):
-            valid_records = [data]
-    else:
-        return {"message": "❌ Dữ liệu không hợp lệ"}
+    # Lọc dữ liệu hợp lệ (kiểm tra theo cột cho cả lô)
+    with stage("ingest", "ingest", "validate"):
+        df = records_to_frame(data)
+        if df is None:
+            return {"message": "❌ Dữ liệu không hợp lệ"}
+        valid_df, skipped = validate_frame(df)
+    INGEST_ROWS.inc(len(valid_df), endpoint="ingest", result="accepted")
+    INGEST_ROWS.inc(skipped, endpoint="ingest", result="skipped")
+
+    # Ghi vào bộ lưu trữ nếu hợp lệ (thời gian chờ tới khi nhóm chứa lô đã fsync)
+    if not valid_df.empty:
+        with stage("ingest", "ingest", "write"):
+            await submit_batch(valid_df)
 
-    # Ghi vào file nếu hợp lệ
-        # Ghi vào file nếu hợp lệ
-    if valid_records:
-        os.makedirs(WEB_DIR, exist_ok=True)  # Đảm bảo thư mục Web tồn tại
-        with open(DATA_FILE, "a", encoding="utf-8") as f:
-            for record in valid_records:
-                # ⚙️ Nếu customerID bị thiếu hoặc null, gán giá trị mặc định
-                if record.get("customerID") in [None, ""]:
-                    record["customerID"] = "unknown CustomerID"
+    return {
+        "message": f"✅ Đã ghi {len(valid_df)} bản ghi hợp lệ",
+        "skipped": skipped
+    }
+
+@app.post("/ingest/bulk")
+async def ingest_bulk(request: Request, format: str = "records"):
+    """
+    Nhận NDJSON dạng stream: mỗi dòng một bản ghi (format=records) hoặc
+    một khối dạng cột {"field": [...]} (format=columns). Body được xử lý
+    theo từng khối BULK_CHUNK_ROWS dòng, không đọc toàn bộ vào bộ nhớ. Dòng dài quá
+    BULK_MAX_LINE_BYTES thì trả 413; các khối trước đó đã được ghi.
+    """
+    parse = parse_ndjson_columns if format == "columns" else parse_ndjson_records
+    accepted = 0
+    skipped = 0
+    invalid_lines = 0  # Dòng NDJSON không đọc được (đã tính vào skipped nếu biết số bản ghi)
 
-                f.write(json.dumps(record) + "\n")
+    try:
+        async for lines in iter_ndjson_chunks(request.stream()):
+            with stage("ingest", "ingest_bulk", "parse"):
+                df, parse_skipped, parse_invalid = parse(lines)
+            skipped += parse_skipped
+            invalid_lines += parse_invalid
+            with stage("ingest", "ingest_bulk", "validate"):
+                valid_df, chunk_skipped = validate_frame(df)
+            skipped += chunk_skipped
+            if not valid_df.empty:
+                with stage("ingest", "ingest_bulk", "write"):
+                    await submit_batch(valid_df)
+                accepted += len(valid_df)
+    except LineTooLongError as e:
+        INGEST_ROWS.inc(accepted, endpoint="ingest_bulk", result="accepted")
+        INGEST_ROWS.inc(skipped, endpoint="ingest_bulk", result="skipped")
+        raise HTTPException(status_code=413, detail=f"❌ {e} (đã ghi {accepted} bản ghi trước dòng này)")
 
-        os.makedirs(WEB_DIR, exist_ok=True)  # Đảm bảo thư mục Web tồn tại
-        with open(DATA_FILE, "a", encoding="utf-8") as f:
-            for record in valid_records:
-                f.write(json.dumps(record) + "\n")
+    INGEST_ROWS.inc(accepted, endpoint="ingest_bulk", result="accepted")
+    INGEST_ROWS.inc(skipped, endpoint="ingest_bulk", result="skipped")
 
     return {
-        "message": f"✅ Đã ghi {len(valid_records)} bản ghi hợp lệ",
-        "skipped": (len(data) if isinstance(data, list) else 1) - len(valid_records)
+        "message": f"✅ Đã ghi {accepted} bản ghi hợp lệ",
+        "skipped": skipped,
+        "invalid_lines": invalid_lines,
     }
 
+async def submit_batch(batch):
+    # Chuyển lô cho writer task (group commit), không mở file trong handler
+    try:
+        await writer.submit(batch, wait_durable=INGEST_ACK == "durable")
+    except WriterBusyError:
+        raise HTTPException(status_code=503, detail="⏳ Hệ thống ghi đang quá tải, thử lại sau")
+
 @app.get("/api/data")
-async def get_data():
-    if not os.path.exists(DATA_FILE):
-        return JSONResponse(content={"labels": [], "data": []})
+async def get_data(n: int = 20, since: Optional[str] = None):
+    """
+    n điểm mới nhất (tuỳ chọn chỉ lấy từ thời điểm since), đọc ngược từ cuối dữ liệu
+    nên độ trễ tỉ lệ với n chứ không với kích thước lịch sử.
+    """
+    n = max(1, min(n, MAX_TAIL_POINTS))
+    try:
+        points = await asyncio.to_thread(read_tail, WEB_DIR, n, since)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="❌ Tham số since không hợp lệ")
+
+    labels = [date.strftime("%H:%M") for date, _ in points]
+    quantities = [quantity for _, quantity in points]
+
+    return JSONResponse(content={"labels": labels, "data": quantities})
+
+@app.get("/api/query")
+async def query_data(
+    from_: Optional[str] = Query(None, alias="from"),
+    to: Optional[str] = None,
+    bucket: Optional[str] = None,
+    group_by: Optional[str] = None,
+    metric: str = "quantity",
+    top: Optional[int] = None,
+    order: str = "desc",
+    approximate: bool = False,
+):
+    """
+    Tổng hợp tại server: chỉ đọc partition rollup/segment giao với [from, to], trả về các nhóm đã tính.
+    group_by: danh sách cột cách nhau bởi dấu phẩy (country, stockCode, description, customerID).
+    """
+    columns = [column.strip() for column in group_by.split(",") if column.strip()] if group_by else []
+    try:
+        with stage("ingest", "query", "aggregate"):
+            result = await asyncio.to_thread(
+                run_query, WEB_DIR, from_, to, bucket, columns, metric, top, order, approximate
+            )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"❌ {e}")
+    return JSONResponse(content=result)
+
+@app.get("/api/scatter")
+async def scatter_data(
+    from_: Optional[str] = Query(None, alias="from"),
+    to: Optional[str] = None,
+    mode: str = "auto",
+    max_points: int = SCATTER_MAX_POINTS,
+):
+    """
+    Điểm (unitPrice, quantity) trong [from, to] đã giảm mẫu tại server cho biểu đồ phân tán.
+    """
+    try:
+        with stage("ingest", "query", "scatter"):
+            result = await asyncio.to_thread(run_scatter, WEB_DIR, from_, to, mode, max_points)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"❌ {e}")
+    return JSONResponse(content=result)
+
+@app.get("/api/stream")
+async def stream_updates(request: Request):
+    """
+    Server-Sent Events: mỗi nhóm dòng vừa ghi là một sự kiện "delta" (id = tổng số dòng sau nhóm).
+    Client nối lại với header Last-Event-ID sẽ nhận các sự kiện đã lỡ, hoặc "reset" nếu lỡ quá nhiều.
+    """
+    last_id = request.headers.get("last-event-id")
+    try:
+        last_id = int(last_id) if last_id else None
+    except ValueError:
+        last_id = None
+    return StreamingResponse(
+        broker.stream(last_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Histogram thời gian theo công đoạn/request và bộ đếm, định dạng văn bản Prometheus.
+    """
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
+
+# Chỉ đăng ký khi bật PROFILE_ENDPOINT (profiler cho cả vòng đời tiến trình: PROFILE_DIR)
+if PROFILE_ENDPOINT:
+    @app.get("/debug/profile")
+    async def get_profile(seconds: float = 5, interval: float = 0.01):
+        """
+        Lấy mẫu stack của tiến trình ingest trong seconds giây, trả về dạng folded (cho flamegraph).
+        """
+        seconds = max(0.1, min(seconds, 60))
+        folded = await asyncio.to_thread(profile_for, seconds, max(interval, 0.001))
+        return PlainTextResponse(folded)
 
-    labels = []
-    quantities = []
 
-    with open(DATA_FILE, "r", encoding="utf-8") as f:
-        for line in f:
+@app.get("/api/retention")
+async def get_retention():
+    """
+    Cấu hình retention, báo cáo lần chạy gần nhất và tổng số dòng/byte đã giải phóng.
+    """
+    return retention.status()
+
+@app.post("/api/retention/run")
+async def run_retention_now():
+    """
+    Chạy retention ngay (không chờ chu kỳ), trả về báo cáo dung lượng giải phóng.
+    """
+    return await asyncio.to_thread(apply_retention)
+
+
+def flush_aggregates():
+    with aggregates_lock:
+        if rollups is not None:
+            rollups.flush()
+            heavy_hitters.flush()
+
+
+def apply_retention():
+    reports = {}
+    with aggregates_lock:
+        if merged_store is not None and retention.enabled:
+            # Lưu bảng tổng hợp trước để watermark trên đĩa bao phủ các dòng sắp bị xoá
+            rollups.flush()
+            heavy_hitters.flush()
+            reports["store"] = retention.run(merged_store, rollups, heavy_hitters)
+    if SHARDED and store is not None:
+        # Phần shard đã gộp vào store chính không cần giữ lại
+        merged = read_manifest(WEB_DIR).get("shards", {}).get(shard_name, 0)
+        reports["shard"] = retention.trim_shard(store, merged)
+    return reports
+
+
+async def run_retention():
+    # 🗑️ Định kỳ xoá dòng thô/rollup cũ ngoài cửa sổ giữ lại
+    while True:
+        await asyncio.sleep(RETENTION_INTERVAL)
+        try:
+            await asyncio.to_thread(apply_retention)
+        except Exception as e:
+            print("❌ Lỗi retention:", e)
+
+
+async def run_rollup_flusher():
+    # 📊 Lưu các partition rollup và sketch vừa thay đổi để dashboard đọc
+    while True:
+        await asyncio.sleep(ROLLUP_FLUSH_INTERVAL)
+        try:
+            await asyncio.to_thread(flush_aggregates)
+        except Exception as e:
+            print("❌ Lỗi lưu rollup:", e)
+
+
+async def run_compactor():
+    # 🧹 Gộp định kỳ các segment nhỏ thành segment lớn
+    while True:
+        await asyncio.sleep(COMPACT_INTERVAL)
+        targets = [store] if merged_store in (None, store) else [store, merged_store]
+        for target in targets:
             try:
-                record = json.loads(line.strip())
-                invoice_date = record.get("invoiceDate")
-                quantity = record.get("quantity")
+                await asyncio.to_thread(target.compact)
+            except Exception as e:
+                print("❌ Lỗi compaction:", e)
+
+
+def follow_merged_rows():
+    # Worker không gộp: phát các dòng mới của store chính (do worker khác gộp) cho client SSE của mình
+    table = read_from_position(WEB_DIR, broker.position)
+    if table.num_rows:
+        broker.publish(table.to_pandas(), broker.position)
+
 
-                if not invoice_date or quantity is None:
-                    continue
+async def run_merger():
+    # 🔀 Chờ giữ merger.lock (một tiến trình gộp cho cả máy), trong lúc chờ thì theo dõi store chính
+    global merged_store, rollups, heavy_hitters, merger
+    lock = merger_lock(WEB_DIR)
+    while not lock.try_acquire():
+        try:
+            await asyncio.to_thread(follow_merged_rows)
+        except Exception as e:
+            print("❌ Lỗi đọc dữ liệu đã gộp:", e)
+        await asyncio.sleep(MERGE_INTERVAL)
+    app.state.merger_lock = lock
+
+    await asyncio.to_thread(follow_merged_rows)
+    merged_store = await asyncio.to_thread(SegmentStore, WEB_DIR)
+    rollups = RollupStore(WEB_DIR)
+    heavy_hitters = HeavyHitterStore(WEB_DIR)
+    await asyncio.to_thread(rollups.catch_up, merged_store)
+    await asyncio.to_thread(heavy_hitters.catch_up, merged_store)
+    merger = ShardMerger(WEB_DIR, merged_store, listeners=[rollups.apply, heavy_hitters.apply, broker.publish])
+    while True:
+        try:
+            merged = await asyncio.to_thread(merger.merge_once)
+        except Exception as e:
+            print("❌ Lỗi gộp shard:", e)
+            merged = 0
+        if not merged:
+            await asyncio.sleep(MERGE_INTERVAL)
 
-                # Parse time: "2020-01-01 12:00:00"
-                dt = datetime.strptime(invoice_date, "%Y-%m-%d %H:%M:%S")
-                label = dt.strftime("%H:%M")
 
-                labels.append(label)
-                quantities.append(quantity)
-            except Exception:
-                continue  # Bỏ qua dòng lỗi
+@app.on_event("startup")
+async def start_background_tasks():
+    global writer
+    global store, shard_name
+    start_profiler_from_env("ingest")
+    if SHARDED:
+        # Rollup, sketch và sự kiện SSE được cập nhật khi gộp (run_merger), không phải khi ghi shard
+        shard_name, app.state.shard_lock = claim_shard(WEB_DIR)
+        store = await asyncio.to_thread(SegmentStore, shard_root(WEB_DIR, shard_name))
+        broker.start(await asyncio.to_thread(count_rows, WEB_DIR))
+        writer = GroupCommitWriter(store)
+        app.state.merger = asyncio.create_task(run_merger())
+    else:
+        # Bổ sung rollup cho các dòng đã ghi trước đó nhưng chưa được tổng hợp
+        await asyncio.to_thread(rollups.catch_up, store)
+        await asyncio.to_thread(heavy_hitters.catch_up, store)
+        broker.start(store.total_rows)
+        writer = GroupCommitWriter(store, listeners=[rollups.apply, heavy_hitters.apply, broker.publish])
+    writer.start()
+    app.state.compactor = asyncio.create_task(run_compactor())
+    app.state.rollup_flusher = asyncio.create_task(run_rollup_flusher())
+    app.state.retention = asyncio.create_task(run_retention()) if retention.enabled or SHARDED else None
+
 
-    return JSONResponse(content={"labels": labels[-20:], "data": quantities[-20:]})
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    app.state.compactor.cancel()
+    app.state.rollup_flusher.cancel()
+    if app.state.retention is not None:
+        app.state.retention.cancel()
+    if SHARDED:
+        app.state.merger.cancel()
+    await writer.stop()
+    # Niêm phong log đang ghi để reader chỉ cần đọc segment
+    await asyncio.to_thread(store.seal)
+    if merger is not None:
+        # Gộp nốt các dòng vừa ghi vào shard trước khi nhả merger.lock
+        await asyncio.to_thread(merger.merge_once)
+    broker.close()
+    await asyncio.to_thread(flush_aggregates)
+    if SHARDED:
+        if merged_store is not None:
+            await asyncio.to_thread(merged_store.seal)
+            app.state.merger_lock.release()
+        app.state.shard_lock.release()
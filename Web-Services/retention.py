@@ -0,0 +1,127 @@
+import os
+import time
+
+import pandas as pd
+
+from metrics import REGISTRY
+from query_engine import data_bounds
+from segment_store import DATE_FORMAT
+
+# Retention: giữ dòng thô trong một cửa sổ gần đây, dữ liệu cũ hơn chỉ còn ở rollup (giờ/ngày/tháng
+# theo country, stockCode) và sketch top-K theo ngày. Mốc thời gian là invoiceDate mới nhất trong store
+# (không phải đồng hồ hệ thống), để dữ liệu phát lại từ quá khứ vẫn được giữ đúng cửa sổ.
+# Số ngày = 0 nghĩa là không xoá mức đó.
+
+RETENTION_INTERVAL = float(os.environ.get("RETENTION_INTERVAL", 300))        # Giây giữa hai lần chạy
+RAW_RETENTION_DAYS = float(os.environ.get("RETENTION_RAW_DAYS", 0))          # Dòng thô (segment)
+MINUTE_RETENTION_DAYS = float(os.environ.get("RETENTION_MINUTE_DAYS", 0))    # Rollup theo phút
+HOUR_RETENTION_DAYS = float(os.environ.get("RETENTION_HOUR_DAYS", 0))        # Rollup và sketch theo giờ
+
+RECLAIMED_BYTES = REGISTRY.counter(
+    "retail_retention_reclaimed_bytes_total", "Số byte retention đã giải phóng", ("kind",)
+)
+DROPPED_ROWS = REGISTRY.counter("retail_retention_dropped_rows_total", "Số dòng thô retention đã xoá")
+
+
+class RetentionPolicy:
+    """
+    Áp dụng retention cho store chính và các bảng tổng hợp của nó (chạy trong tiến trình sở hữu chúng).
+    Dòng thô chỉ bị xoá khi đã có trong rollup và sketch đã lưu xuống đĩa.
+    """
+
+    def __init__(self, root, raw_days=RAW_RETENTION_DAYS, minute_days=MINUTE_RETENTION_DAYS,
+                 hour_days=HOUR_RETENTION_DAYS):
+        self.root = root
+        self.raw_days = raw_days
+        self.minute_days = minute_days
+        self.hour_days = hour_days
+        self.last_reports = {}  # "store" / "shard" -> báo cáo lần chạy gần nhất
+        self.totals = {"runs": 0, "rows_dropped": 0, "bytes_reclaimed": 0}
+
+    @property
+    def enabled(self):
+        return bool(self.raw_days or self.minute_days or self.hour_days)
+
+    def cutoff(self, latest, days):
+        return latest - pd.Timedelta(days=days) if days else None
+
+    def run(self, store, rollups, heavy_hitters):
+        """
+        Một lần dọn dẹp; gọi sau khi rollups/heavy_hitters đã flush và không song song với flush.
+        Trả về báo cáo (số dòng/file đã xoá, số byte giải phóng theo loại).
+        """
+        started = time.perf_counter()
+        bounds = data_bounds(self.root)
+        report = {
+            "latest": None, "raw_before": None, "segments_dropped": 0, "rows_dropped": 0,
+            "rollup_files_dropped": 0, "sketch_files_dropped": 0, "bytes_reclaimed": {},
+        }
+        if bounds is None:
+            return report
+        latest = bounds[1]
+        report["latest"] = latest.strftime(DATE_FORMAT)
+        reclaimed = report["bytes_reclaimed"]
+
+        raw_before = self.cutoff(latest, self.raw_days)
+        if raw_before is not None:
+            report["raw_before"] = raw_before.strftime(DATE_FORMAT)
+            # Chỉ xoá các dòng mà cả rollup lẫn sketch đã tổng hợp và lưu
+            applied = min(rollups.position, heavy_hitters.position)
+            segments, rows, size = store.drop_prefix(before=raw_before, max_position=applied)
+            report["segments_dropped"] = segments
+            report["rows_dropped"] = rows
+            reclaimed["raw"] = size
+
+        minute_before = self.cutoff(latest, self.minute_days)
+        if minute_before is not None:
+            files, size = rollups.prune("minute", minute_before)
+            report["rollup_files_dropped"] += files
+            reclaimed["rollup_minute"] = size
+
+        hour_before = self.cutoff(latest, self.hour_days)
+        if hour_before is not None:
+            files, size = rollups.prune("hour", hour_before)
+            report["rollup_files_dropped"] += files
+            reclaimed["rollup_hour"] = size
+            files, size = heavy_hitters.prune("hour", hour_before)
+            report["sketch_files_dropped"] += files
+            reclaimed["sketch_hour"] = size
+
+        for kind, size in reclaimed.items():
+            if size:
+                RECLAIMED_BYTES.inc(size, kind=kind)
+        DROPPED_ROWS.inc(report["rows_dropped"])
+        report["seconds"] = round(time.perf_counter() - started, 3)
+        self.record("store", report)
+        return report
+
+    def trim_shard(self, store, merged_position):
+        """
+        Chế độ sharded: xoá các segment của shard đã được gộp hết vào store chính.
+        """
+        segments, rows, size = store.drop_prefix(max_position=merged_position)
+        if size:
+            RECLAIMED_BYTES.inc(size, kind="shard")
+        report = {"segments_dropped": segments, "rows_dropped": rows, "bytes_reclaimed": {"shard": size}}
+        self.record("shard", report)
+        return report
+
+    def record(self, kind, report):
+        self.last_reports[kind] = report
+        self.totals["runs"] += 1
+        self.totals["rows_dropped"] += report["rows_dropped"]
+        self.totals["bytes_reclaimed"] += sum(report["bytes_reclaimed"].values())
+        if report["rows_dropped"] or any(report["bytes_reclaimed"].values()):
+            freed = sum(report["bytes_reclaimed"].values()) / 2 ** 20
+            print(f"🧹 Retention: xoá {report['rows_dropped']:,} dòng thô, giải phóng {freed:,.1f} MB")
+
+    def status(self):
+        return {
+            "enabled": self.enabled,
+            "raw_days": self.raw_days,
+            "minute_days": self.minute_days,
+            "hour_days": self.hour_days,
+            "interval": RETENTION_INTERVAL,
+            "last_reports": self.last_reports,
+            "totals": self.totals,
+        }
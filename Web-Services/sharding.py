@@ -0,0 +1,141 @@
+import os
+import threading
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from segment_store import SCHEMA, read_from_position, store_dir
+
+# Ingest nhiều tiến trình (uvicorn --workers N, INGEST_MODE=sharded):
+#   shards/shard-00/segments/...  -> store riêng của từng worker (mỗi thư mục chỉ một tiến trình ghi)
+#   shards/shard-00.lock          -> khoá file giữ bởi worker đang dùng shard
+#   shards/merger.lock            -> khoá của tiến trình gộp (chỉ một tiến trình giữ)
+# Tiến trình gộp đọc các dòng đã commit của từng shard, trộn theo invoiceDate rồi ghi vào store chính
+# cùng với vị trí đã gộp của từng shard (manifest["shards"]) trong một lần cập nhật manifest,
+# nên mọi reader của store chính luôn thấy một snapshot nhất quán: đúng một tiền tố của mỗi shard.
+
+SHARD_DIR_NAME = "shards"
+MAX_SHARDS = int(os.environ.get("INGEST_MAX_SHARDS", 64))
+MERGE_INTERVAL = float(os.environ.get("SHARD_MERGE_INTERVAL", 0.5))   # Giây giữa hai lần gộp khi không có dòng mới
+MERGE_MAX_ROWS = int(os.environ.get("SHARD_MERGE_MAX_ROWS", 200_000))  # Số dòng tối đa lấy từ mỗi shard mỗi lần
+
+
+def shards_dir(root):
+    return os.path.join(root, SHARD_DIR_NAME)
+
+
+def shard_root(root, name):
+    return os.path.join(shards_dir(root), name)
+
+
+def list_shards(root):
+    try:
+        names = os.listdir(shards_dir(root))
+    except FileNotFoundError:
+        return []
+    return sorted(name for name in names if os.path.isdir(store_dir(shard_root(root, name))))
+
+
+class FileLock:
+    """
+    Khoá file độc quyền không chờ; hệ điều hành tự nhả khi tiến trình giữ khoá kết thúc.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def try_acquire(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        f = open(self.path, "a+")
+        try:
+            if os.name == "nt":
+                import msvcrt
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        self.file = f
+        return True
+
+    def release(self):
+        if self.file is not None:
+            self.file.close()  # Đóng file là nhả khoá
+            self.file = None
+
+
+def claim_shard(root, max_shards=MAX_SHARDS):
+    """
+    Chọn shard trống đầu tiên (dùng lại shard của worker đã dừng). Trả về (tên shard, khoá).
+    """
+    for i in range(max_shards):
+        name = f"shard-{i:02d}"
+        lock = FileLock(os.path.join(shards_dir(root), name + ".lock"))
+        if lock.try_acquire():
+            os.makedirs(shard_root(root, name), exist_ok=True)
+            return name, lock
+    raise RuntimeError(f"Đã dùng hết {max_shards} shard, tăng INGEST_MAX_SHARDS")
+
+
+def merger_lock(root):
+    return FileLock(os.path.join(shards_dir(root), "merger.lock"))
+
+
+class ShardMerger:
+    """
+    Gộp các shard vào store chính (store: SegmentStore của thư mục gốc, chỉ tiến trình giữ merger.lock mở).
+    listeners(DataFrame đã có kiểu, vị trí dòng đầu) được gọi sau mỗi lần gộp, như listener của writer.
+    """
+
+    def __init__(self, root, store, listeners=()):
+        self.root = root
+        self.store = store
+        self.listeners = list(listeners)
+        self.lock = threading.Lock()  # Một lần gộp tại một thời điểm (vòng gộp và lần gộp khi dừng)
+        self.rows_merged = 0
+
+    def positions(self):
+        # Số thứ tự (số dòng đã gộp) của từng shard, ghi trong manifest của store chính
+        return dict(self.store.manifest.get("shards", {}))
+
+    def merge_once(self, max_rows=MERGE_MAX_ROWS):
+        """
+        Gộp các dòng mới của mọi shard: nối rồi sắp xếp ổn định theo invoiceDate
+        (trộn k đường các phần mới, cùng thời điểm thì giữ thứ tự shard và thứ tự ghi).
+        Trả về số dòng đã gộp.
+        """
+        with self.lock:
+            return self._merge_locked(max_rows)
+
+    def _merge_locked(self, max_rows):
+        positions = self.positions()
+        updated = dict(positions)
+        tables = []
+        for name in list_shards(self.root):
+            start = positions.get(name, 0)
+            table = read_from_position(shard_root(self.root, name), start)
+            if not table.num_rows:
+                continue
+            table = table.slice(0, max_rows)
+            tables.append(table.cast(SCHEMA))
+            updated[name] = start + table.num_rows
+        if not tables:
+            return 0
+
+        table = pa.concat_tables(tables).unify_dictionaries().combine_chunks()
+        table = table.take(pc.sort_indices(table, sort_keys=[("invoiceDate", "ascending")]))
+        position = self.store.append_table(table, manifest_updates={"shards": updated})
+        self.rows_merged += table.num_rows
+
+        if self.listeners:
+            typed = table.to_pandas()
+            for listener in self.listeners:
+                try:
+                    listener(typed, position)
+                except Exception as e:
+                    print("❌ Lỗi cập nhật sau khi gộp shard:", e)
+        return table.num_rows
@@ -0,0 +1,92 @@
+import json
+import os
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from segment_store import READ_RETRIES, log_path, read_manifest, segment_path
+
+BLOCK_SIZE = 64 * 1024
+
+
+def iter_lines_reversed(path, block_size=BLOCK_SIZE):
+    """
+    Đọc file từ cuối lên theo từng khối, trả về các dòng theo thứ tự mới nhất trước.
+    """
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return
+    with f:
+        pos = f.seek(0, os.SEEK_END)
+        remainder = b""
+        while pos > 0:
+            size = min(block_size, pos)
+            pos -= size
+            f.seek(pos)
+            lines = (f.read(size) + remainder).split(b"\n")
+            remainder = lines.pop(0)  # Có thể là nửa dòng, ghép với khối phía trước
+            for line in reversed(lines):
+                if line.strip():
+                    yield line
+        if remainder.strip():
+            yield remainder
+
+
+def tail_log(path, n, since=None):
+    points = []
+    for line in iter_lines_reversed(path):
+        try:
+            record = json.loads(line)
+            date = pd.Timestamp(record["invoiceDate"])
+            quantity = record["quantity"]
+        except (ValueError, KeyError, TypeError):
+            continue  # Dòng đang ghi dở hoặc lỗi
+        if since is not None and date < since:
+            return points, True
+        points.append((date, quantity))
+        if len(points) >= n:
+            return points, True
+    return points, False
+
+
+def tail_segment(root, segment, n, since=None):
+    # Đọc ngược từng row group, chỉ hai cột cần thiết
+    points = []
+    parquet_file = pq.ParquetFile(segment_path(root, segment["file"]))
+    for index in reversed(range(parquet_file.num_row_groups)):
+        df = parquet_file.read_row_group(index, columns=["invoiceDate", "quantity"]).to_pandas()
+        for date, quantity in zip(df["invoiceDate"].iloc[::-1], df["quantity"].iloc[::-1]):
+            if pd.isna(date):
+                continue
+            if since is not None and date < since:
+                return points, True
+            points.append((date, int(quantity)))
+            if len(points) >= n:
+                return points, True
+    return points, False
+
+
+def read_tail(root, n=20, since=None):
+    """
+    Lấy n điểm (invoiceDate, quantity) mới nhất mà không quét toàn bộ dữ liệu:
+    đọc ngược log đang ghi, thiếu thì đọc ngược các segment mới nhất.
+    Trả về danh sách theo thứ tự thời gian tăng dần.
+    """
+    since = pd.Timestamp(since) if since is not None else None
+    for _ in range(READ_RETRIES):
+        manifest = read_manifest(root)
+        try:
+            points, done = tail_log(log_path(root, manifest["active_log"]), n, since)
+            for segment in reversed(manifest["segments"]):
+                if done:
+                    break
+                if since is not None and segment.get("max_date") and pd.Timestamp(segment["max_date"]) < since:
+                    break
+                more, done = tail_segment(root, segment, n - len(points), since)
+                points.extend(more)
+        except (FileNotFoundError, OSError):
+            continue  # Segment vừa bị compaction xoá -> đọc lại manifest
+        if read_manifest(root)["version"] == manifest["version"]:
+            return points[::-1]
+    raise RuntimeError("Không đọc được phần đuôi dữ liệu ổn định")
@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Web"))
+
+from query_engine import parse_bucket, rollup_granularity  # noqa: E402
+
+
+@pytest.mark.parametrize("bucket, days, expected", [
+    ("1D", 400, "day"),
+    ("D", 400, "day"),
+    ("24h", 400, "day"),
+    ("8h", 400, "hour"),
+    ("MS", 400, "day"),
+    ("MS", 1000, "month"),
+    ("W", 400, "day"),
+])
+def test_rollup_granularity_long_window(bucket, days, expected):
+    # Cửa sổ dài: bucket ghép được từ rollup thô hơn thì không đọc rollup phút
+    assert rollup_granularity(parse_bucket(bucket), pd.Timedelta(days=days)) == expected
+
+
+@pytest.mark.parametrize("bucket, start, expected", [
+    ("1h", None, "hour"),
+    ("30min", None, "hour"),
+    ("30min", "2011-01-10 08:00", "minute"),
+    ("30min", "2011-01-01 08:00", "hour"),
+    ("1D", "2011-01-01", "hour"),
+])
+def test_rollup_granularity_skips_pruned_levels(bucket, start, expected):
+    # Rollup phút đã bị retention xoá trước 2011-01-05: cửa sổ bắt đầu trước mốc không đọc rollup phút
+    retained = {"minute": pd.Timestamp("2011-01-05")}
+    start = pd.Timestamp(start) if start is not None else None
+    assert rollup_granularity(parse_bucket(bucket), pd.Timedelta(hours=4), start, retained) == expected
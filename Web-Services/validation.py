@@ -0,0 +1,158 @@
+import io
+import json
+import os
+
+import pandas as pd
+
+from frame_schema import FLOAT32_EXACT_CENTS, INT32_RANGE
+
+# Các trường bắt buộc
+REQUIRED_FIELDS = ["description", "quantity", "invoiceDate"]
+DEFAULT_CUSTOMER_ID = "unknown CustomerID"
+
+# Số dòng NDJSON gom lại trước khi kiểm tra theo cột và chuyển cho writer
+BULK_CHUNK_ROWS = 5000
+# Độ dài tối đa một dòng NDJSON (byte, đủ cho một khối dạng cột cỡ vài chục nghìn bản ghi)
+BULK_MAX_LINE_BYTES = int(os.environ.get("INGEST_BULK_MAX_LINE_BYTES", 16 << 20))
+
+
+class LineTooLongError(Exception):
+    pass
+
+
+def validate_frame(df):
+    """
+    Kiểm tra cả lô theo cột thay vì gọi float()/all() cho từng bản ghi.
+    Trả về (DataFrame hợp lệ, số bản ghi bị bỏ qua).
+    """
+    if df.empty:
+        return df, 0
+    if any(field not in df.columns for field in REQUIRED_FIELDS):
+        return df.iloc[0:0], len(df)
+
+    mask = pd.Series(True, index=df.index)
+    for field in REQUIRED_FIELDS:
+        values = df[field]
+        mask &= values.notna() & (values != "")
+
+    # Số lượng phải là số và không âm; số lượng và đơn giá phải vừa kiểu gọn của frame trong bộ nhớ
+    # (quantity int32, unitPrice float32 còn đúng tới xu)
+    quantity = pd.to_numeric(df["quantity"], errors="coerce")
+    mask &= quantity.notna() & (quantity >= 0) & (quantity <= INT32_RANGE[1])
+    if "unitPrice" in df.columns:
+        price = pd.to_numeric(df["unitPrice"], errors="coerce")
+        mask &= price.isna() | (price.abs() < FLOAT32_EXACT_CENTS)
+
+    valid = df[mask]
+    if not valid.empty:
+        # ⚙️ Nếu customerID bị thiếu hoặc null, gán giá trị mặc định
+        if "customerID" in valid.columns:
+            customer = valid["customerID"]
+            missing = customer.isna() | (customer == "")
+            if missing.any():
+                valid = valid.assign(customerID=customer.where(~missing, DEFAULT_CUSTOMER_ID))
+        else:
+            valid = valid.assign(customerID=DEFAULT_CUSTOMER_ID)
+    return valid, len(df) - len(valid)
+
+
+def records_to_frame(data):
+    if isinstance(data, list):
+        if not all(isinstance(record, dict) for record in data):
+            return None
+        return pd.DataFrame(data)
+    if isinstance(data, dict):
+        return pd.DataFrame([data])
+    return None
+
+
+def parse_ndjson_records(lines):
+    """
+    Mỗi dòng là một bản ghi. Trả về (DataFrame, số bản ghi bị loại, số dòng không đọc được).
+    """
+    if not lines:
+        return pd.DataFrame(), 0, 0
+    try:
+        # Đọc cả khối dòng bằng parser C của pandas, giữ nguyên chuỗi (không tự đổi kiểu/ngày)
+        return pd.read_json(io.BytesIO(b"\n".join(lines)), lines=True, dtype=False, convert_dates=False), 0, 0
+    except (ValueError, TypeError):
+        pass
+    # Có dòng hỏng: đọc lại từng dòng, chỉ bỏ các dòng hỏng
+    records = []
+    invalid = 0
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            invalid += 1
+            continue
+        if isinstance(record, dict):
+            records.append(record)
+        else:
+            invalid += 1
+    return pd.DataFrame(records), invalid, invalid
+
+
+def parse_ndjson_columns(lines):
+    """
+    Mỗi dòng là một khối dạng cột: {"quantity": [...], "invoiceDate": [...], ...}.
+    Khối hỏng bị loại cả khối. Trả về (DataFrame, số bản ghi bị loại, số dòng không đọc được);
+    khối không phải JSON thì không biết số bản ghi, chỉ được đếm vào số dòng không đọc được.
+    """
+    frames = []
+    skipped = 0
+    invalid = 0
+    for line in lines:
+        try:
+            block = json.loads(line)
+        except ValueError:
+            invalid += 1
+            continue
+        if not isinstance(block, dict):
+            invalid += 1
+            continue
+        try:
+            frames.append(pd.DataFrame(block))
+        except (ValueError, TypeError):
+            # Các cột dài khác nhau hoặc toàn giá trị vô hướng: số bản ghi lấy theo cột dài nhất
+            invalid += 1
+            skipped += max((len(v) for v in block.values() if isinstance(v, list)), default=0)
+    if not frames:
+        return pd.DataFrame(), skipped, invalid
+    return pd.concat(frames, ignore_index=True), skipped, invalid
+
+
+async def iter_ndjson_chunks(stream, chunk_rows=BULK_CHUNK_ROWS, max_line_bytes=BULK_MAX_LINE_BYTES):
+    """
+    Cắt body đang stream thành từng khối tối đa chunk_rows dòng, không giữ cả body trong bộ nhớ.
+    Mỗi chunk chỉ được tách một lần; dòng dở dang giữ dạng danh sách mảnh và chỉ nối khi gặp "\n".
+    LineTooLongError nếu một dòng dài quá max_line_bytes.
+    """
+    fragments = []  # Các mảnh của dòng chưa kết thúc
+    fragment_bytes = 0
+    lines = []
+    async for chunk in stream:
+        parts = chunk.split(b"\n")
+        if len(parts) > 1:
+            if fragments:
+                parts[0] = b"".join(fragments) + parts[0]
+            tail = parts.pop()
+            fragments, fragment_bytes = [tail], len(tail)
+            for line in parts:
+                if len(line) > max_line_bytes:
+                    raise LineTooLongError(f"Dòng NDJSON dài quá {max_line_bytes} byte")
+                if line.strip():
+                    lines.append(line)
+        else:
+            fragments.append(chunk)
+            fragment_bytes += len(chunk)
+        if fragment_bytes > max_line_bytes:
+            raise LineTooLongError(f"Dòng NDJSON dài quá {max_line_bytes} byte")
+        while len(lines) >= chunk_rows:
+            yield lines[:chunk_rows]
+            del lines[:chunk_rows]
+    pending = b"".join(fragments)
+    if pending.strip():
+        lines.append(pending)
+    if lines:
+        yield lines
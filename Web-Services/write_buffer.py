@@ -0,0 +1,125 @@
+import asyncio
+import json
+import os
+
+import pandas as pd
+
+from segment_store import frame_to_table
+from metrics import stage
+
+# Cấu hình group commit
+QUEUE_MAX_BATCHES = int(os.environ.get("INGEST_QUEUE_MAX_BATCHES", 1000))  # Số lô tối đa đang chờ ghi
+GROUP_MAX_ROWS = int(os.environ.get("INGEST_GROUP_MAX_ROWS", 20_000))      # Ghi ngay khi nhóm đủ số dòng
+GROUP_MAX_DELAY = float(os.environ.get("INGEST_GROUP_MAX_DELAY", 0.05))    # ... hoặc sau tối đa bấy nhiêu giây
+ENQUEUE_TIMEOUT = float(os.environ.get("INGEST_ENQUEUE_TIMEOUT", 5))       # Hết thời gian chờ chỗ trống -> báo bận
+
+
+class WriterBusyError(Exception):
+    pass
+
+
+def encode_batch(batch):
+    # Lô có thể là list bản ghi (/ingest) hoặc DataFrame đã kiểm tra theo cột (/ingest/bulk)
+    if isinstance(batch, pd.DataFrame):
+        return batch.to_json(orient="records", lines=True, force_ascii=False).rstrip("\n") + "\n"
+    return "".join(json.dumps(record) + "\n" for record in batch)
+
+
+def group_frame(group):
+    frames = [batch if isinstance(batch, pd.DataFrame) else pd.DataFrame(batch) for batch, _ in group]
+    return pd.concat(frames, ignore_index=True)
+
+
+class GroupCommitWriter:
+    """
+    Một task duy nhất sở hữu file log: nhận các lô đã kiểm tra qua asyncio.Queue,
+    gom thành nhóm theo ngưỡng số dòng/thời gian và ghi mỗi nhóm với một lần fsync.
+    """
+
+    def __init__(self, store, listeners=(), max_batches=QUEUE_MAX_BATCHES, max_rows=GROUP_MAX_ROWS,
+                 max_delay=GROUP_MAX_DELAY):
+        self.store = store
+        # Hàm nhận (DataFrame đã có kiểu, vị trí dòng đầu) sau mỗi nhóm ghi thành công
+        self.listeners = list(listeners)
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.queue = asyncio.Queue(maxsize=max_batches)
+        self.task = None
+        self.groups_written = 0
+        self.rows_written = 0
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        # Ghi nốt các lô còn trong hàng đợi rồi mới dừng
+        await self.queue.join()
+        self.task.cancel()
+        await asyncio.to_thread(self.store.close)
+
+    async def submit(self, records, wait_durable=True):
+        """
+        Đưa một lô vào hàng đợi. Khi hàng đợi đầy sẽ chờ (backpressure) tối đa
+        ENQUEUE_TIMEOUT giây. Nếu wait_durable, chờ tới khi nhóm chứa lô đã fsync.
+        """
+        future = asyncio.get_running_loop().create_future() if wait_durable else None
+        try:
+            await asyncio.wait_for(self.queue.put((records, future)), ENQUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise WriterBusyError("Hàng đợi ghi đang đầy")
+        if future is not None:
+            await future
+        return len(records)
+
+    async def next_group(self):
+        loop = asyncio.get_running_loop()
+        group = [await self.queue.get()]
+        rows = len(group[0][0])
+        deadline = loop.time() + self.max_delay
+
+        while rows < self.max_rows:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            group.append(item)
+            rows += len(item[0])
+        return group
+
+    def write_group(self, group):
+        with stage("ingest", "writer", "encode"):
+            text = "".join(encode_batch(batch) for batch, _ in group)
+        rows = sum(len(batch) for batch, _ in group)
+        with stage("ingest", "writer", "log_append"):
+            position = self.store.append_lines(text, rows)
+        if self.listeners:
+            with stage("ingest", "writer", "aggregate"):
+                typed = frame_to_table(group_frame(group)).to_pandas()
+                for listener in self.listeners:
+                    try:
+                        listener(typed, position)
+                    except Exception as e:
+                        print("❌ Lỗi cập nhật sau khi ghi:", e)
+        return rows
+
+    async def run(self):
+        while True:
+            group = await self.next_group()
+            try:
+                rows = await asyncio.to_thread(self.write_group, group)
+                self.groups_written += 1
+                self.rows_written += rows
+                for _, future in group:
+                    if future is not None and not future.done():
+                        future.set_result(None)
+            except Exception as e:
+                print("❌ Lỗi ghi nhóm:", e)
+                for _, future in group:
+                    if future is not None and not future.done():
+                        future.set_exception(e)
+            finally:
+                for _ in group:
+                    self.queue.task_done()